@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+u"""
+batch_loader.py
+
+Prefetching batch loader for the DataGenerator classes in
+data_generation.py and data_generation_weights.py.
+
+A pool of thread or process workers fills a fixed set of preallocated
+batch buffers and hands them over through a bounded queue, so the files
+of the next batches are read while the model trains on the current one.
+Queue-depth and wait-time counters show whether training is input-bound.
+
+Usage:
+	loader = PrefetchLoader(training_generator, workers=4, queue_size=8)
+	model.fit_generator(generator=iter(loader), steps_per_epoch=len(loader),
+		workers=0, epochs=n_epochs)
+	print(loader.summary())
+	loader.close()
+
+NOTE: the yielded arrays are reused for later batches, so the loader has
+to be consumed directly by keras (workers=0) and not through another queue.
+Batches are yielded in the order they finish loading. With process workers
+the last batches of an epoch may be interleaved with the first of the next.
+"""
+import time
+import queue
+import threading
+import traceback
+import multiprocessing
+import numpy as np
+
+#-- worker process: fill shared-memory buffers for each (index,slot,epoch) task
+def _process_worker(sequence, tasks, ready, raw, shapes):
+	buffers = [[np.frombuffer(r,dtype=dtype).reshape(shape)
+		for r,(shape,dtype) in zip(rs,shapes)] for rs in raw]
+	epoch = 0
+	while True:
+		task = tasks.get()
+		if task is None:
+			break
+		index,slot,task_epoch = task
+		#-- each worker has its own copy of the sequence. Since the shuffling
+		#-- is seeded, calling on_epoch_end the same number of times gives
+		#-- every copy the same order of samples
+		while epoch < task_epoch:
+			sequence.on_epoch_end()
+			epoch += 1
+		t0 = time.time()
+		try:
+			sequence.load_batch(index, out=buffers[slot])
+		except Exception:
+			ready.put((index,slot,0.,traceback.format_exc()))
+		else:
+			ready.put((index,slot,time.time()-t0,None))
+
+class PrefetchLoader(object):
+	'Prefetches batches of a keras Sequence into reused buffers'
+	def __init__(self, sequence, workers=4, queue_size=8, mode='thread'):
+		if mode not in ('thread','process'):
+			raise ValueError('mode must be "thread" or "process", got %s'%mode)
+		self.sequence = sequence
+		self.workers = workers
+		self.queue_size = queue_size
+		self.mode = mode
+		#-- one buffer set for every queued batch, every worker and the consumer
+		self.n_slots = queue_size + workers + 1
+		self.shapes = sequence.batch_shapes()
+		self.stats = {'batches':0,'wait_time':0.,'load_time':0.,
+			'queue_depth':0,'empty_waits':0}
+		self._started = False
+		self._stop = threading.Event()
+
+	def __len__(self):
+		return len(self.sequence)
+
+	def start(self):
+		'Allocate the buffers and start the workers'
+		if self._started:
+			return
+		self._started = True
+		self._free = queue.Queue()
+		for slot in range(self.n_slots):
+			self._free.put(slot)
+		if self.mode == 'thread':
+			self._buffers = [[np.empty(shape,dtype=dtype) for shape,dtype in self.shapes]
+				for slot in range(self.n_slots)]
+			self._tasks = queue.Queue()
+			self._ready = queue.Queue()
+			self._pending = 0
+			self._cond = threading.Condition()
+			self._workers = [threading.Thread(target=self._thread_worker,daemon=True)
+				for i in range(self.workers)]
+		else:
+			raw = [[multiprocessing.RawArray('b',int(np.prod(shape))*np.dtype(dtype).itemsize)
+				for shape,dtype in self.shapes] for slot in range(self.n_slots)]
+			self._buffers = [[np.frombuffer(r,dtype=dtype).reshape(shape)
+				for r,(shape,dtype) in zip(rs,self.shapes)] for rs in raw]
+			self._tasks = multiprocessing.Queue()
+			self._ready = multiprocessing.Queue()
+			self._workers = [multiprocessing.Process(target=_process_worker,
+				args=(self.sequence,self._tasks,self._ready,raw,self.shapes),daemon=True)
+				for i in range(self.workers)]
+		for w in self._workers:
+			w.start()
+		self._dispatcher = threading.Thread(target=self._dispatch,daemon=True)
+		self._dispatcher.start()
+
+	def _thread_worker(self):
+		while True:
+			task = self._tasks.get()
+			if task is None:
+				break
+			index,slot,epoch = task
+			t0 = time.time()
+			try:
+				self.sequence.load_batch(index, out=self._buffers[slot])
+			except Exception:
+				self._ready.put((index,slot,0.,traceback.format_exc()))
+			else:
+				self._ready.put((index,slot,time.time()-t0,None))
+			with self._cond:
+				self._pending -= 1
+				self._cond.notify_all()
+
+	def _dispatch(self):
+		#-- hand out batch indices for as long as the loader is running
+		#-- a task is only sent once a free buffer is available
+		epoch = 0
+		while not self._stop.is_set():
+			if (epoch > 0) and (self.mode == 'thread'):
+				#-- wait for the last batches of the epoch before reshuffling
+				with self._cond:
+					while (self._pending > 0) and not self._stop.is_set():
+						self._cond.wait(timeout=0.1)
+				self.sequence.on_epoch_end()
+			for index in range(len(self.sequence)):
+				slot = self._free.get()
+				if (slot is None) or self._stop.is_set():
+					return
+				if self.mode == 'thread':
+					with self._cond:
+						self._pending += 1
+				self._tasks.put((index,slot,epoch))
+			epoch += 1
+
+	def __iter__(self):
+		self.start()
+		last = None
+		while True:
+			#-- the previous batch has been used, so its buffers can be refilled
+			if last is not None:
+				self._free.put(last)
+			try:
+				depth = self._ready.qsize()
+			except NotImplementedError:
+				depth = 0
+			t0 = time.time()
+			index,slot,load_time,err = self._ready.get()
+			self.stats['wait_time'] += time.time() - t0
+			self.stats['load_time'] += load_time
+			self.stats['queue_depth'] += depth
+			self.stats['empty_waits'] += (depth == 0)
+			self.stats['batches'] += 1
+			if err is not None:
+				#-- stop the workers before passing on the error
+				self.close()
+				raise RuntimeError('Loading batch %i failed:\n%s'%(index,err))
+			last = slot
+			yield tuple(self._buffers[slot])
+
+	def summary(self):
+		'Summary of the loader counters'
+		n = max(self.stats['batches'],1)
+		return ('batches: {0:d}, mean wait: {1:.4f}s, mean load: {2:.4f}s, '
+			'mean queue depth: {3:.2f}, empty queue: {4:.1f}%').format(
+			self.stats['batches'],self.stats['wait_time']/n,self.stats['load_time']/n,
+			self.stats['queue_depth']/n,100.*self.stats['empty_waits']/n)
+
+	def close(self):
+		'Stop the dispatcher and the workers'
+		if not self._started:
+			return
+		self._stop.set()
+		self._free.put(None)
+		#-- no more tasks are sent once the dispatcher has stopped
+		self._dispatcher.join(timeout=5)
+		for w in self._workers:
+			self._tasks.put(None)
+		for w in self._workers:
+			w.join(timeout=5)
+		if self.mode == 'process':
+			for w in self._workers:
+				if w.is_alive():
+					w.terminate()
+					w.join()
+					self._tasks.cancel_join_thread()
+			#-- close the queues and their feeder threads
+			self._tasks.close()
+			self._ready.close()
+			self._tasks.join_thread()
+			self._ready.join_thread()
+		self._started = False
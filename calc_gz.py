@@ -5,6 +5,9 @@ by Yara Mohajerani (12/2020)
 
 Calculate the width of the grounding zone by drawing an intersecting 
 line in the direction of flow based on the velocity field
+
+All the transects are built and intersected with the GZ polygons in
+batches (gz_transects.py)
 """
 from logging import warn
 import os
@@ -14,7 +17,9 @@ import pathlib
 import random
 import numpy as np
 import geopandas as gpd
-import netCDF4 as nc
+import gl_catalog
+import velocity_sampler
+import gz_transects
 from numpy.core.defchararray import isdigit
 from shapely.geometry import Point,MultiPoint,LineString,Polygon,MultiPolygon
 from shapely import ops
@@ -24,8 +29,6 @@ from shapely.geometry.multipolygon import MultiPolygon
 
 #-- function to calculate the GZ width
 def calc_gz(GL_FILE='',BASIN_FILE='',VEL_FILE='',region='',dist=0,N=0):
-	#-- read the grounding lines
-	gdf = gpd.read_file(GL_FILE)
 	#-- read the basin file
 	basins = gpd.read_file(BASIN_FILE)
 	idx = basins.index[basins['NAME']==region]
@@ -34,6 +37,8 @@ def calc_gz(GL_FILE='',BASIN_FILE='',VEL_FILE='',region='',dist=0,N=0):
 
 	#-- add a 5km buffer to find the corresponding GLs
 	region_poly = poly.buffer(5e3)
+	#-- read the grounding lines (only the ones in the bounds of the region)
+	gdf = gl_catalog.read_catalog(GL_FILE,bbox=region_poly.bounds)
 
 	lines = []
 	for i in range(len(gdf)):
@@ -80,17 +85,6 @@ def calc_gz(GL_FILE='',BASIN_FILE='',VEL_FILE='',region='',dist=0,N=0):
 		out_gdf = gpd.GeoDataFrame(df,geometry=out_geo,crs=gdf.crs)
 		out_gdf.to_file(gz_file,driver='ESRI Shapefile')
 
-	#-- read velocity field
-	vel_fid = nc.Dataset(VEL_FILE,'r')
-	x = vel_fid['x'][:]
-	y = vel_fid['y'][:]
-	vx = vel_fid['VX'][:]
-	vy = vel_fid['VY'][:]
-	#-- also read lat and lon
-	# vel_lat = vel_fid['lat'][:]
-	# vel_lon = vel_fid['lon'][:]
-	vel_fid.close()
-	
 	#-- select the points for the calculation of GZ width
 	#-- in order to generate points, we randomly draw a line from the
 	#-- mutliline, and then draw a random distance to go along the line to get
@@ -110,102 +104,85 @@ def calc_gz(GL_FILE='',BASIN_FILE='',VEL_FILE='',region='',dist=0,N=0):
 		xx,yy = rand_pt.coords.xy
 		xlist[i] = float(xx[0])
 		ylist[i] = float(yy[0])
-	
-	#-- loop through points and calculate GZ
-	for i,(xi,yi) in enumerate(zip(xlist,ylist)):
-		if i%100 == 0:
-			print(i)
-		
-		#-- A) velocity based approach
-		#-- get list of distances to get a list of closest points
-		#- For a given coordinate, get the flow angle and then the intersecting line
-		ii = np.argsort(np.abs(x - xi))
-		jj = np.argsort(np.abs(y - yi))
 
-		#-- loop through the first 20 points and get the minimum width, so we dont
-		#-- rely on a single point
-		tmp_trans = {}
-		tmp_dist = np.zeros(25)
-		cc = 0
-		for k in range(5):
-			for w in range(5):
-				#-- find flow angle
-				ang = np.arctan(vy[jj[w],ii[k]]/vx[jj[w],ii[k]])
-				#-- Now constuct a line of a given length, centered at the 
-				#-- chosen coordinates, with the angle above
-				dx,dy = dist*np.cos(ang),dist*np.sin(ang)
-				tmp_trans[cc] = LineString([[x[ii[k]]-dx,y[jj[w]]-dy],[x[ii[k]],y[jj[w]]],[x[ii[k]]+dx,y[jj[w]]+dy]])
-				
-				if tmp_trans[cc].intersects(gz_poly):
-					vel_int = tmp_trans[cc].intersection(gz_poly)
-					tmp_dist[cc] = vel_int.length
-				else:
-					print("No intersection. i={0:d}, k={1:d}, w={2:d}".format(i,k,w))
-				cc += 1
+	#-- read the velocity field around the points
+	vel = velocity_sampler.VelocitySampler(VEL_FILE)
+	x = vel.x
+	y = vel.y
+	#-- get the 5 closest grid columns and rows of each point and
+	#-- the flow angles at all their combinations
+	iis,jjs = vel.neighbours(xlist,ylist,k=5)
+	vxs,vys = vel.velocity(iis[:,:,None],jjs[:,None,:])
+	angs = velocity_sampler.flow_angle(vxs,vys)
 
-		ind_min = np.argmin(tmp_dist)	
-		vel_transects[i] = tmp_trans[ind_min]
-		gz[i] = tmp_dist[ind_min]
+	#-- polygons of the GZ and the transect engine to intersect them
+	if gz_poly.geom_type == 'Polygon':
+		print("GZ object is polygon.")
+		gz_polys = [gz_poly]
+	elif gz_poly.geom_type == 'MultiPolygon':
+		gz_polys = list(gz_poly.geoms)
+	else:
+		sys.exit("Exiting. GZ object type: ",gz_poly.geom_type)
+	engine = gz_transects.TransectEngine(gz_polys)
 
-		
-		# vel_int = vel_transects[i].intersection(gz_poly)
-		# gz[i] = vel_int.length
+	#-- A) velocity based approach
+	#-- For the 5x5 closest grid points of each point, constuct a line of a given
+	#-- length, centered at the grid point, with the flow angle there. Take the
+	#-- minimum width, so we dont rely on a single point
+	xc = np.broadcast_to(np.asarray(x)[iis][:,:,None],(N,5,5))
+	yc = np.broadcast_to(np.asarray(y)[jjs][:,None,:],(N,5,5))
+	vel_coords = gz_transects.transect_coords(xc,yc,np.ma.filled(angs,np.nan),dist).reshape(N,25,3,2)
+	vel_dist,vel_count,vel_first = [v.reshape(N,25) for v in engine.intersect(vel_coords)]
+	for i,cc in zip(*np.nonzero((vel_count == 0) & ~np.isnan(vel_dist))):
+		print("No intersection. i={0:d}, k={1:d}, w={2:d}".format(i,cc//5,cc%5))
+	vel_min = gz_transects.shortest(vel_dist)
+	for i in range(N):
+		vel_transects[i] = LineString(vel_coords[i,vel_min[i]])
+		gz[i] = vel_dist[i,vel_min[i]]
 
-		#-- B) tangent based appriach
-		found_match = False
-		if gz_poly.geom_type == 'Polygon':
-			print("GZ object is polygon.")
-			if vel_transects[i].intersects(gz_poly):
-				x_ext,y_ext = gz_poly.exterior.coords.xy
-				found_match = True
-		elif gz_poly.geom_type == 'MultiPolygon':
-			for sp in gz_poly:
-				if vel_transects[i].intersects(sp):
-					if found_match:
-						print("More than one intersecting polygon found for point {0:d}".format(i))
-					else:
-						#-- get coordinates of the exterior of GZ polygon to be used later
-						x_ext,y_ext = sp.exterior.coords.xy
-						found_match = True
-		else:
-			sys.exit("Exiting. GZ object type: ",gz_poly.geom_type)
-		
+	#-- B) tangent based appriach
+	#-- Calculate GZ without velocity for comparison by constructing a perpendicular
+	#-- line to the first GZ polygon that the velocity transect intersects
+	perp_pts = []
+	perp_coords = []
+	exteriors = {}
+	for i,(xi,yi) in enumerate(zip(xlist,ylist)):
+		if i%100 == 0:
+			print(i)
+		match = vel_first[i,vel_min[i]]
+		if vel_count[i,vel_min[i]] > 1:
+			print("More than one intersecting polygon found for point {0:d}".format(i))
 		#-- Check if any of the polygons intersect
-		if not found_match:
+		if match < 0:
 			print("No matches found for point {0:d}".format(i))
-			#-- move on to the next point and skip rest of iteration
+			#-- move on to the next point
 			continue
-
-		#-- Calculate GZ without velocity for comparison by constructing a perpendicular
-		#-- line to the gz polygon at each point
+		#-- get coordinates of the exterior of GZ polygon
+		if match not in exteriors:
+			exteriors[match] = [np.asarray(v) for v in gz_polys[match].exterior.coords.xy]
+		x_ext,y_ext = exteriors[match]
 		#-- 1) to get the tangent, get the index of the closest point on the boundary
-		#-- of the gz polython
+		#-- of the gz polython (use the first few points so we dont rely on a single point)
 		dist2 = (x_ext - xi)**2 + (y_ext - yi)**2
-		# ind = np.argmin(dist2)
 		ind = np.argsort(dist2)
+		k = ind[:10]
+		km1 = ind[np.arange(10)-1]
+		#-- 2) calculate the slope of the tangent
+		tangent = (y_ext[k]-y_ext[km1])/(x_ext[k]-x_ext[km1])
+		#-- 3) calculate slope of perpendicular line
+		slope_ang = np.arctan(-1/tangent)
+		#-- 4) construct new transects
+		perp_pts.append(i)
+		perp_coords.append(gz_transects.transect_coords(x_ext[k],y_ext[k],slope_ang,dist))
 
-		#-- loop through the first few points and get the minimum width, so we dont
-		#-- rely on a single point
-		tmp_trans = {}
-		tmp_dist = np.zeros(10)
-		for k in range(10):
-			#-- 2) calculate the slope of the tangent
-			tangent = (y_ext[ind[k]]-y_ext[ind[k-1]])/(x_ext[ind[k]]-x_ext[ind[k-1]])
-
-			#-- 3) calculate slope of perpendicular line
-			slope_ang = np.arctan(-1/tangent)
-
-			#-- 4) construct new transect and calculate width
-			dx,dy = dist*np.cos(slope_ang),dist*np.sin(slope_ang)
-			tmp_trans[k] = LineString([[x_ext[ind[k]]-dx,y_ext[ind[k]]-dy],[x_ext[ind[k]],y_ext[ind[k]]],[x_ext[ind[k]]+dx,y_ext[ind[k]]+dy]])
-
-			perp_int = tmp_trans[k].intersection(gz_poly)
-			tmp_dist[k] = perp_int.length
-
-		ind_min = np.argmin(tmp_dist)
-		perp_transects[i] = tmp_trans[ind_min]
-		gz[i] = tmp_dist[ind_min]
-		
+	#-- calculate the widths of the perpendicular transects
+	if len(perp_pts) > 0:
+		perp_coords = np.array(perp_coords)
+		perp_dist = engine.intersect(perp_coords)[0].reshape(-1,10)
+		perp_min = gz_transects.shortest(perp_dist)
+		for n,i in enumerate(perp_pts):
+			perp_transects[i] = LineString(perp_coords[n,perp_min[n]])
+			gz[i] = perp_dist[n,perp_min[n]]
 
 	#-- write grounding zone widths to file
 	outfile = os.path.join(os.path.dirname(GL_FILE),'GZ_widths_{0}.csv'.format(region))
@@ -7,6 +7,10 @@ Calculate the width of the grounding zone by drawing an intersecting
 line in the direction of flow based on the velocity field in areas of 
 fast flow, and retrieve widths from centerline calculation in QGIS
 for areas of slow flow.
+
+With --BILINEAR the velocity is bilinearly interpolated at each point
+(and the transect centered on the point) instead of taking the closest
+point of the velocity grid
 """
 import os
 import sys
@@ -15,17 +19,32 @@ import pathlib
 import random
 import numpy as np
 import geopandas as gpd
-import netCDF4 as nc
+import gl_catalog
+import velocity_sampler
+from spatial_index import GeometryIndex
 from copy import copy
 from shapely.geometry import Point,MultiPoint,LineString,MultiLineString,Polygon,MultiPolygon
 from shapely import ops
 from descartes import PolygonPatch
 import matplotlib.pyplot as plt
 
+#-- dates of the grounding lines within tol of the ends of a transect: the
+#-- first date is from a line at pt1 and the second from a line at pt0
+#-- (the last such line in the order of the lines)
+def match_dates(index, lines, dates, pt0, pt1, date1, date2, tol=0.2):
+	if pt0.is_empty or pt1.is_empty:
+		candidates = range(len(lines))
+	else:
+		candidates = np.union1d(index.near(pt1,tol),index.near(pt0,tol))
+	for l in candidates:
+		if lines[l].distance(pt1) < tol:
+			date1 = dates[l]
+		elif lines[l].distance(pt0) < tol:
+			date2 = dates[l]
+	return date1,date2
+
 #-- function to calculate the GZ width
-def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',region='',dist=0,N=0,vel_thr=0):
-	#-- read the grounding lines
-	df_gl = gpd.read_file(GL_FILE)
+def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',region='',dist=0,N=0,vel_thr=0,bilinear=False):
 	#-- read widths
 	df_w = gpd.read_file(WIDTH_FILE)
 	#-- read the basin file
@@ -36,6 +55,8 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 
 	#-- add a 5km buffer to find the corresponding GLs
 	region_poly = poly.buffer(5e3)
+	#-- read the grounding lines (only the ones in the bounds of the region)
+	df_gl = gl_catalog.read_catalog(GL_FILE,bbox=region_poly.bounds,columns=['FILENAME'])
 
 	lines = []
 	dates = []
@@ -51,6 +72,9 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 	for i in range(len(df_w)):
 		ws.append(df_w['geometry'][i])
 	widths = MultiLineString(ws)
+	#-- spatial indices of the width lines and grounding lines
+	widths_index = GeometryIndex(ws)
+	lines_index = GeometryIndex(lines)
 	
 	#-- merge all lines into linestring
 	lm = ops.linemerge(lines)
@@ -90,17 +114,6 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 		out_gdf = gpd.GeoDataFrame(df,geometry=out_geo,crs=df_gl.crs)
 		out_gdf.to_file(gz_file,driver='ESRI Shapefile')
 
-	#-- read velocity field
-	vel_fid = nc.Dataset(VEL_FILE,'r')
-	x = vel_fid['x'][:]
-	y = vel_fid['y'][:]
-	vx = vel_fid['VX'][:]
-	vy = vel_fid['VY'][:]
-	#-- also read lat and lon
-	# vel_lat = vel_fid['lat'][:]
-	# vel_lon = vel_fid['lon'][:]
-	vel_fid.close()
-	
 	#-- select the points for the calculation of GZ width
 	#-- in order to generate points, we randomly draw a line from the
 	#-- mutliline, and then draw a random distance to go along the line to get
@@ -135,7 +148,23 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 		xx,yy = rand_pt.coords.xy
 		xlist[i] = float(xx[0])
 		ylist[i] = float(yy[0])
-	
+
+	#-- read the velocity field around the points and get the velocity
+	#-- of the closest grid point (or bilinearly interpolated) of each point
+	vel = velocity_sampler.VelocitySampler(VEL_FILE)
+	if bilinear:
+		x = xlist
+		y = ylist
+		iis = jjs = np.arange(N)
+		vxs,vys = vel.bilinear(xlist,ylist)
+	else:
+		x = vel.x
+		y = vel.y
+		iis,jjs = vel.nearest(xlist,ylist)
+		vxs,vys = vel.velocity(iis,jjs)
+	vel_mags = np.sqrt(vys**2 + vxs**2)
+	angs = velocity_sampler.flow_angle(vxs,vys)
+
 	#-- make special polygons that require a different transect length
 	plong = Polygon([[-1175399.2293594137,-1124281.6845298712],
 					[-1166026.3695500833,-1132757.1428680948],
@@ -149,14 +178,14 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 		#-- A) velocity based approach
 		#-- get list of distances to get a list of closest points
 		#- For a given coordinate, get the flow angle and then the intersecting line
-		ii = np.argmin(np.abs(x - xi))
-		jj = np.argmin(np.abs(y - yi))
+		ii = iis[i]
+		jj = jjs[i]
 
 		#-- chech if velocity is above required threshold
-		vel_mag = np.sqrt(vy[jj,ii]**2 + vx[jj,ii]**2)
+		vel_mag = vel_mags[i]
 		if vel_mag > vel_thr:
 			#-- find flow angle
-			ang = np.arctan(vy[jj,ii]/vx[jj,ii])
+			ang = angs[i]
 			#-- Now constuct a line of a given length, centered at the 
 			#-- chosen coordinates, with the angle above
 			if Point(xi,yi).within(plong):
@@ -171,19 +200,12 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 			#-- get dates
 			pt0 = vel_int.interpolate(0,normalized=True)
 			pt1 = vel_int.interpolate(1,normalized=True)
-			for l in range(len(lines)):
-				if lines[l].distance(pt1) < 0.2:
-					date1_list[i] = dates[l]
-				elif lines[l].distance(pt0) < 0.2:
-					date2_list[i] = dates[l]
+			date1_list[i],date2_list[i] = match_dates(lines_index,lines,dates,pt0,pt1,
+				date1_list[i],date2_list[i])
 		else:
 			#-- B) retrieve width from QGIS centerline width calculation
 			#-- first get the closest line to the point
-			po = Point(xi,yi)
-			wdist = np.zeros(len(widths))
-			for wi in range(len(widths)):
-				wdist[wi] = widths[wi].distance(po)
-			ind_w = np.argmin(wdist)
+			ind_w = widths_index.nearest(Point(xi,yi))
 
 			cn_transects[i] = widths[ind_w]
 			#-- get length
@@ -191,11 +213,8 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 			#-- also get the corresponding dates
 			pt0 = cn_transects[i].interpolate(0,normalized=True)
 			pt1 = cn_transects[i].interpolate(1,normalized=True)
-			for l in range(len(lines)):
-				if lines[l].distance(pt1) < 0.2:
-					date1_list[i] = dates[l]
-				elif lines[l].distance(pt0) < 0.2:
-					date2_list[i] = dates[l]
+			date1_list[i],date2_list[i] = match_dates(lines_index,lines,dates,pt0,pt1,
+				date1_list[i],date2_list[i])
 
 	#-- write grounding zone widths to file
 	outfile = os.path.join(os.path.dirname(GL_FILE),'GZ_widths-hybrid_{0}.csv'.format(region))
@@ -255,7 +274,7 @@ def calc_gz(GL_FILE='',WIDTH_FILE='',BASIN_FILE='',VEL_FILE='',POINT_FILE='',reg
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['GL_FILE=','BASIN_FILE=','VEL_FILE=','POINT_FILE','REGION=','DIST=','NUMBER=','THRESHOLD']
+	long_options=['GL_FILE=','BASIN_FILE=','VEL_FILE=','POINT_FILE','REGION=','DIST=','NUMBER=','THRESHOLD','BILINEAR']
 	optlist,arglist = getopt.getopt(sys.argv[1:],'G:B:V:P:R:D:N:T:',long_options)
 
 	GL_FILE = os.path.join(pathlib.Path.home(),'GL_learning_data',\
@@ -272,6 +291,7 @@ def main():
 	dist = 10e3
 	N = 500
 	vel_thr = 300
+	bilinear = False
 	for opt, arg in optlist:
 		if opt in ("-G","--GL_FILE"):
 			GL_FILE = os.path.expanduser(arg)
@@ -291,10 +311,12 @@ def main():
 			N = int(arg)
 		elif opt in ("-T","--THRESHOLD"):
 			vel_thr = float(arg)
+		elif opt == "--BILINEAR":
+			bilinear = True
 
 	#-- call the function to calculate the grounding zone width
 	calc_gz(GL_FILE=GL_FILE,WIDTH_FILE=WIDTH_FILE,BASIN_FILE=BASIN_FILE,\
-		VEL_FILE=VEL_FILE,POINT_FILE=POINT_FILE,region=region,dist=dist,N=N,vel_thr=vel_thr)
+		VEL_FILE=VEL_FILE,POINT_FILE=POINT_FILE,region=region,dist=dist,N=N,vel_thr=vel_thr,bilinear=bilinear)
 
 #-- run main program
 if __name__ == '__main__':
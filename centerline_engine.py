@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+u"""
+centerline_engine.py
+
+Get the centerlines of all the grounding line contours of a scene in a
+process pool, instead of running run_centerline.py as one Slurm job per
+contour and combining the outputs with combine_shapefiles.py.
+
+The input is the combined error file of a scene written by polygonize.py
+(<scene>_ERR.shp). Pinning contours are kept as pinning points and
+get_centerline is run on the 'GL Uncertainty' contours. Each contour has
+the same time limit as its Slurm job in polygonize.py (int(length/300)+10
+minutes); contours that time out or fail are reported and left out.
+The contours are run by --NPROC persistent worker processes. The parent
+process keeps track of the time limits, and a worker that is still
+running a contour at its time limit is terminated and replaced, since
+the GEOS and qhull calls of get_centerline can't be interrupted from
+within.
+The centerlines are written to a single file per scene (<scene>.shp)
+with the same fields as the combined run_centerline.py outputs.
+
+--BACKEND=skeleton uses the skeleton of the rasterized polygon
+(skeleton_centerline.py) instead of the Voronoi-based get_centerline.
+--BENCHMARK runs both backends on every contour and reports their run
+times and the distances between the two centerlines instead of writing
+the output.
+
+python centerline_engine.py --NPROC=<# of processes> <scene>_ERR.shp ...
+"""
+import os
+import sys
+import time
+import getopt
+import shutil
+import shapefile
+import numpy as np
+from multiprocessing import Process,Pipe
+from multiprocessing.connection import wait
+from shapely.geometry import Polygon,Point
+from label_centerlines import get_centerline
+from skeleton_centerline import get_skeleton_centerline
+
+#-- Voronoi-based centerline (as run_centerline.py)
+def voronoi_centerline(p):
+	return get_centerline(p,segmentize_maxlen=p.length/10,max_points=p.length/80)
+
+#-- available centerline backends
+BACKENDS = {'voronoi':voronoi_centerline, 'skeleton':get_skeleton_centerline}
+
+#-- time limit of a contour in minutes (as the slurm jobs of polygonize.py)
+def time_limit(length):
+	return int(length/300)+10
+
+#-- length of the closed ring of contour coordinates (the polygon perimeter)
+def ring_length(coords):
+	c = np.asarray(coords,dtype=float)[:,:2]
+	return np.sum(np.hypot(*(np.roll(c,-1,axis=0)-c).T))
+
+#-- get the centerline of one contour
+#-- returns the index, the centerline coordinates (None if failed) and error
+def centerline_job(job):
+	idx,coords,backend = job
+	try:
+		line = BACKENDS[backend](Polygon(coords))
+		return idx,[list(a) for a in line.coords],None
+	except Exception as e:
+		return idx,None,repr(e)
+
+#-- result of a centerline job that failed outside of centerline_job
+def centerline_failed(idx, err):
+	return idx,None,err
+
+#-- run both backends on one contour
+#-- returns the index, the run times of the Voronoi and skeleton backends,
+#-- the mean distance of the skeleton centerline from the Voronoi
+#-- centerline, their Hausdorff distance and the error (None if successful)
+def benchmark_job(job):
+	idx,coords = job
+	try:
+		p = Polygon(coords)
+		t0 = time.time()
+		vor = voronoi_centerline(p)
+		t1 = time.time()
+		skel = get_skeleton_centerline(p)
+		t2 = time.time()
+		mean_dist = np.mean([vor.distance(Point(c)) for c in skel.coords])
+		return idx,t1-t0,t2-t1,mean_dist,vor.hausdorff_distance(skel),None
+	except Exception as e:
+		return idx,None,None,None,None,repr(e)
+
+#-- result of a benchmark job that failed outside of benchmark_job
+def benchmark_failed(idx, err):
+	return idx,None,None,None,None,err
+
+#-- worker process: run the jobs sent by the parent and send back their
+#-- results until the parent sends None
+def _worker(conn):
+	while True:
+		task = conn.recv()
+		if task is None:
+			break
+		func,job = task
+		conn.send(func(job))
+	conn.close()
+
+class Worker(object):
+	'Worker process of run_jobs and the job it is running'
+	def __init__(self):
+		self.conn,child = Pipe()
+		self.process = Process(target=_worker, args=(child,))
+		self.process.daemon = True
+		self.process.start()
+		child.close()
+		self.idx = None
+		self.minutes = None
+		self.deadline = None
+
+	def submit(self, func, job):
+		'Send a job (index, contour coordinates, ...) and start its time limit'
+		self.idx = job[0]
+		self.minutes = time_limit(ring_length(job[1]))
+		self.deadline = time.time() + 60*self.minutes
+		self.conn.send((func,job))
+
+	def done(self):
+		'Result of the job, or None if the worker died'
+		try:
+			res = self.conn.recv()
+		except EOFError:
+			return None
+		self.idx = None
+		return res
+
+	def close(self):
+		'Stop the worker once it is idle'
+		try:
+			self.conn.send(None)
+		except (OSError,EOFError):
+			pass
+		self.process.join()
+		self.conn.close()
+
+	def kill(self):
+		'Terminate the worker'
+		self.process.terminate()
+		self.process.join()
+		self.conn.close()
+
+#-- run jobs (index, contour coordinates, ...) in a pool of nproc persistent
+#-- worker processes. The time limit of each contour is enforced from this
+#-- process: a worker that is still running a job at its time limit is
+#-- terminated and replaced by a new worker. jobs can be any iterable, and
+#-- the next job is only taken when a worker is free.
+#-- yields the results as the jobs are done, and failed(index,error) for
+#-- the jobs that time out or whose worker dies
+def run_jobs(func, jobs, failed, nproc=1):
+	jobs = iter(jobs)
+	workers = [Worker() for _ in range(max(nproc,1))]
+	more = True
+	try:
+		while True:
+			#-- send jobs to the idle workers
+			for w in workers:
+				if more and (w.idx is None):
+					job = next(jobs, None)
+					if job is None:
+						more = False
+					else:
+						w.submit(func, job)
+			busy = [w for w in workers if w.idx is not None]
+			if not busy:
+				break
+			#-- wait for a job to finish or for the next time limit
+			timeout = max(min(w.deadline for w in busy)-time.time(),0)
+			ready = wait([w.conn for w in busy], timeout=timeout)
+			now = time.time()
+			for k,w in enumerate(workers):
+				if w.idx is None:
+					continue
+				if w.conn in ready:
+					res = w.done()
+					if res is None:
+						w.process.join()
+						res = failed(w.idx,'worker exited with code %s'%w.process.exitcode)
+						w.conn.close()
+						workers[k] = Worker()
+					yield res
+				elif w.deadline <= now:
+					idx,minutes = w.idx,w.minutes
+					w.kill()
+					workers[k] = Worker()
+					yield failed(idx,'timed out after %i minutes'%minutes)
+	finally:
+		for w in workers:
+			if w.idx is None:
+				w.close()
+			else:
+				w.kill()
+
+#-- read the contours of a scene error file
+#-- returns the field names, shapes and records as dictionaries
+def read_contours(er_file):
+	r = shapefile.Reader(er_file)
+	fields = [f[0] for f in r.fields[1:]]
+	shapes = r.shapes()
+	records = [dict(zip(fields,rec)) for rec in r.records()]
+	return fields,shapes,records
+
+#-- get the centerlines of all the contours of a scene and write them to
+#-- a single file
+def run_scene(er_file, nproc=1, backend='voronoi'):
+	fields,shapes,records = read_contours(er_file)
+	#-- pinning points are the contours themselves
+	lines = {}
+	jobs = []
+	for idx,(shp,rec) in enumerate(zip(shapes,records)):
+		if rec['Class'] == 'Pinning Contour':
+			lines[idx] = [list(a) for a in shp.points]
+		elif rec['Class'] == 'GL Uncertainty':
+			jobs.append((idx,shp.points,backend))
+	#-- run the longest contours first so they don't hold up the workers at the end
+	jobs.sort(key=lambda j: len(j[1]), reverse=True)
+	t0 = time.time()
+	failed = 0
+	for idx,coords,err in run_jobs(centerline_job, jobs, centerline_failed, nproc=nproc):
+		if coords is None:
+			print('%s contour %s: %s'%(os.path.basename(er_file),records[idx]['ID'],err))
+			failed += 1
+		else:
+			lines[idx] = coords
+
+	#-- write centerlines in the order of the contours
+	gl_file = er_file.replace('_ERR','')
+	w = shapefile.Writer(gl_file)
+	for f in fields:
+		w.field(f,'C')
+	for idx in sorted(lines.keys()):
+		rec = records[idx]
+		w.line([lines[idx]])
+		#-- remove 'err' from ID and set the centerline class
+		cls = 'Pinning Point' if (rec['Class'] == 'Pinning Contour') else 'Grounding Line'
+		rec = dict(rec, ID=rec['ID'].replace('err',''), Class=cls)
+		w.record(*[rec[f] for f in fields])
+	w.close()
+	#-- copy the .prj file
+	if os.path.exists(er_file.replace('.shp','.prj')):
+		shutil.copyfile(er_file.replace('.shp','.prj'),gl_file.replace('.shp','.prj'))
+	print('%s: %i centerlines, %i failed (%.1f s)'%(os.path.basename(gl_file),
+		len(lines),failed,time.time()-t0))
+	return gl_file
+
+#-- compare the skeleton and Voronoi backends on the contours of a scene
+#-- returns an array of (Voronoi time, skeleton time, mean distance,
+#-- Hausdorff distance) for each successful contour
+def benchmark_scene(er_file, nproc=1):
+	fields,shapes,records = read_contours(er_file)
+	jobs = [(idx,shp.points) for idx,(shp,rec) in enumerate(zip(shapes,records))
+		if (rec['Class'] == 'GL Uncertainty')]
+	jobs.sort(key=lambda j: len(j[1]), reverse=True)
+	stats = []
+	for idx,t_vor,t_skel,mean_dist,hausdorff,err in run_jobs(benchmark_job, jobs, benchmark_failed, nproc=nproc):
+		if err is not None:
+			print('%s contour %s: %s'%(os.path.basename(er_file),records[idx]['ID'],err))
+		else:
+			stats.append((t_vor,t_skel,mean_dist,hausdorff))
+	stats = np.array(stats).reshape(-1,4)
+	print_benchmark(os.path.basename(er_file), stats)
+	return stats
+
+#-- print the summary of a benchmark
+def print_benchmark(name, stats):
+	if len(stats) == 0:
+		print('%s: no contours'%name)
+		return
+	print('%s: %i contours, Voronoi %.1f s, skeleton %.1f s (%.1fx faster), '
+		'mean distance %.1f m (median %.1f m), max Hausdorff distance %.1f m'%(name,
+		len(stats),stats[:,0].sum(),stats[:,1].sum(),stats[:,0].sum()/max(stats[:,1].sum(),1e-9),
+		stats[:,2].mean(),np.median(stats[:,2]),stats[:,3].max()))
+
+#-- main function
+def main():
+	#-- Read the system arguments listed after the program
+	long_options=['NPROC=','BACKEND=','BENCHMARK']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'P:B:M',long_options)
+
+	#-- Set default settings
+	nproc = 1
+	backend = 'voronoi'
+	benchmark = False
+	for opt, arg in optlist:
+		if opt in ("-P","--NPROC"):
+			nproc = int(arg)
+		elif opt in ("-B","--BACKEND"):
+			backend = arg.lower()
+		elif opt in ("-M","--BENCHMARK"):
+			benchmark = True
+	if backend not in BACKENDS:
+		sys.exit('Unknown backend %s (%s)'%(backend,', '.join(sorted(BACKENDS.keys()))))
+
+	if len(arglist) == 0:
+		sys.exit('No input file given')
+	if benchmark:
+		stats = [benchmark_scene(os.path.expanduser(er_file), nproc=nproc)
+			for er_file in arglist]
+		if len(arglist) > 1:
+			print_benchmark('Total', np.concatenate(stats))
+	else:
+		for er_file in arglist:
+			run_scene(os.path.expanduser(er_file), nproc=nproc, backend=backend)
+
+#-- run main program
+if __name__ == '__main__':
+	main()
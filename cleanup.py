@@ -4,12 +4,58 @@ cleanup.py
 Yara Mohajerani (08/2020)
 
 Use a static coast line to clean up the GL shapefile
+The input can also be a GeoParquet or FlatGeobuf catalog (gl_catalog.py),
+which is written back in the same format
+
+Lines are kept if they intersect a mask polygon, using a spatial index of
+the (prepared) mask polygons. Several thresholds (comma-separated, in
+meters) are cleaned in a single pass over the lines: the polygons of all
+the masks (ais_mask_<threshold>km.shp) are in one spatial index, tagged
+with their threshold, and each line is only tested against the masks it
+hasn't been found to intersect yet. One file is written for each mask.
 """
 import os
 import sys
 import getopt
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import gl_catalog
+from shapely.prepared import prep
+from spatial_index import GeometryIndex
+
+#-- boolean arrays of the geometries that intersect any of the polygons of
+#-- each mask (a list of lists of polygons), in a single pass over the geometries
+def intersects_masks(geoms, masks):
+	mask_geoms = [g for m in masks for g in m]
+	tags = np.concatenate([np.full(len(m),k,dtype=np.int64) for k,m in enumerate(masks)]
+		+ [np.zeros(0,dtype=np.int64)])
+	index = GeometryIndex(mask_geoms)
+	prepared = {}
+	keep = np.zeros((len(masks),len(geoms)),dtype=bool)
+	for i,g in enumerate(geoms):
+		if i%10000 == 0:
+			print('%i/%i'%(i,len(geoms)))
+		if (g is None) or g.is_empty:
+			continue
+		found = 0
+		for j in index.query(g):
+			#-- as soon as one intersecting element of a mask is found, skip
+			#-- the rest of that mask, and stop once all masks are found
+			if keep[tags[j],i]:
+				continue
+			if j not in prepared:
+				prepared[j] = prep(mask_geoms[j])
+			if prepared[j].intersects(g):
+				keep[tags[j],i] = True
+				found += 1
+				if found == len(masks):
+					break
+	return keep
+
+#-- boolean array of the geometries that intersect any of the mask polygons
+def intersects_mask(geoms, mask_geoms):
+	return intersects_masks(geoms, [mask_geoms])[0]
 
 #-- main function
 def main():
@@ -18,47 +64,38 @@ def main():
 	optlist,arglist = getopt.getopt(sys.argv[1:],'T:M:I:',long_options)
 
 	#-- Set default settings
-	thresh = 15e3
+	thresholds = [15e3]
 	MASK_DIR = '/DFS-L/DATA/gl_ml/auxiliary/'
 	INFILE = '/DFS-L/DATA/gl_ml/SENTINEL1_2018/combined_AllTracks.shp'
 	for opt, arg in optlist:
 		if opt in ("-T","--THRESHOLD"):
-			thresh = int(arg)
+			thresholds = [int(t) for t in arg.split(',')]
 		elif opt in ("-M","--MASK_DIR"):
 			MASK_DIR = os.path.expanduser(arg)
 		elif opt in ("-I","--INFILE"):
 			INFILE = os.path.expanduser(arg)
-	
-	#-- read mask file
-	mask = gpd.read_file(os.path.join(MASK_DIR,'ais_mask_%ikm.shp'%(thresh/1e3)))
 
 	#-- read GLS
-	gls = gpd.read_file(INFILE)
+	gls = gl_catalog.read_catalog(INFILE)
+	geoms = list(gls['geometry'])
+
+	#-- read mask files
+	masks = [list(gpd.read_file(os.path.join(MASK_DIR,'ais_mask_%ikm.shp'%(thresh/1e3)))['geometry'])
+		for thresh in thresholds]
 
-	#-- now go through and get list of GLs to delete
-	n = len(mask)
-	remove_ind = []
-	for i in range(len(gls)):
-		if i%1000 == 0:
-			print('%i/%i'%(i,len(gls)))
-		#-- start assuming GL is noise
-		rm = True
-		j = 0
-		#-- as soon as one intersecting element is found, stop and move on.
-		while rm and j < n:
-			if mask['geometry'][j].intersects(gls['geometry'][i]):
-				rm = False
-			j += 1
-		if rm:
-			remove_ind.append(i)
+	#-- get the lines that intersect each mask
+	keep = intersects_masks(geoms, masks)
 
-	print("deleting %i lines"%len(remove_ind))
+	base,ext = os.path.splitext(INFILE.rstrip('/'))
+	for k,thresh in enumerate(thresholds):
+		print("%ikm: deleting %i lines"%(thresh/1e3,np.count_nonzero(~keep[k])))
 
-	#-- remove extra elements
-	gls_out = gls.drop(remove_ind)
+		#-- remove extra elements
+		gls_out = gls[keep[k]]
 
-	#-- save to file
-	gls_out.to_file(INFILE.replace('.shp','_cleaned_%ikm.shp'%(thresh/1e3)),driver='ESRI Shapefile')
+		#-- save to file
+		gl_catalog.write_catalog(gls_out,'%s_cleaned_%ikm%s'%(base,thresh/1e3,ext),
+			fmt=gl_catalog.catalog_format(INFILE))
 
 #-- run main program
 if __name__ == '__main__':
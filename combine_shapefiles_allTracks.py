@@ -4,25 +4,65 @@ combine_shapfiles.py
 Yara Mohajerani (08/2020)
 
 Combine all individual shapefiles for all tracks into 1 file
+
+With --FORMAT=parquet or --FORMAT=fgb the combined lines are written as a
+catalog partitioned by track and month instead (see gl_catalog.py)
+
+The scene files are read in parallel with --NPROC processes. With
+--INCREMENTAL only the scenes that are new or changed since the last merge
+(modification time and size, or MD5 checksum with --HASH, recorded in
+<output>.state.json) are read and merged into the existing output, and
+the lines of deleted scenes are removed.
 """
 import os
 import sys
+import json
 import getopt
+import hashlib
 import pandas as pd
 import geopandas as gpd
+import gl_catalog
 from rasterio.crs import CRS
+from multiprocessing import Pool
+
+#-- read a scene file without the noise (lines without an ID)
+def read_scene(path):
+	g = gpd.read_file(path)
+	g = g[g['ID'].notnull().values].copy()
+	#-- also add file name to attribute table
+	g['FILENAME'] = os.path.basename(path)
+	return g
+
+#-- modification time and size (and MD5 checksum of the shapefile and its
+#-- attributes with use_hash) of a scene file
+def file_state(path, use_hash=False):
+	st = os.stat(path)
+	state = {'mtime':st.st_mtime,'size':st.st_size}
+	if use_hash:
+		md5 = hashlib.md5()
+		for f in [path,path.replace('.shp','.dbf')]:
+			if os.path.exists(f):
+				with open(f,'rb') as fid:
+					for chunk in iter(lambda: fid.read(1<<20), b''):
+						md5.update(chunk)
+		state['md5'] = md5.hexdigest()
+	return state
 
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['DIR=','FILTER=','MODEL=','ERROR']
-	optlist,arglist = getopt.getopt(sys.argv[1:],'D:F:M:E',long_options)
+	long_options=['DIR=','FILTER=','MODEL=','ERROR','FORMAT=','NPROC=','INCREMENTAL','HASH']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'D:F:M:EP:IH',long_options)
 
 	#-- Set default settings
 	ddir = '/DFS-L/DATA/gl_ml/SENTINEL1_2018/'
 	model_str = 'atrous_32init_drop0.2_customLossR727'
 	FILTER = 8000
 	error = False
+	fmt = 'shp'
+	nproc = 1
+	incremental = False
+	use_hash = False
 	for opt, arg in optlist:
 		if opt in ("-D","--DIR"):
 			ddir = os.path.expanduser(arg)
@@ -33,50 +73,84 @@ def main():
 			model_str = arg
 		elif opt in ("-E","--ERROR"):
 			error = True
+		elif opt == "--FORMAT":
+			fmt = arg.lower()
+		elif opt in ("-P","--NPROC"):
+			nproc = int(arg)
+		elif opt in ("-I","--INCREMENTAL"):
+			incremental = True
+		elif opt in ("-H","--HASH"):
+			use_hash = True
+	if fmt not in ['shp','parquet','fgb']:
+		sys.exit('Unknown format %s (shp, parquet or fgb)'%fmt)
 	flt_str = '_%.1fkm'%(FILTER/1000)
 
 	#-- get list of all folders (tracks)
 	folderList = os.listdir(ddir)
 	folder_list = [f for f in folderList if os.path.isdir(os.path.join(ddir,f))]
 	print(folder_list)
-	#-- initialize list to be converted to geopandas dataframe
-	gdf = []
+	#-- output file
+	if error:
+		suffix = ''
+	else:
+		suffix = '_centerLines'
+	out_file = os.path.join(ddir,'combined_AllTracks%s%s'%(suffix,gl_catalog.EXTENSIONS[fmt]))
+	state_file = '%s.state.json'%out_file
+	#-- get list of all scene files
+	file_list = []
 	for d in folder_list:
-		#-- get list of files
-		fileList = os.listdir(os.path.join(ddir,d,'%s.dir'%model_str,'stitched.dir','shapefiles.dir'))
+		sdir = os.path.join(ddir,d,'%s.dir'%model_str,'stitched.dir','shapefiles.dir')
+		#-- skip other directories (e.g. partitioned outputs)
+		if not os.path.isdir(sdir):
+			continue
+		fileList = os.listdir(sdir)
 		if error:
-			file_list = [f for f in fileList if (f.endswith('%s_ERR.shp'%flt_str))]
+			sub_list = [f for f in fileList if (f.endswith('%s_ERR.shp'%flt_str))]
 		else:
-			file_list = [f for f in fileList if (f.endswith('%s.shp'%flt_str))]
+			sub_list = [f for f in fileList if (f.endswith('%s.shp'%flt_str))]
+		print(d,len(sub_list))
+		file_list += [os.path.join(sdir,f) for f in sub_list]
+	states = {f:file_state(f,use_hash=use_hash) for f in file_list}
+
+	#-- with INCREMENTAL, only read the scenes that are new or changed
+	#-- and replace the lines of changed and deleted scenes
+	old_states = None
+	if incremental and os.path.exists(out_file) and os.path.exists(state_file):
+		with open(state_file,'r') as fid:
+			old_states = json.load(fid)
+	if old_states is not None:
+		read_list = [f for f in file_list if (f not in old_states) or any(
+			old_states[f].get(k) != v for k,v in states[f].items())]
+		replace = [os.path.basename(f) for f in old_states.keys()
+			if (f not in states) or (f in read_list)]
+		print('%i new or changed scenes, %i scenes to replace'%(len(read_list),len(replace)))
+	else:
+		read_list = file_list
 
-		print(d,len(file_list))
-		for f in file_list:
-			#-- read file
-			g = gpd.read_file(os.path.join(ddir,d,'%s.dir'%model_str,'stitched.dir','shapefiles.dir',f))
-			#-- remove rows corresponding to noise
-			ind_remove = []
-			for i in range(len(g)):
-				if g['ID'][i] == None:
-					ind_remove.append(i)
-			g = g.drop(ind_remove)
-			#-- also add file name to attribute table
-			g['FILENAME'] = [f]*len(g['ID'])
-			#-- add to main dataframe list
-			gdf.append(g)
+	#-- read the scene files in parallel
+	if nproc > 1:
+		pool = Pool(processes=nproc)
+		gdf = pool.map(read_scene, read_list, chunksize=4)
+		pool.close()
+		pool.join()
+	else:
+		gdf = [read_scene(f) for f in read_list]
 
-	#print(g.crs)
-	#-- get projection to save file (same for all files, so just read last one)
-	#crs_wkt = CRS.from_dict(g.crs).to_wkt()
-	#crs_wkt = CRS.from_dict(init='epsg:3031').to_wkt()
-	#print(crs_wkt)
-	#-- concatenate dataframes
-	combined = gpd.GeoDataFrame(pd.concat(gdf))
 	#-- save to file
-	if error:
-		suffix = ''
+	if old_states is not None:
+		if (len(read_list) > 0) or (len(replace) > 0):
+			if len(gdf) > 0:
+				combined = gpd.GeoDataFrame(pd.concat(gdf))
+			else:
+				combined = gpd.GeoDataFrame(columns=['ID','FILENAME','geometry'])
+			gl_catalog.update_catalog(combined,out_file,replace=replace,fmt=fmt)
 	else:
-		suffix = '_centerLines'
-	combined.to_file(os.path.join(ddir,'combined_AllTracks%s.shp'%suffix),driver='ESRI Shapefile')#,crs_wkt=crs_wkt)
+		#-- concatenate dataframes
+		combined = gpd.GeoDataFrame(pd.concat(gdf))
+		gl_catalog.write_catalog(combined,out_file,fmt=fmt)
+	#-- record the merged scenes
+	with open(state_file,'w') as fid:
+		json.dump(states,fid)
 
 #-- run main program
 if __name__ == '__main__':
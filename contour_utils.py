@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+u"""
+contour_utils.py
+
+Shared helpers for classifying the contours of the predictions in
+polygonize.py, postprocess_scene.py, convert_shapefile.py and
+convert_shapefile_centerline.py.
+"""
+import numpy as np
+from skimage.measure import find_contours
+from shapely.geometry import Polygon
+from shapely.prepared import prep
+from spatial_index import GeometryIndex
+
+#-- all (i,j) pairs where polygon i contains polygon j, sorted by i then j
+#-- candidates are found with an STRtree and filtered by their bounding
+#-- boxes before the (prepared) containment test
+def containment_pairs(pols):
+	index = GeometryIndex(pols)
+	pairs = []
+	for i in index.valid:
+		minx,miny,maxx,maxy = pols[i].bounds
+		outer = None
+		for j in index.query(pols[i]):
+			if j == i:
+				continue
+			#-- the envelope of j has to be inside the envelope of i
+			bminx,bminy,bmaxx,bmaxy = pols[j].bounds
+			if (bminx < minx) or (bminy < miny) or (bmaxx > maxx) or (bmaxy > maxy):
+				continue
+			if outer is None:
+				outer = prep(pols[i])
+			if outer.contains(pols[j]):
+				pairs.append((int(i),int(j)))
+	return pairs
+
+#-- threshold for getting contours
+EPS = 0.3
+
+#-- flag bits of the contour records
+NONE = 1 #-- too few vertices for a polygon
+NOISE = 2
+IGNORE = 4
+PIN = 8
+OUTER = 16
+INNER = 32
+LOOP = 64
+
+#-- class codes of the contours and their names in the output files
+CLASS_NAMES = ['','Noise','Ignored Contour','Pinning Contour','GL Uncertainty',
+	'Outer Contour','Inner Contour']
+(NO_CLASS,NOISE_CLASS,IGNORED_CLASS,PIN_CLASS,GL_CLASS,OUTER_CLASS,
+	INNER_CLASS) = range(len(CLASS_NAMES))
+
+#-- compact record of each contour: number of vertices, flag bits, class code,
+#-- type (True for test data), and perimeter and width of the polygon
+RECORD = np.dtype([('n',np.int64),('flags',np.uint8),('code',np.uint8),
+	('test',np.bool_),('length',np.float64),('width',np.float64)])
+
+#-- records of a list of contours
+def new_records(contours):
+	rec = np.zeros(len(contours),dtype=RECORD)
+	rec['n'] = [len(c) for c in contours]
+	return rec
+
+#-- boolean array of the contours with a flag set
+def has_flag(rec, flag):
+	return (rec['flags'] & flag) != 0
+
+#-- set a flag for the contours selected by a boolean array or indices
+def set_flag(rec, select, flag):
+	rec['flags'][select] |= flag
+
+#-- start of the vertices of each contour in the concatenated arrays
+#-- (with the total number of vertices as last element)
+def contour_offsets(rec):
+	offsets = np.zeros(len(rec)+1,dtype=np.int64)
+	np.cumsum(rec['n'],out=offsets[1:])
+	return offsets
+
+#-- sums of a per-vertex array for each contour
+def sum_contours(values, offsets):
+	out = np.zeros(len(offsets)-1,dtype=values.dtype)
+	full, = np.nonzero(offsets[1:] > offsets[:-1])
+	if len(full):
+		out[full] = np.add.reduceat(values, offsets[full])
+	return out
+
+#-- perimeter and area of the closed polygon and length of the open line
+#-- of each contour, from the concatenated vertex coordinates
+def measure_contours(x, y, offsets):
+	n = np.diff(offsets)
+	first = np.repeat(offsets[:-1],n)
+	#-- index of the next vertex around each ring
+	nxt = np.arange(len(x)) + 1
+	last = offsets[1:][n > 0] - 1
+	nxt[last] = offsets[:-1][n > 0]
+	#-- use coordinates relative to the first vertex for the area
+	xr = x - x[first]
+	yr = y - y[first]
+	dx = x[nxt] - x
+	dy = y[nxt] - y
+	seg = np.sqrt(dx*dx + dy*dy)
+	perimeter = sum_contours(seg, offsets)
+	area = 0.5*np.abs(sum_contours(xr*yr[nxt] - xr[nxt]*yr, offsets))
+	line_length = perimeter.copy()
+	line_length[n > 0] -= seg[last]
+	return perimeter,area,line_length
+
+#-- contours that are mostly on test tiles of the mask
+def test_contours(mask, contour_rc, offsets):
+	rows = np.round(contour_rc[:,0]).astype('int')
+	cols = np.round(contour_rc[:,1]).astype('int')
+	count = sum_contours((mask[rows,cols] != 0).astype(np.int64), offsets)
+	return count > np.diff(offsets)/2.
+
+#-- classify the contours of a scene as in polygonize.py from their polygons
+#-- (None for fewer than 3 vertices), perimeters, areas and line lengths:
+#-- contours wider than 1/25 of their length are pinning contours, contours
+#-- inside another are ignored (the outer one if both are pinning contours)
+#-- and the remaining lines not longer than FILTER are noise
+def classify_contours(rec, pols, perimeter, area, line_length, FILTER=0.):
+	none = rec['n'] < 3
+	set_flag(rec, none, NONE)
+	valid = ~none
+	rec['length'][valid] = perimeter[valid]
+	rec['width'][valid] = area[valid]/perimeter[valid]
+	set_flag(rec, valid & (rec['width'] > rec['length']/25), PIN)
+	pin = has_flag(rec, PIN)
+	for i,j in containment_pairs(pols):
+		set_flag(rec, i if (pin[i] and pin[j]) else j, IGNORE)
+	ignore = has_flag(rec, IGNORE)
+	set_flag(rec, valid & (~ignore) & (line_length <= FILTER), NOISE)
+	#-- class codes
+	rec['code'][:] = GL_CLASS
+	rec['code'][pin] = PIN_CLASS
+	rec['code'][ignore] = IGNORED_CLASS
+	rec['code'][none | has_flag(rec,NOISE)] = NOISE_CLASS
+	return rec
+
+#-- concatenated (row,col) vertices of a list of contours
+def concat_contours(contours):
+	if len(contours) == 0:
+		return np.zeros((0,2))
+	return np.concatenate(contours)
+
+#-- map coordinates of all contour vertices with one affine transform
+#-- (pixel centers, as rasterio.transform.xy with offset='center')
+def transform_contours(trans, contour_rc):
+	a,b,c,d,e,f = tuple(trans)[:6]
+	cols = np.asarray(contour_rc)[:,1] + 0.5
+	rows = np.asarray(contour_rc)[:,0] + 0.5
+	return cols*a + rows*b + c, cols*d + rows*e + f
+
+#-- split concatenated coordinates into an (n,2) array for each contour
+def split_contours(x, y, offsets):
+	xy = np.column_stack((x,y))
+	return [xy[offsets[n]:offsets[n+1]] for n in range(len(offsets)-1)]
+
+#-- contours of a probability raster and their classification
+#-- returns the records, the coordinates of each contour and the labels
+def scene_contours(im, trans, mask=None, FILTER=0., eps=EPS):
+	#-- close contour ends to make polygons
+	im[np.nonzero(im[:,0] > eps),0] = eps
+	im[np.nonzero(im[:,-1] > eps),-1] = eps
+	im[0,np.nonzero(im[0,:] > eps)] = eps
+	im[-1,np.nonzero(im[-1,:] > eps)] = eps
+	contours = find_contours(im, eps)
+	rec = new_records(contours)
+	offsets = contour_offsets(rec)
+	contour_rc = concat_contours(contours)
+	#-- convert all vertices to coordinates at once
+	xs,ys = transform_contours(trans, contour_rc)
+	xy = split_contours(xs, ys, offsets)
+	pols = [Polygon(xy[n]) if (rec['n'][n] >= 3) else None for n in range(len(xy))]
+	#-- train or test contours
+	if mask is not None:
+		rec['test'] = test_contours(mask, contour_rc, offsets)
+	else:
+		rec['test'] = True
+	#-- classify contours
+	perimeter,area,line_length = measure_contours(xs, ys, offsets)
+	classify_contours(rec, pols, perimeter, area, line_length, FILTER=FILTER)
+	#-- labels of the pinning points and lines
+	lbl = [None]*len(rec)
+	pc = 1 # pinning point counter
+	lc = 1 # line counter
+	for idx in range(len(rec)):
+		if rec['code'][idx] == PIN_CLASS:
+			lbl[idx] = 'pin_err%i'%pc
+			pc += 1
+		elif rec['code'][idx] == GL_CLASS:
+			lbl[idx] = 'err%i'%lc
+			lc += 1
+	return rec,xy,lbl
@@ -12,8 +12,10 @@ import numpy as np
 import skimage
 import getopt
 import shapefile
+import geotiff_io
+import contour_utils
 import scipy.ndimage as ndimage
-from shapely.geometry import Polygon,LineString
+from shapely.geometry import Polygon
 from skimage.graph import route_through_array
 from skimage.morphology import thin,skeletonize
 
@@ -79,7 +81,7 @@ def main():
 	for f in pred_list:
 		#-- read file
 		raster = rasterio.open(os.path.join(pred_dir,f),'r')
-		im = raster.read(1)
+		im = geotiff_io.read_band(raster)
 		#-- get transformation matrix
 		trans = raster.transform
 
@@ -97,80 +99,68 @@ def main():
 		im[0,np.nonzero(im[0,:] > eps)] = eps
 		im[-1,np.nonzero(im[-1,:] > eps)] = eps
 		contours = skimage.measure.find_contours(im, eps)
+		#-- per-contour records
+		rec = contour_utils.new_records(contours)
+		offsets = contour_utils.contour_offsets(rec)
+		contour_rc = contour_utils.concat_contours(contours)
 		#-- make contours into closed polyons to find pinning points
-		pols = [None]*len(contours)
-		pol_type = [None]*len(contours)
-		for n,contour in enumerate(contours):
-			pols[n] = Polygon(zip(contour[:,0],contour[:,1]))
-			#-- get elements of mask the contour is on
-			submask = mask[np.round(contour[:, 0]).astype('int'), np.round(contour[:, 1]).astype('int')]
-			#-- if more than half of the elements are from test tile, count contour as test type
-			if np.count_nonzero(submask) > submask.size/2.:
-				pol_type[n] = 'Test'
+		pols = [Polygon(zip(contour[:,0],contour[:,1])) for contour in contours]
+		#-- if more than half of the elements of the mask the contour is on
+		#-- are from test tile, count contour as test type
+		rec['test'] = contour_utils.test_contours(mask, contour_rc, offsets)
+		pol_type = np.where(rec['test'],'Test','Train')
+
+		#-- inner contour of each outer contour (-1 for none) and number of
+		#-- contours inside each contour
+		partner = -np.ones(len(contours),dtype=np.int64)
+		n_inside = np.zeros(len(contours),dtype=np.int64)
+		pairs = contour_utils.containment_pairs(pols)
+		for i,j in pairs:
+			#-- if the outer contour is significantly longer than the
+			#-- inner contour, then it's not a pinning point but a loop
+			#-- in the GL (use factor of 10 difference). In that case, get 
+			#-- the inner loop instead
+			if rec['n'][i] > 10*rec['n'][j]:
+				#-- the outer contour is a loop
+				contour_utils.set_flag(rec, i, contour_utils.LOOP)
+				#-- inner contour is considered pinning point
+				contour_utils.set_flag(rec, j, contour_utils.INNER)
 			else:
-				pol_type[n] = 'Train'
-			
-		#-- intialize matrix of polygon containment
-		cmat = np.zeros((len(pols),len(pols)),dtype=bool)
-		#-- initialize list of loops, inner and outer contours
-		loops = []
-		outer = []
-		inner = []
-		for i in range(len(pols)):
-			for j in range(len(pols)):
-				if (i != j) and pols[i].contains(pols[j]):
-					#-- if the outer contour is significantly longer than the
-					#-- inner contour, then it's not a pinning point but a loop
-					#-- in the GL (use factor of 10 difference). In that case, get 
-					#-- the inner loop instead
-					if len(contours[i][:,0]) > 10*len(contours[j][:,0]):
-						#-- the outer contour is a loop
-						loops.append(i)
-						#-- inner contour is considered pinning point
-						inner.append(j)
-					else:
-						cmat[i,j] = True
+				partner[i] = j
+				n_inside[i] += 1
 		#-- However, note that if one outer control has more than 1 inner contour,
 		#-- then it's not a pinning point and it's actually just noise.
-		#-- In that case, ignore the inner contours. We add a new array for 
+		#-- In that case, ignore the inner contours. We flag these as
 		#-- 'noise' points to be ignored.
-		noise = []
-		#-- get indices of rows with more than 1 True column in cmat
-		for i in range(len(cmat)):
-			if np.count_nonzero(cmat[i,:]) > 1:
-				noise_idx, = np.nonzero(cmat[i,:])
-				#-- concentante to noise list
-				noise += list(noise_idx)
-				#-- turn the matrix elements back off
-				for j in noise_idx:
-					cmat[i,j] = False 
+		multiple = n_inside > 1
+		for i,j in pairs:
+			if multiple[i] and (rec['n'][i] <= 10*rec['n'][j]):
+				contour_utils.set_flag(rec, j, contour_utils.NOISE)
+		partner[multiple] = -1
 		
-		#-- also apply noise filter and append to noise list
-		x = {}
-		y = {}
-		tmp_noise = []
-		for idx,contour in enumerate(contours):
-			#-- convert to coordinates
-			x[idx],y[idx] = rasterio.transform.xy(trans, contour[:,0], contour[:,1])
-			#-- apply filter
-			if (len(x[idx]) < 2 or LineString(zip(x[idx],y[idx])).length <= FILTER):
-				tmp_noise.append(idx)
-
-		#-- combine and remove repeating elements
-		noise = list(set(noise+tmp_noise))
+		#-- convert all vertices to coordinates at once
+		xs,ys = contour_utils.transform_contours(trans, contour_rc)
+		xy = contour_utils.split_contours(xs, ys, offsets)
+		#-- also apply noise filter to the lengths of all lines at once
+		perimeter,area,line_length = contour_utils.measure_contours(xs, ys, offsets)
+		contour_utils.set_flag(rec, (rec['n'] < 2) | (line_length <= FILTER), contour_utils.NOISE)
+		noise = contour_utils.has_flag(rec, contour_utils.NOISE)
 
 		#-- go through overlapping elements and get nonoverlapping area to convert to 'donuts'
 		#-- NOTE we will get the the contour corresponding to the inner ring
-		for i in range(len(pols)):
-			for j in range(len(pols)):
-				if cmat[i,j] and (i not in noise) and (j not in noise):
-					#-- save indices of inner and outer rings
-					outer.append(i)
-					if j not in loops:
-						inner.append(j)
+		loops = contour_utils.has_flag(rec, contour_utils.LOOP)
+		for i in np.nonzero(partner >= 0)[0]:
+			j = partner[i]
+			if (not noise[i]) and (not noise[j]):
+				#-- save indices of inner and outer rings
+				contour_utils.set_flag(rec, i, contour_utils.OUTER)
+				if not loops[j]:
+					contour_utils.set_flag(rec, j, contour_utils.INNER)
+		outer = contour_utils.has_flag(rec, contour_utils.OUTER)
+		inner = contour_utils.has_flag(rec, contour_utils.INNER)
 		#-- initialize list of contour linestrings
 		cnts = [None]*len(contours)
-		centers = [None]*(len(contours)-len(outer)-len(noise))
+		centers = [None]*(len(contours)-np.count_nonzero(outer)-np.count_nonzero(noise))
 		#-- counters for centerlines and contours
 		cc = 0 # contour counter
 		n = 0  # center line counter
@@ -184,18 +174,18 @@ def main():
 		cn_lbl = [None]*len(centers)
 		#-- convert to coordinates
 		for idx,contour in enumerate(contours):
-			cnts[cc] = [list(a) for a in zip(x[idx],y[idx])]
-			er_type[cc] = pol_type[idx]
-			if idx in noise:
-				er_class[cc] = 'Noise'				
-			elif idx in outer:
+			cnts[cc] = xy[idx].tolist()
+			er_type[cc] = str(pol_type[idx])
+			if noise[idx]:
+				er_class[cc] = 'Noise'
+			elif outer[idx]:
 				er_class[cc] = 'Outer Contour'
 			else:
 				#-- In these cases there is a grounding line to be counted.
 				#-- either pinning point or line
-				cn_type[n] = pol_type[idx]
+				cn_type[n] = str(pol_type[idx])
 				#-- if this is an inner ring, then the centerline is the same as the contour
-				if idx in inner:
+				if inner[idx]:
 					centers[n] = cnts[cc].copy()
 					cn_class[n] = 'Pinning Point'
 					er_class[cc] = 'Inner Contour'
@@ -230,13 +220,12 @@ def main():
 					inds, ws = route_through_array(1-im2, (startPoint[0], startPoint[1]),\
 						(endPoint[0], endPoint[1]), geometric=True,fully_connected=True)
 					#-- wrap up list of tuples
-					ii,jj = zip(*inds)
-					xc,yc = rasterio.transform.xy(trans, ii, jj)
+					xc,yc = contour_utils.transform_contours(trans, inds)
 					try:
-						centers[n] = [list(a) for a in zip(xc,yc)]
+						centers[n] = np.column_stack((xc,yc)).tolist()
 					except:
 						print('%s\nlen centers: %i, len outer: %i, len contours: %i, len noise: %i'%(
-							f,len(centers),len(outer),len(contours),len(noise)))
+							f,len(centers),np.count_nonzero(outer),len(contours),np.count_nonzero(noise)))
 						sys.exit('index out of bounds.')
 
 					#-- set label
@@ -11,8 +11,10 @@ import rasterio
 import numpy as np
 import getopt
 import shapefile
+import geotiff_io
+import contour_utils
 from skimage.measure import find_contours
-from shapely.geometry import Polygon,LineString,Point
+from shapely.geometry import Polygon
 from label_centerlines import get_centerline
 
 
@@ -41,7 +43,7 @@ def main():
 
 	#-- read file
 	raster = rasterio.open(INPUT,'r')
-	im = raster.read(1)
+	im = geotiff_io.read_band(raster)
 	#-- get transformation matrix
 	trans = raster.transform
 
@@ -59,62 +61,47 @@ def main():
 	im[0,np.nonzero(im[0,:] > eps)] = eps
 	im[-1,np.nonzero(im[-1,:] > eps)] = eps
 	contours = find_contours(im, eps)
+	#-- per-contour records
+	rec = contour_utils.new_records(contours)
+	offsets = contour_utils.contour_offsets(rec)
+	contour_rc = contour_utils.concat_contours(contours)
+	#-- convert all vertices to coordinates at once
+	xs,ys = contour_utils.transform_contours(trans, contour_rc)
+	xy = contour_utils.split_contours(xs, ys, offsets)
 	#-- make contours into closed polyons to find pinning points
-	#-- also apply noise filter and append to noise list
-	x = {}
-	y = {}
-	noise = []
-	pols = [None]*len(contours)
-	pol_type = [None]*len(contours)
-	for n,contour in enumerate(contours):
-		#-- convert to coordinates
-		x[n],y[n] = rasterio.transform.xy(trans, contour[:,0], contour[:,1])
-
-		pols[n] = Polygon(zip(x[n],y[n]))
-		#-- get elements of mask the contour is on
-		submask = mask[np.round(contour[:, 0]).astype('int'), np.round(contour[:, 1]).astype('int')]
-		#-- if more than half of the elements are from test tile, count contour as test type
-		if np.count_nonzero(submask) > submask.size/2.:
-			pol_type[n] = 'Test'
-		else:
-			pol_type[n] = 'Train'
-	
-	#-- loop through and apply noise filter
-	for n in range(len(contours)):
-		#-- apply filter
-		if (n not in ignore_list) and (len(x[n]) < 2 or LineString(zip(x[n],y[n])).length <= FILTER):
-			noise.append(n)
-
-	#-- loop through remaining polygons and determine which ones are 
-	#-- pinning points based on the width and length of the bounding box
-	pin_list = []
-	box_ll = [None]*len(contours)
-	box_ww = [None]*len(contours)
-	for n in range(len(pols)):
-		box_ll[n] = pols[n].length
-		box_ww[n] = pols[n].area/box_ll[n]
-		if (n not in noise):
-			#-- if the with is larger than 1/25 of the length, it's a pinning point
-			if box_ww[n] > box_ll[n]/25:
-				pin_list.append(n)
+	pols = [Polygon(v) for v in xy]
+	#-- if more than half of the elements of the mask the contour is on
+	#-- are from test tile, count contour as test type
+	rec['test'] = contour_utils.test_contours(mask, contour_rc, offsets)
+	pol_type = np.where(rec['test'],'Test','Train')
+
+	#-- lengths and widths of all polygons at once
+	perimeter,area,line_length = contour_utils.measure_contours(xs, ys, offsets)
+	rec['length'] = perimeter
+	rec['width'] = area/perimeter
+	box_ll = rec['length'].tolist()
+	box_ww = rec['width'].tolist()
+	#-- lines not longer than the filter are noise
+	#-- (contours ignored below are not counted as noise)
+	short = line_length <= FILTER
+	#-- determine which of the remaining polygons are pinning points: if the
+	#-- width is larger than 1/25 of the length, it's a pinning point
+	contour_utils.set_flag(rec, (~short) & (rec['width'] > rec['length']/25), contour_utils.PIN)
+	pin = contour_utils.has_flag(rec, contour_utils.PIN)
 
 	#-- Loop through all the polygons and take any overlapping areas out
 	#-- of the enclosing polygon and ignore the inside polygon
-	ignore_list = []
-	for i in range(len(pols)):
-		for j in range(len(pols)):
-			if (i != j) and pols[i].contains(pols[j]):
-				# pols[i] = pols[i].difference(pols[j])
-				if (i in pin_list) and (j in pin_list):
-					#-- if it's a pinning point, ignore outer loop
-					ignore_list.append(i)
-				else:
-					#-- if not, add inner loop to ignore list
-					ignore_list.append(j)
-
-	#-- find overlap between ignore list nad noise list
-	if len(list(set(noise) & set(ignore_list))) != 0:
-		sys.exit('Overlap not empty: ', list(set(noise) & set(ignore_list)))
+	for i,j in contour_utils.containment_pairs(pols):
+		# pols[i] = pols[i].difference(pols[j])
+		if pin[i] and pin[j]:
+			#-- if it's a pinning point, ignore outer loop
+			contour_utils.set_flag(rec, i, contour_utils.IGNORE)
+		else:
+			#-- if not, ignore the inner loop
+			contour_utils.set_flag(rec, j, contour_utils.IGNORE)
+	ignore = contour_utils.has_flag(rec, contour_utils.IGNORE)
+	contour_utils.set_flag(rec, short & (~ignore), contour_utils.NOISE)
+	noise = contour_utils.has_flag(rec, contour_utils.NOISE)
 
 	#-- initialize list of contour linestrings
 	er = [None]*len(contours)
@@ -130,32 +117,32 @@ def main():
 	cn_lbl = []
 	#-- loop through polygons, get centerlines, and save
 	for idx,p in enumerate(pols):
-		er[idx] = [list(a) for a in zip(x[idx],y[idx])]
-		er_type[idx] = pol_type[idx]
-		if idx in noise:
-			er_class[idx] = 'Noise'				
-		elif idx in ignore_list:
+		er[idx] = xy[idx].tolist()
+		er_type[idx] = str(pol_type[idx])
+		if noise[idx]:
+			er_class[idx] = 'Noise'
+		elif ignore[idx]:
 			er_class[idx] = 'Ignored Contour'
 		else:
-			if idx in pin_list:
+			if pin[idx]:
 				#-- pinning point. Just get perimeter of polygon
 				xc,yc = pols[idx].exterior.coords.xy
 				cn.append([list(a) for a in zip(xc,yc)])
 				cn_class.append('Pinning Point')
-				cn_type.append(pol_type[idx])
+				cn_type.append(str(pol_type[idx]))
 				#-- set label
 				cn_lbl.append('pin%i'%pc)
 				pc += 1 #- incremenet pinning point counter
 			else:
-				dis = pols[idx].length/10
-				mx = pols[idx].length/80
+				dis = rec['length'][idx]/10
+				mx = rec['length'][idx]/80
 				merged_lines = get_centerline(p,segmentize_maxlen=dis,max_points=mx)
 				#-- save coordinates of linestring
 				xc,yc = merged_lines.coords.xy
 				cn.append([list(a) for a in zip(xc,yc)])
 				cn_class.append('Grounding Line')
 				cn_lbl.append('line%i'%lc)
-				cn_type.append(pol_type[idx])
+				cn_type.append(str(pol_type[idx]))
 				er_class[idx] = 'GL Uncertainty'
 				#-- set label
 				er_lbl[idx] = 'err%i'%lc
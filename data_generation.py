@@ -4,20 +4,64 @@ Yara Mohajerani (Last Update 07/2020)
 
 data generator class for feeding data into keras model.
 Modified from https://stanford.edu/~shervine/blog/keras-how-to-generate-data-on-the-fly
+
+If shard_dir is given, list_IDs are tile names in the index of a shard
+directory written by geocoded_preprocess.py --SHARD (tile_shards.py) and
+batches are read through np.memmap instead of individual .npy files.
+
+With augment=True each sample is randomly flipped left-right and/or
+up-down when the batch is generated (and transposed if rotate=True,
+which adds the 90 degree rotations), so the augmented copies no longer
+have to be written to disk by geocoded_preprocess.py --AUGMENT.
 """
 import numpy as np
 import keras
+from tile_shards import ShardReader
+
+#-- randomly flip (and rotate) each sample of a batch in place
+#-- labels is a list of flattened (n,h*w,...) arrays transformed like X
+def augment_batch(X, labels, rng, rotate=False):
+	n,h,w = X.shape[:3]
+	if rotate and (h != w):
+		raise ValueError('Rotations require square tiles, got {0:d}x{1:d}'.format(h,w))
+	#-- view the flattened labels as images
+	lbls = [l.reshape(n,h,w) for l in labels]
+	#-- bit 1: flip left-right, bit 2: flip up-down, bit 4: transpose
+	#-- the 8 combinations are all flips and 90 degree rotations
+	ops = rng.randint(8 if rotate else 4, size=n)
+	for op in np.unique(ops):
+		ii, = np.nonzero(ops == op)
+		for arr in [X]+lbls:
+			sub = arr[ii]
+			if op & 1:
+				sub = sub[:,:,::-1]
+			if op & 2:
+				sub = sub[:,::-1]
+			if op & 4:
+				sub = sub.swapaxes(1,2)
+			#-- the flips and transposes are views of the copy made by
+			#-- arr[ii], which is written back into the batch here
+			arr[ii] = sub
+	return X,labels
 
 class DataGenerator(keras.utils.Sequence):
 	'Generates data for Keras'
 	def __init__(self, list_IDs, batch_size=10, dim=(512,512), 
-			n_channels=2, shuffle=True):
+			n_channels=2, shuffle=True, shard_dir=None, augment=False,
+			rotate=False, seed=None):
 		'Initialization'
 		self.dim = dim
 		self.batch_size = batch_size
 		self.n_channels = n_channels
 		self.list_IDs = list_IDs
 		self.shuffle = shuffle
+		self.reader = ShardReader(shard_dir) if shard_dir else None
+		self.augment = augment
+		self.rotate = rotate
+		#-- base seed for shuffling and for the augmentation of each batch
+		self.seed = np.random.randint(2**31) if seed is None else seed
+		self.rng = np.random.RandomState(self.seed)
+		self.epoch = -1
 		self.on_epoch_end()
 
 	def __len__(self):
@@ -26,6 +70,10 @@ class DataGenerator(keras.utils.Sequence):
 
 	def __getitem__(self, index):
 		'Generate one batch of data'
+		return self.load_batch(index)
+
+	def load_batch(self, index, out=None):
+		'Generate one batch of data, optionally into the preallocated arrays out'
 		# Generate indexes of the batch
 		indexes = self.indexes[index*self.batch_size:(index+1)*self.batch_size]
 
@@ -33,26 +81,44 @@ class DataGenerator(keras.utils.Sequence):
 		list_IDs_temp = [self.list_IDs[k] for k in indexes]
 
 		# Generate data
-		X, y = self.__data_generation(list_IDs_temp)
+		X, y = self.__data_generation(list_IDs_temp, out=out)
+
+		# Augment data
+		if self.augment:
+			#-- seed from the epoch and batch so results don't depend on worker order
+			rng = np.random.RandomState([self.seed,self.epoch,index])
+			augment_batch(X, [y], rng, rotate=self.rotate)
 
 		return X, y
 
+	def batch_shapes(self):
+		'Shapes and data types of the arrays of one batch'
+		return [((self.batch_size, *self.dim, self.n_channels), np.float64),
+			((self.batch_size, self.dim[0]*self.dim[1], 1), np.float64)]
+
 	def on_epoch_end(self):
 		'Updates indexes after each epoch'
 		self.indexes = np.arange(len(self.list_IDs))
+		self.epoch += 1
 		if self.shuffle == True:
-			np.random.shuffle(self.indexes)
+			self.rng.shuffle(self.indexes)
 
-	def __data_generation(self, list_IDs_temp):
+	def __data_generation(self, list_IDs_temp, out=None):
 		'Generates data containing batch_size samples' # X : (n_samples, *dim, n_channels)
 		# Initialization
-		X = np.empty((self.batch_size, *self.dim, self.n_channels))
-		y = np.empty((self.batch_size, self.dim[0]*self.dim[1], 1))
+		if out is None:
+			out = [np.empty(shape, dtype=dtype) for shape,dtype in self.batch_shapes()]
+		X,y = out
 		# Generate data
-		for i, ID in enumerate(list_IDs_temp):
-			#-- read image
-			X[i,] = np.load(ID)
-			#-- read labels
-			y[i,] = np.load(ID.replace('coco','delineation').replace('pred','delineation'))
+		if self.reader is not None:
+			#-- read the whole batch from the memory-mapped shards
+			self.reader.read_images(list_IDs_temp, X)
+			self.reader.read_labels(list_IDs_temp, y)
+		else:
+			for i, ID in enumerate(list_IDs_temp):
+				#-- read image
+				X[i,] = np.load(ID)
+				#-- read labels
+				y[i,] = np.load(ID.replace('coco','delineation').replace('pred','delineation'))
 
 		return X,y
\ No newline at end of file
@@ -4,22 +4,61 @@ Yara Mohajerani (Last Update 04/2020)
 
 data generator class for feeding data into keras model.
 Modified from https://stanford.edu/~shervine/blog/keras-how-to-generate-data-on-the-fly
+
+If shard_dir is given, list_IDs are tile names in the index of a shard
+directory written by geocoded_preprocess.py --SHARD (tile_shards.py) and
+batches are read through np.memmap instead of individual .npy files.
+
+augment, rotate and seed apply random flips and rotations at batch time,
+as in data_generation.py.
+
+With weight_mode='loss' no weight array is generated. The batches only
+contain the images as float32 and the labels as uint8, and the class-ratio
+weighting is done inside the loss on the device:
+	model.compile(loss=class_ratio_loss(ratio), optimizer='adam',
+		metrics=[uint8_accuracy])
 """
 import numpy as np
 import rasterio
 import keras
+from keras import backend as K
+from tile_shards import ShardReader
+from data_generation import augment_batch
+
+#-- custom loss with the class-ratio weighting (same as customLoss in
+#-- run_prediction.py) for labels fed as uint8
+def class_ratio_loss(ratio=727):
+	def customLoss(yTrue,yPred):
+		yTrue = K.cast(yTrue,K.floatx())
+		return -1*K.mean(ratio*(yTrue*K.log(yPred+1e-32)) + ((1. - yTrue)*K.log(1-yPred+1e-32)))
+	return customLoss
+
+#-- binary accuracy for labels fed as uint8
+def uint8_accuracy(yTrue,yPred):
+	return K.mean(K.equal(K.cast(yTrue,K.floatx()),K.round(yPred)))
 
 class DataGenerator(keras.utils.Sequence):
 	'Generates data for Keras'
 	def __init__(self, list_IDs, batch_size=10, dim=(512,512), 
-			n_channels=2, shuffle=True, ratio=727):
+			n_channels=2, shuffle=True, ratio=727, shard_dir=None, augment=False,
+			rotate=False, seed=None, weight_mode='array'):
 		'Initialization'
 		self.dim = dim
 		self.batch_size = batch_size
 		self.n_channels = n_channels
 		self.list_IDs = list_IDs
 		self.shuffle = shuffle
+		self.reader = ShardReader(shard_dir) if shard_dir else None
 		self.ratio = ratio
+		if weight_mode not in ('array','loss'):
+			raise ValueError('weight_mode must be "array" or "loss", got %s'%weight_mode)
+		self.weight_mode = weight_mode
+		self.augment = augment
+		self.rotate = rotate
+		#-- base seed for shuffling and for the augmentation of each batch
+		self.seed = np.random.randint(2**31) if seed is None else seed
+		self.rng = np.random.RandomState(self.seed)
+		self.epoch = -1
 		self.on_epoch_end()
 
 	def __len__(self):
@@ -28,6 +67,10 @@ class DataGenerator(keras.utils.Sequence):
 
 	def __getitem__(self, index):
 		'Generate one batch of data'
+		return self.load_batch(index)
+
+	def load_batch(self, index, out=None):
+		'Generate one batch of data, optionally into the preallocated arrays out'
 		# Generate indexes of the batch
 		indexes = self.indexes[index*self.batch_size:(index+1)*self.batch_size]
 
@@ -35,29 +78,55 @@ class DataGenerator(keras.utils.Sequence):
 		list_IDs_temp = [self.list_IDs[k] for k in indexes]
 
 		# Generate data
-		X, y, w = self.__data_generation(list_IDs_temp)
+		batch = self.__data_generation(list_IDs_temp, out=out)
+
+		# Augment data
+		if self.augment:
+			#-- seed from the epoch and batch so results don't depend on worker order
+			rng = np.random.RandomState([self.seed,self.epoch,index])
+			augment_batch(batch[0], batch[1:], rng, rotate=self.rotate)
 
-		return X, y, w
+		return batch
+
+	def batch_shapes(self):
+		'Shapes and data types of the arrays of one batch'
+		if self.weight_mode == 'loss':
+			#-- compact images and labels only, weights are computed in the loss
+			return [((self.batch_size, *self.dim, self.n_channels), np.float32),
+				((self.batch_size, self.dim[0]*self.dim[1], 1), np.uint8)]
+		return [((self.batch_size, *self.dim, self.n_channels), np.float64),
+			((self.batch_size, self.dim[0]*self.dim[1], 1), np.float64),
+			((self.batch_size, self.dim[0]*self.dim[1]), np.float64)]
 
 	def on_epoch_end(self):
 		'Updates indexes after each epoch'
 		self.indexes = np.arange(len(self.list_IDs))
+		self.epoch += 1
 		if self.shuffle == True:
-			np.random.shuffle(self.indexes)
+			self.rng.shuffle(self.indexes)
 
-	def __data_generation(self, list_IDs_temp):
+	def __data_generation(self, list_IDs_temp, out=None):
 		'Generates data containing batch_size samples' # X : (n_samples, *dim, n_channels)
 		# Initialization
-		X = np.empty((self.batch_size, *self.dim, self.n_channels))
-		y = np.empty((self.batch_size, self.dim[0]*self.dim[1], 1))
-		w = np.empty((self.batch_size, self.dim[0]*self.dim[1]))
+		if out is None:
+			out = [np.empty(shape, dtype=dtype) for shape,dtype in self.batch_shapes()]
+		X,y = out[:2]
 		# Generate data
-		for i, ID in enumerate(list_IDs_temp):
-			#-- read image
-			X[i,] = np.load(ID)
-			#-- read labels
-			y[i,] = np.load(ID.replace('coco','delineation'))
-			#-- get flattened weights
-			w[i,] = np.squeeze(y[i,])*self.ratio
+		if self.reader is not None:
+			#-- read the whole batch from the memory-mapped shards
+			self.reader.read_images(list_IDs_temp, X)
+			self.reader.read_labels(list_IDs_temp, y)
+		else:
+			for i, ID in enumerate(list_IDs_temp):
+				#-- read image
+				X[i,] = np.load(ID)
+				#-- read labels
+				y[i,] = np.load(ID.replace('coco','delineation'))
+		if self.weight_mode == 'loss':
+			return X,y
+
+		#-- get flattened weights
+		w = out[2]
+		np.multiply(y[:,:,0], self.ratio, out=w)
 
 		return X,y,w
\ No newline at end of file
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+u"""
+export_model.py
+
+Export a trained network as an inference-only frozen graph.
+
+The model is built without dropout layers, the weights are loaded from
+the .h5 checkpoint and folded into the graph as constants, and constant
+subgraphs are precomputed. The weights can optionally be stored as int8
+(--QUANTIZE=int8, frozen graph) or float16 (--QUANTIZE=float16, written
+as a TensorFlow Lite model). A .json file next to the output records the
+input and output tensors.
+
+The exported model can be used with FrozenModel, or with the --FROZEN
+option of run_prediction.py and test_model.py, without rebuilding and
+compiling the keras model.
+"""
+import os
+import sys
+import imp
+import json
+import getopt
+import numpy as np
+import tensorflow as tf
+from keras import backend as K
+
+#-- build one of the networks in nn_model.py
+def build_model(mod_module, mod_lbl, height, width, channels, ninit=32, ndown=4, drop=0):
+	if mod_lbl == 'unet':
+		print('loading unet model')
+		model = mod_module.unet_model_double_dropout(height=height,width=width,\
+			channels=channels,n_init=ninit,n_layers=ndown,drop=drop)
+	elif mod_lbl == 'atrous':
+		print("loading atrous model")
+		model = mod_module.nn_model_atrous_double_dropout(height=height,\
+			width=width,channels=channels,n_filts=ninit,drop=drop)
+	elif mod_lbl == 'atrous_noPool':
+		print("loading atrous_noPool model")
+		model = mod_module.nn_model_atrous_noPool(height=height,width=width,\
+			channels=channels,n_filts=ninit,drop=drop)
+	else:
+		sys.exit('Model label not correct.')
+	return model
+
+#-- freeze the weights of a loaded keras model into a graph definition
+def freeze_model(model, quantize=None):
+	from tensorflow.tools.graph_transforms import TransformGraph
+	sess = K.get_session()
+	input_name = model.input.op.name
+	output_name = model.output.op.name
+	graph_def = tf.graph_util.convert_variables_to_constants(sess,
+		sess.graph.as_graph_def(), [output_name])
+	#-- fold constants and remove training-only nodes
+	transforms = ['strip_unused_nodes','remove_nodes(op=Identity)',
+		'fold_constants(ignore_errors=true)','fold_batch_norms','fold_old_batch_norms']
+	if quantize == 'int8':
+		transforms.append('quantize_weights')
+	transforms.append('sort_by_execution_order')
+	graph_def = TransformGraph(graph_def, [input_name], [output_name], transforms)
+	return graph_def,input_name,output_name
+
+#-- load a frozen graph (.pb) or tensorflow lite model (.tflite) for inference
+class FrozenModel(object):
+	'Inference-only model exported by export_model.py'
+	def __init__(self, model_file, num_threads=0):
+		self.model_file = model_file
+		with open(os.path.splitext(model_file)[0]+'.json','r') as fid:
+			self.info = json.load(fid)
+		if model_file.endswith('.tflite'):
+			self.interpreter = tf.lite.Interpreter(model_path=model_file)
+			self.input_index = self.interpreter.get_input_details()[0]['index']
+			self.output_index = self.interpreter.get_output_details()[0]['index']
+		else:
+			self.interpreter = None
+			graph_def = tf.GraphDef()
+			with tf.gfile.GFile(model_file,'rb') as fid:
+				graph_def.ParseFromString(fid.read())
+			self.graph = tf.Graph()
+			with self.graph.as_default():
+				tf.import_graph_def(graph_def, name='')
+			self.input = self.graph.get_tensor_by_name(self.info['input']+':0')
+			self.output = self.graph.get_tensor_by_name(self.info['output']+':0')
+			config = tf.ConfigProto(intra_op_parallelism_threads=num_threads,
+				inter_op_parallelism_threads=num_threads)
+			self.sess = tf.Session(graph=self.graph, config=config)
+
+	def predict_on_batch(self, x):
+		'Run the model on one batch'
+		x = np.asarray(x,dtype=np.float32)
+		if self.interpreter is None:
+			return self.sess.run(self.output, feed_dict={self.input:x})
+		self.interpreter.resize_tensor_input(self.input_index, x.shape)
+		self.interpreter.allocate_tensors()
+		self.interpreter.set_tensor(self.input_index, x)
+		self.interpreter.invoke()
+		return self.interpreter.get_tensor(self.output_index)
+
+	def predict(self, x, batch_size=1, verbose=0):
+		'Run the model on an array of samples in batches (same as keras)'
+		out = [self.predict_on_batch(x[i:i+batch_size]) for i in range(0,len(x),batch_size)]
+		return np.concatenate(out,axis=0)
+
+#-- main function
+def main():
+	#-- Read the system arguments listed after the program
+	long_options=['MODEL_DIR=','DOWN=','INIT=','DROPOUT=','RATIO=','MOD=','HEIGHT=',
+		'WIDTH=','QUANTIZE=','OUTPUT=']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'L:W:I:O:R:M:H:X:Q:U:',long_options)
+
+	#-- Set default settings
+	model_dir = os.path.join(os.path.expanduser('~'),'GL_learning')
+	ndown = 4 # number of 'down' steps
+	ninit = 32 #number of channels to start with
+	dropout_frac = 0.2 # dropout fraction (only used for the name of the model)
+	ratio = 727 # penalization ratio for GL and non-GL points based on smaller dataaset
+	mod_lbl = 'atrous'
+	h = 512
+	wi = 512
+	quantize = None
+	out_file = None
+	for opt, arg in optlist:
+		if opt in ("-L","--MODEL_DIR"):
+			model_dir = os.path.expanduser(arg)
+		elif opt in ("-W","--DOWN"):
+			ndown = int(arg)
+		elif opt in ("-I","--INIT"):
+			ninit = int(arg)
+		elif opt in ("-O","--DROPOUT"):
+			dropout_frac = float(arg)
+		elif opt in ("-R","--RATIO"):
+			ratio = float(arg)
+		elif opt in ("-M","--MOD"):
+			mod_lbl = arg
+		elif opt in ("-H","--HEIGHT"):
+			h = int(arg)
+		elif opt in ("-X","--WIDTH"):
+			wi = int(arg)
+		elif opt in ("-Q","--QUANTIZE"):
+			quantize = arg if arg != 'none' else None
+		elif opt in ("-U","--OUTPUT"):
+			out_file = os.path.expanduser(arg)
+
+	if quantize not in (None,'int8','float16'):
+		sys.exit('QUANTIZE must be none, int8 or float16.')
+
+	#-- set up model name
+	if mod_lbl == 'unet':
+		mod_str = '{0}_{1}init_{2}down_drop{3:.1f}_customLossR{4}'.\
+			format(mod_lbl,ninit,ndown,dropout_frac,ratio)
+	elif mod_lbl in ['atrous','atrous_noPool']:
+		mod_str = '{0}_{1}init_drop{2:.1f}_customLossR{3}'.\
+			format(mod_lbl,ninit,dropout_frac,ratio)
+	else:
+		sys.exit('model label not matching.')
+
+	#-- checkpoint file
+	chk_file = os.path.join(model_dir,'{0}_weights.h5'.format(mod_str))
+	if not os.path.isfile(chk_file):
+		sys.exit('Model does not previously exist.')
+	if out_file is None:
+		ext = '.tflite' if quantize == 'float16' else '.pb'
+		q_str = '_%s'%quantize if quantize else ''
+		out_file = os.path.join(model_dir,'{0}_frozen{1}{2}'.format(mod_str,q_str,ext))
+
+	#-- build the model for inference only (no dropout layers)
+	#-- dropout layers have no weights, so the checkpoint loads unchanged
+	K.set_learning_phase(0)
+	ch = 2
+	mod_module = imp.load_source('nn_model',os.path.join(model_dir,'nn_model.py'))
+	model = build_model(mod_module, mod_lbl, h, wi, ch, ninit=ninit, ndown=ndown, drop=0)
+	print(chk_file)
+	model.load_weights(chk_file)
+
+	#-- export the model
+	if quantize == 'float16':
+		converter = tf.lite.TFLiteConverter.from_session(K.get_session(),
+			[model.input], [model.output])
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.target_spec.supported_types = [tf.lite.constants.FLOAT16]
+		with open(out_file,'wb') as fid:
+			fid.write(converter.convert())
+		input_name,output_name = model.input.op.name,model.output.op.name
+	else:
+		graph_def,input_name,output_name = freeze_model(model, quantize=quantize)
+		with tf.gfile.GFile(out_file,'wb') as fid:
+			fid.write(graph_def.SerializeToString())
+	#-- save input and output names and dimensions
+	info = {'model':mod_str,'input':input_name,'output':output_name,
+		'height':h,'width':wi,'channels':ch,'quantize':quantize}
+	with open(os.path.splitext(out_file)[0]+'.json','w') as fid:
+		json.dump(info,fid,indent=1)
+	print(out_file)
+
+#-- run main program
+if __name__ == '__main__':
+	main()
@@ -4,29 +4,191 @@ Yara Mohajerani 04/2020
 
 Read geotiff files, preprocess, and convert to
 npy arrays for keras data generator
+
+Tiles can be processed in parallel with --NPROC. Completed tiles are
+recorded in a manifest file in each output directory so that an
+interrupted run resumes from where it stopped.
+
+With --SHARD the tiles are written as packed, memory-mappable shards
+of the given number of tiles (see tile_shards.py) instead of one .npy
+file per tile and label.
+
+--AUGMENT (writing flipped copies of the training tiles) is deprecated in
+favor of augmenting at batch time with DataGenerator(augment=True,
+rotate=True), and is ignored with --SHARD.
 """
 import os
 import sys
 import getopt
+import functools
+import multiprocessing
 import numpy as np
 import rasterio
 from skimage.morphology import binary_dilation
+import tile_shards
+
+#-- name of the manifest file listing completed tiles in each output directory
+MANIFEST = 'manifest.txt'
+
+#-- read the complex image and the label of one tile
+def read_tile(f, ddir='', dilate=False):
+	#-- read image (each band is only read once)
+	raster = rasterio.open(os.path.join(ddir,'cocotile_withoutnull_v1',f))
+	band = raster.read(1)
+	raster.close()
+	img = np.empty(band.shape+(2,))
+	img[:,:,0] = band.real
+	img[:,:,1] = band.imag
+	#-- read label
+	raster = rasterio.open(os.path.join(ddir,'delineationtile_withoutnull_v1',
+		f.replace('coco','delineation')))
+	lbl = np.int8(raster.read(1)/255.)
+	raster.close()
+	if dilate:
+		lbl = np.int8(binary_dilation(lbl))
+	return img,lbl
+
+#-- get the list of (flipped) copies of an image or label tile
+def augment_tile(arr, augment=False):
+	if augment:
+		return [arr,np.fliplr(arr),np.flipud(arr),np.fliplr(np.flipud(arr))]
+	else:
+		return [arr]
+
+#-- names of the (augmented) copies of a tile
+def tile_copies(f, augment=False):
+	n_img = 4 if augment else 1
+	return [f.replace('.tif','') + ('_aug%i'%i if i else '') for i in range(n_img)]
+
+#-- read and preprocess one tile and return the arrays of all its copies
+def load_tile(f, ddir='', augment=False, dilate=False):
+	img,lbl = read_tile(f, ddir=ddir, dilate=dilate)
+	return augment_tile(img,augment),augment_tile(lbl,augment)
+
+#-- read, preprocess and save one tile to the output directory
+def preprocess_tile(f, ddir='', out_dir='', augment=False, dilate=False):
+	img_file = os.path.join(out_dir,f.replace('.tif','.npy'))
+	lbl_file = os.path.join(out_dir,f.replace('coco','delineation').replace('.tif','.npy'))
+	imgs,lbls = load_tile(f, ddir=ddir, augment=augment, dilate=dilate)
+	h,w = lbls[0].shape
+	#-- save arrays to file
+	for i,(im,lb) in enumerate(zip(imgs,lbls)):
+		if i == 0:
+			suffix = ''
+		else:
+			suffix = '_aug%i'%i
+		#-- save image array
+		np.save(img_file.replace('.npy','%s.npy'%suffix),im)
+		#-- save label array
+		np.save(lbl_file.replace('.npy','%s.npy'%suffix),lb.reshape((h*w,1)))
+	return f
+
+#-- read the list of completed tiles from the manifest of an output directory
+def read_manifest(out_dir):
+	manifest_file = os.path.join(out_dir,MANIFEST)
+	if not os.path.exists(manifest_file):
+		return set()
+	with open(manifest_file,'r') as fid:
+		return set(line.strip() for line in fid if line.strip())
+
+#-- check that all copies of a tile were completely written
+#-- (truncated .npy files can't be memory-mapped)
+def tile_written(f, out_dir='', augment=False):
+	for name in tile_copies(f, augment):
+		for out in [name,name.replace('coco','delineation')]:
+			try:
+				np.load(os.path.join(out_dir,'%s.npy'%out), mmap_mode='r')
+			except (IOError,ValueError):
+				return False
+	return True
+
+#-- start the manifest of an output directory written before the manifest
+#-- existed, with the tiles whose outputs are complete
+def seed_manifest(tile_list, out_dir='', augment=False):
+	manifest_file = os.path.join(out_dir,MANIFEST)
+	if os.path.exists(manifest_file):
+		return
+	done = [f for f in tile_list if tile_written(f, out_dir=out_dir, augment=augment)]
+	with open(manifest_file,'w') as fid:
+		for f in done:
+			fid.write('%s\n'%f)
+	if done:
+		print('{0:d} tiles already written in {1}'.format(len(done),out_dir))
+
+#-- map a function over tiles, optionally with a pool of processes
+def map_tiles(func, tile_list, pool=None, ordered=False):
+	if pool is None:
+		return map(func, tile_list)
+	elif ordered:
+		return pool.imap(func, tile_list, chunksize=4)
+	else:
+		return pool.imap_unordered(func, tile_list, chunksize=4)
+
+#-- process a list of tiles, optionally in parallel, and record completed tiles
+def process_tiles(tile_list, pool=None, **kwargs):
+	out_dir = kwargs['out_dir']
+	seed_manifest(tile_list, out_dir=out_dir, augment=kwargs.get('augment',False))
+	done = read_manifest(out_dir)
+	todo = [f for f in tile_list if f not in done]
+	print('{0:d} of {1:d} tiles left to process in {2}'.format(len(todo),
+		len(tile_list),out_dir))
+	fid = open(os.path.join(out_dir,MANIFEST),'a')
+	#-- append each tile as soon as it is written so interrupted runs can resume
+	for f in map_tiles(functools.partial(preprocess_tile, **kwargs), todo, pool=pool):
+		fid.write('%s\n'%f)
+		fid.flush()
+	fid.close()
+
+#-- process a list of tiles into packed shards and record completed shards
+def process_shards(tile_list, pool=None, out_dir='', dim=(512,512), shard_size=500,
+	ddir='', augment=False, dilate=False):
+	#-- sort tiles so the shard layout is the same when resuming
+	tile_list = sorted(tile_list)
+	index,created = tile_shards.create_index(out_dir, [tile_copies(f,augment) for f in tile_list],
+		dim=dim, n_channels=2, shard_size=shard_size)
+	#-- a new index invalidates any previously completed shards
+	if created and os.path.exists(os.path.join(out_dir,MANIFEST)):
+		os.remove(os.path.join(out_dir,MANIFEST))
+	done = read_manifest(out_dir)
+	func = functools.partial(load_tile, ddir=ddir, augment=augment, dilate=dilate)
+	fid = open(os.path.join(out_dir,MANIFEST),'a')
+	for k,shard in enumerate(index['shards']):
+		if shard['images'] in done:
+			continue
+		print('writing shard {0:d} of {1:d} in {2}'.format(k+1,len(index['shards']),out_dir))
+		images,labels = tile_shards.open_shard(out_dir, index, k)
+		row = 0
+		#-- keep the tile order so rows match the index
+		tiles = tile_list[k*shard_size:(k+1)*shard_size]
+		for imgs,lbls in map_tiles(func, tiles, pool=pool, ordered=True):
+			for im,lb in zip(imgs,lbls):
+				images[row] = im
+				labels[row] = tile_shards.pack_label(lb)
+				row += 1
+		images.flush()
+		labels.flush()
+		del(images,labels)
+		#-- shard is complete
+		fid.write('%s\n'%shard['images'])
+		fid.flush()
+	fid.close()
 
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['DIR=','N_TEST=','AUGMENT','DILATE']
-	optlist,arglist = getopt.getopt(sys.argv[1:],'D:N:AD',long_options)
+	long_options=['DIR=','N_TEST=','AUGMENT','DILATE','NPROC=','SHARD=']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'D:N:ADP:S:',long_options)
 
 	#-- Set default settings
 	ddir = os.path.join(os.path.expanduser('~'),'Google Drive File Stream',
 		'Shared drives','GROUNDING_LINE_TEAM_DRIVE','ML_Yara','geocoded_v1')
 	augment = False
 	aug_str = ''
-	n_img = 1 #default 1 image without augmentation
 	dilate = False
 	dilate_str = ''
 	n_test = 50
+	nproc = 1
+	shard_size = 0
 	for opt, arg in optlist:
 		if opt in ("-D","--DIR"):
 			ddir = os.path.expanduser(arg)
@@ -36,21 +198,36 @@ def main():
 		elif opt in ("-A","--AUGMENT"):
 			augment = True
 			aug_str = '_aug'
-			n_img = 4
 		elif opt in ("-D","--dilate"):
 			dilate = True
 			dilate_str = '_dilated'
 		elif opt in ("-N","--N_TEST"):
 			n_test = int(arg)
+		elif opt in ("-P","--NPROC"):
+			nproc = int(arg)
+		elif opt in ("-S","--SHARD"):
+			shard_size = int(arg)
+
+	#-- the flipped copies are made at batch time by the data generators
+	if augment and shard_size:
+		print('--AUGMENT is deprecated and ignored with --SHARD, use '
+			'DataGenerator(augment=True, rotate=True) instead')
+		augment = False
+		aug_str = ''
+	elif augment:
+		print('--AUGMENT is deprecated, use DataGenerator(augment=True, '
+			'rotate=True) instead of writing the flipped copies to disk')
 
 	#-- Get list of files
 	img_dir = os.path.join(ddir,'cocotile_withoutnull_v1')
 	fileList = os.listdir(img_dir)
 	img_list = [f for f in fileList if (f.endswith('.tif') and f.startswith('coco'))]
-	
+
 	#-- output directories
-	out_train = os.path.join(ddir,'train{0}{1}_n{2}.dir'.format(aug_str,dilate_str,n_test))
-	out_test = os.path.join(ddir,'test_n{0}.dir'.format(n_test))
+	shard_str = '_shards' if shard_size else ''
+	out_train = os.path.join(ddir,'train{0}{1}_n{2}{3}.dir'.format(aug_str,dilate_str,
+		n_test,shard_str))
+	out_test = os.path.join(ddir,'test_n{0}{1}.dir'.format(n_test,shard_str))
 
 	#-- make directories if they don't exist
 	if not os.path.exists(out_train):
@@ -63,84 +240,27 @@ def main():
 	h = raster.height
 	w = raster.width
 	ch = raster.count
+	raster.close()
 	if ch > 1:
 		sys.exit('More than one channel in input dataset. Exiting.')
+
+	#-- set up pool of processes
+	pool = multiprocessing.Pool(processes=nproc) if nproc > 1 else None
 	#-- loop through files, read, and preprocess
 	#-- save each file to output directory so we don't have to read them all at once
 	n_train = len(img_list) - n_test
-	for f in img_list[:n_train]:
-		#-- IMAGE
-		if (not os.path.exists(os.path.join(out_train,f.replace('.tif','.npy')))):
-			img = np.ones((n_img,h,w,2))
-			#-- read image
-			raster = rasterio.open(os.path.join(ddir,'cocotile_withoutnull_v1',f))
-			img[0,:,:,0] = raster.read(1).real
-			img[0,:,:,1] = raster.read(1).imag
-			if augment:
-				for c in range(2):
-					img[1,:,:,c] = np.fliplr(img[0,:,:,c])
-					img[2,:,:,c] = np.flipud(img[0,:,:,c])
-					img[3,:,:,c] = np.fliplr(np.flipud(img[0,:,:,c]))
-			#-- save arrays to file
-			for i in range(n_img):
-				if i == 0:
-					suffix = ''
-				else:
-					suffix = '_aug%i'%i
-				#-- save image array
-				np.save(os.path.join(out_train,f.replace('.tif','%s.npy'%suffix)),img[i])
-		#-- TRAINING LABELS
-		if (not os.path.exists(os.path.join(out_train,\
-				f.replace('coco','delineation').replace('.tif','.npy')))):
-			lbl = np.ones((n_img,h*w,1),dtype=np.int8)
-			#-- read label
-			raster = rasterio.open(os.path.join(ddir,'delineationtile_withoutnull_v1',
-				f.replace('coco','delineation')))
-			if dilate:
-				lbl[0,:,0] = binary_dilation(np.int8(raster.read(1)/255.)).reshape((h*w))
-				if augment:
-					lbl[1,:,0] = binary_dilation(np.fliplr(lbl[0,:,0]))
-					lbl[2,:,0] = binary_dilation(np.flipud(lbl[0,:,0]))
-					lbl[3,:,0] = binary_dilation(np.fliplr(np.flipud(lbl[0,:,0])))
-			else:
-				lbl[0,:,0] = np.int8(raster.read(1)/255.).reshape((h*w))
-				if augment:
-					lbl[1,:,0] = np.fliplr(lbl[0,:,0])
-					lbl[2,:,0] = np.flipud(lbl[0,:,0])
-					lbl[3,:,0] = np.fliplr(np.flipud(lbl[0,:,0]))
-			#-- save arrays to file
-			for i in range(n_img):
-				if i == 0:
-					suffix = ''
-				else:
-					suffix = '_aug%i'%i
-				#-- save label array
-				np.save(os.path.join(out_train,\
-					f.replace('coco','delineation').replace('.tif','%s.npy'%suffix)),lbl[i])
-	
-	#-- read, process, and write TEST data
-	for f in img_list[n_train:]:
-		if (not os.path.exists(os.path.join(out_test,f.replace('.tif','.npy')))):
-			#-- initialize
-			img = np.ones((h,w,2))
-			#-- read image
-			raster = rasterio.open(os.path.join(ddir,'cocotile_withoutnull_v1',f))
-			img[:,:,0] = raster.read(1).real
-			img[:,:,1] = raster.read(1).imag
-			#-- save image array
-			np.save(os.path.join(out_test,f.replace('.tif','.npy')),img)
-		if (not os.path.exists(os.path.join(out_test,\
-				f.replace('coco','delineation').replace('.tif','.npy')))):	
-			#-- initialize
-			lbl = np.ones((h*w,1),dtype=np.int8)
-			#-- read label
-			raster = rasterio.open(os.path.join(ddir,'delineationtile_withoutnull_v1',
-				f.replace('coco','delineation')))
-			lbl[:,0] = np.int8(raster.read(1)/255.).reshape((h*w))	
-			#-- save label array
-			np.save(os.path.join(out_test,\
-				f.replace('coco','delineation').replace('.tif','.npy')),lbl)
-	
+	for tiles,out_dir,aug,dil in zip([img_list[:n_train],img_list[n_train:]],
+		[out_train,out_test],[augment,False],[dilate,False]):
+		if shard_size:
+			process_shards(tiles, pool=pool, out_dir=out_dir, dim=(h,w),
+				shard_size=shard_size, ddir=ddir, augment=aug, dilate=dil)
+		else:
+			process_tiles(tiles, pool=pool, ddir=ddir, out_dir=out_dir,
+				augment=aug, dilate=dil)
+	if pool is not None:
+		pool.close()
+		pool.join()
+
 #-- run main program
 if __name__ == '__main__':
 	main()
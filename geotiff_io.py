@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+u"""
+geotiff_io.py
+
+Shared GeoTIFF output for the prediction and stitching steps.
+
+Outputs are written as tiled, LZW-compressed GeoTIFFs with a predictor
+(floating-point predictor for Float32 and horizontal differencing for
+uint8) and multi-threaded compression (NUM_THREADS, shared between the
+files that are written at the same time). Probabilities can
+optionally be quantized to uint8 with a scale factor of 1/255 stored in
+the band metadata; read_band applies the scale so readers always get
+float32 probabilities back.
+
+WriterPool writes whole files and StripWriter writes the strips of one
+large file in background threads, so the processing loop does not wait
+for the compression.
+"""
+import queue
+import multiprocessing
+import threading
+import traceback
+import numpy as np
+from osgeo import gdal,osr
+
+#-- scale factor of quantized probabilities
+SCALE = 1.0/255.0
+
+#-- creation options for an output data type
+def creation_options(quantize=False, num_threads='ALL_CPUS'):
+	OPTS = ['COMPRESS=LZW','TILED=YES','BIGTIFF=IF_SAFER']
+	OPTS.append('PREDICTOR=2' if quantize else 'PREDICTOR=3')
+	if num_threads:
+		OPTS.append('NUM_THREADS=%s'%str(num_threads))
+	return OPTS
+
+#-- compression threads of each of nproc files written at the same time
+def writer_threads(nproc=1):
+	return max(1, multiprocessing.cpu_count()//max(nproc,1))
+
+#-- convert probabilities to the type of the output file
+def quantize_array(arr, quantize=False):
+	if not quantize:
+		return np.asarray(arr,dtype=np.float32)
+	return np.round(np.clip(arr,0,1)/SCALE).astype(np.uint8)
+
+#-- create a single band geotiff
+#-- geotransform is a gdal geotransform and srs an EPSG code or WKT string
+def create_geotiff(out_file, nx, ny, geotransform, srs, quantize=False,
+	num_threads='ALL_CPUS'):
+	driver = gdal.GetDriverByName("GTiff")
+	dtype = gdal.GDT_Byte if quantize else gdal.GDT_Float32
+	ds = driver.Create(out_file, int(nx), int(ny), 1, dtype,
+		creation_options(quantize=quantize, num_threads=num_threads))
+	#-- top left x, w-e pixel resolution, rotation
+	#-- top left y, rotation, n-s pixel resolution
+	ds.SetGeoTransform(list(geotransform))
+	#-- set the reference info
+	if isinstance(srs,str):
+		ds.SetProjection(srs)
+	else:
+		sr = osr.SpatialReference()
+		sr.ImportFromEPSG(int(srs))
+		ds.SetProjection(sr.ExportToWkt())
+	if quantize:
+		ds.GetRasterBand(1).SetScale(SCALE)
+		ds.GetRasterBand(1).SetOffset(0.0)
+	return ds
+
+#-- write an array to a new single band geotiff
+def write_geotiff(out_file, arr, geotransform, srs, quantize=False,
+	num_threads='ALL_CPUS'):
+	ny,nx = arr.shape
+	ds = create_geotiff(out_file, nx, ny, geotransform, srs, quantize=quantize,
+		num_threads=num_threads)
+	ds.GetRasterBand(1).WriteArray(quantize_array(arr,quantize=quantize))
+	ds.FlushCache()
+	ds = None
+	return out_file
+
+#-- read band 1 of an open rasterio dataset as float32 probabilities
+#-- (applying the scale factor of quantized files)
+def read_band(raster, window=None):
+	arr = raster.read(1, window=window)
+	if np.issubdtype(arr.dtype,np.integer) and (raster.scales[0] != 1.0):
+		return arr.astype(np.float32)*np.float32(raster.scales[0]) + \
+			np.float32(raster.offsets[0])
+	return arr
+
+#-- pool of threads writing whole geotiffs in the background
+class WriterPool(object):
+	'Writes geotiffs in background threads'
+	def __init__(self, workers=2, max_pending=16, quantize=False, num_threads='ALL_CPUS'):
+		self.quantize = quantize
+		self.num_threads = num_threads
+		#-- bounded so that only a few arrays are waiting in memory
+		self._tasks = queue.Queue(maxsize=max_pending)
+		self._errors = []
+		self._workers = [threading.Thread(target=self._work,daemon=True)
+			for i in range(workers)]
+		for w in self._workers:
+			w.start()
+
+	def _work(self):
+		while True:
+			task = self._tasks.get()
+			if task is None:
+				break
+			try:
+				write_geotiff(*task, quantize=self.quantize, num_threads=self.num_threads)
+			except Exception:
+				self._errors.append(traceback.format_exc())
+
+	def submit(self, out_file, arr, geotransform, srs):
+		'Queue an array to be written (blocks only if the queue is full)'
+		if self._errors:
+			raise RuntimeError('Writing geotiff failed:\n%s'%self._errors[0])
+		self._tasks.put((out_file,arr,geotransform,srs))
+
+	def close(self):
+		'Wait for all files to be written'
+		for w in self._workers:
+			self._tasks.put(None)
+		for w in self._workers:
+			w.join()
+		if self._errors:
+			raise RuntimeError('Writing geotiff failed:\n%s'%self._errors[0])
+
+#-- background thread writing the strips of one geotiff in order
+class StripWriter(object):
+	'Writes strips of rows to a geotiff in a background thread'
+	def __init__(self, out_file, nx, ny, geotransform, srs, quantize=False,
+		num_threads='ALL_CPUS', max_pending=2):
+		self.quantize = quantize
+		self.ds = create_geotiff(out_file, nx, ny, geotransform, srs,
+			quantize=quantize, num_threads=num_threads)
+		self.band = self.ds.GetRasterBand(1)
+		self._strips = queue.Queue(maxsize=max_pending)
+		self._error = None
+		self._thread = threading.Thread(target=self._work,daemon=True)
+		self._thread.start()
+
+	def _work(self):
+		while True:
+			strip = self._strips.get()
+			if strip is None:
+				break
+			if self._error is not None:
+				continue
+			try:
+				arr,yoff = strip
+				self.band.WriteArray(quantize_array(arr,quantize=self.quantize), 0, int(yoff))
+			except Exception:
+				self._error = traceback.format_exc()
+
+	def write(self, arr, yoff):
+		'Queue a strip of rows starting at row yoff'
+		if self._error is not None:
+			raise RuntimeError('Writing strip failed:\n%s'%self._error)
+		self._strips.put((arr,yoff))
+
+	def close(self):
+		'Write the remaining strips and close the file'
+		self._strips.put(None)
+		self._thread.join()
+		self.ds.FlushCache()
+		self.band = None
+		self.ds = None
+		if self._error is not None:
+			raise RuntimeError('Writing strip failed:\n%s'%self._error)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+u"""
+gl_catalog.py
+
+Combined grounding line catalogs written by combine_shapefiles_allTracks.py
+and read by cleanup.py and calc_gz*.py.
+
+Besides a single shapefile (FORMAT='shp'), the combined lines can be
+written as a directory of GeoParquet (FORMAT='parquet') or FlatGeobuf
+(FORMAT='fgb') files partitioned by track and month of the first
+acquisition (<catalog>/TRACK=<track>/MONTH=<yymm>.<ext>). In these
+catalogs every line gets TRACK and DATE attributes and its bounding box
+(MINX, MINY, MAXX, MAXY), and the catalog index (index.json) stores the
+bounding box of every partition, so read_catalog only opens the
+partitions and rows that intersect the requested region and only reads
+the requested columns.
+
+GeoParquet is written with geopandas (>=0.8) or directly with pyarrow
+(WKB geometries), and FlatGeobuf with the fiona FlatGeobuf driver (GDAL
+>=3.1). If these are not available, the partitions are written as
+GeoPackages (also with a spatial index) instead.
+"""
+import os
+import json
+import shutil
+import importlib.util
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import fiona
+from shapely import wkb
+
+#-- catalog index file
+INDEX = 'index.json'
+#-- bounding box columns
+BBOX = ['MINX','MINY','MAXX','MAXY']
+#-- file extensions of the formats
+EXTENSIONS = {'shp':'.shp','parquet':'.parquet','fgb':'.fgb','gpkg':'.gpkg'}
+
+#-- format of a catalog from its path
+def catalog_format(path):
+	if os.path.isdir(path) and os.path.exists(os.path.join(path,INDEX)):
+		with open(os.path.join(path,INDEX),'r') as fid:
+			return json.load(fid)['format']
+	for fmt,ext in EXTENSIONS.items():
+		if path.endswith(ext):
+			return fmt
+	return 'shp'
+
+#-- track and date (yymmdd of the first acquisition) from a file name
+#-- e.g. gl_069_181218-181224-181224-181230_..._8.0km.shp
+def parse_filename(f):
+	parts = os.path.basename(f).split('_')
+	if len(parts) < 3:
+		return '',''
+	return parts[1],parts[2].split('-')[0]
+
+#-- add track, date and bounding box columns (if they aren't there yet)
+def add_columns(gdf):
+	gdf = gdf.loc[:,~gdf.columns.duplicated()].copy()
+	if ('FILENAME' in gdf.columns) and ('TRACK' not in gdf.columns):
+		keys = [parse_filename(f) for f in gdf['FILENAME']]
+		gdf['TRACK'] = [k[0] for k in keys]
+		gdf['DATE'] = [k[1] for k in keys]
+	elif 'TRACK' not in gdf.columns:
+		gdf['TRACK'] = ''
+		gdf['DATE'] = ''
+	if not all(c in gdf.columns for c in BBOX):
+		bounds = np.array([g.bounds if ((g is not None) and (not g.is_empty))
+			else (np.nan,)*4 for g in gdf['geometry']]).reshape(-1,4)
+		for i,c in enumerate(BBOX):
+			gdf[c] = bounds[:,i]
+	return gdf
+
+#-- does geopandas itself read and write geoparquet (>=0.8)
+#-- (older GeoDataFrames inherit the pandas method, which can't write geometries)
+def geopandas_parquet():
+	return getattr(gpd.GeoDataFrame,'to_parquet',None) is not getattr(pd.DataFrame,'to_parquet',None)
+
+#-- can geoparquet be written in this environment
+def has_parquet():
+	if geopandas_parquet():
+		return True
+	return importlib.util.find_spec('pyarrow') is not None
+
+#-- can flatgeobuf be written in this environment
+def has_flatgeobuf():
+	return 'FlatGeobuf' in fiona.supported_drivers
+
+#-- crs of a dataframe as a JSON serializable object
+def crs_json(crs):
+	if crs is None or isinstance(crs,(dict,str)):
+		return crs
+	return crs.to_wkt()
+
+#-- write a partition in a given format
+def write_partition(gdf, path, fmt):
+	if fmt == 'parquet':
+		if geopandas_parquet():
+			gdf.to_parquet(path)
+			return
+		import pyarrow
+		import pyarrow.parquet as pq
+		df = pd.DataFrame(gdf.drop(columns='geometry'))
+		df['geometry'] = [None if g is None else g.wkb for g in gdf['geometry']]
+		table = pyarrow.Table.from_pandas(df, preserve_index=False)
+		geo = {'version':'0.4.0','primary_column':'geometry',
+			'columns':{'geometry':{'encoding':'WKB','crs':crs_json(gdf.crs)}}}
+		meta = dict(table.schema.metadata or {})
+		meta[b'geo'] = json.dumps(geo).encode('utf8')
+		pq.write_table(table.replace_schema_metadata(meta), path)
+	elif fmt == 'fgb':
+		gdf.to_file(path, driver='FlatGeobuf')
+	elif fmt == 'gpkg':
+		gdf.to_file(path, driver='GPKG')
+	else:
+		gdf.to_file(path, driver='ESRI Shapefile')
+
+#-- read a partition (only the given columns if not None)
+def read_partition(path, fmt, bbox=None, columns=None, crs=None):
+	if fmt == 'parquet':
+		cols = None if columns is None else list(columns) + [c for c in
+			BBOX + ['geometry'] if c not in columns]
+		if geopandas_parquet():
+			return gpd.read_parquet(path, columns=cols)
+		import pyarrow.parquet as pq
+		df = pq.read_table(path, columns=cols).to_pandas()
+		geom = [None if b is None else wkb.loads(b) for b in df['geometry']]
+		return gpd.GeoDataFrame(df.drop(columns='geometry'), geometry=geom, crs=crs)
+	gdf = gpd.read_file(path, bbox=bbox)
+	if columns is not None:
+		gdf = gdf[[c for c in gdf.columns if (c in columns) or (c in BBOX) or (c == 'geometry')]]
+	return gdf
+
+#-- write a combined grounding line catalog
+#-- path is the output file for 'shp' and the output directory otherwise
+#-- returns the format that was written (after any fallback)
+def write_catalog(gdf, path, fmt='shp'):
+	#-- shapefiles keep the columns of the input lines
+	if fmt == 'shp':
+		gdf.to_file(path, driver='ESRI Shapefile')
+		return fmt
+	gdf = add_columns(gdf)
+	#-- fallback to GeoPackage if the format can't be written
+	if ((fmt == 'parquet') and not has_parquet()) or ((fmt == 'fgb') and not has_flatgeobuf()):
+		print('%s is not available, writing GeoPackage partitions instead.'%fmt)
+		fmt = 'gpkg'
+	if os.path.exists(path):
+		shutil.rmtree(path)
+	os.makedirs(path)
+	month = gdf['DATE'].str.slice(0,4)
+	partitions = []
+	for (track,mm),part in gdf.groupby([gdf['TRACK'],month], sort=True):
+		partitions.append(write_partition_entry(part, path, fmt, track, mm))
+	write_index(path, fmt, gdf.crs, list(gdf.columns), partitions)
+	return fmt
+
+#-- write the lines of one track and month and return its index entry
+def write_partition_entry(part, path, fmt, track, mm):
+	name = os.path.join('TRACK=%s'%track,'MONTH=%s%s'%(mm,EXTENSIONS[fmt]))
+	if not os.path.exists(os.path.join(path,'TRACK=%s'%track)):
+		os.mkdir(os.path.join(path,'TRACK=%s'%track))
+	part = part.reset_index(drop=True)
+	write_partition(part, os.path.join(path,name), fmt)
+	return {'file':name,'TRACK':track,'MONTH':mm,'rows':len(part),
+		'bbox':[float(np.nanmin(part['MINX'])),float(np.nanmin(part['MINY'])),
+			float(np.nanmax(part['MAXX'])),float(np.nanmax(part['MAXY']))]}
+
+#-- write the catalog index
+def write_index(path, fmt, crs, columns, partitions):
+	with open(os.path.join(path,INDEX),'w') as fid:
+		json.dump({'format':fmt,'crs':crs_json(crs),'columns':columns,
+			'partitions':partitions}, fid, indent=1)
+
+#-- add lines to an existing catalog, first removing all the lines of the
+#-- files in replace (FILENAME column). Only the partitions of the new and
+#-- replaced files are rewritten. A new catalog is written if there is none.
+def update_catalog(gdf, path, replace=(), fmt='shp'):
+	replace = set(replace)
+	if not os.path.exists(path):
+		return write_catalog(gdf, path, fmt=fmt)
+	if not (os.path.isdir(path) and os.path.exists(os.path.join(path,INDEX))):
+		old = read_catalog(path)
+		if 'FILENAME' in old.columns:
+			old = old[~old['FILENAME'].isin(replace).values]
+		combined = gpd.GeoDataFrame(pd.concat([old,gdf], ignore_index=True, sort=False), crs=old.crs)
+		return write_catalog(combined, path, fmt=catalog_format(path))
+	with open(os.path.join(path,INDEX),'r') as fid:
+		index = json.load(fid)
+	fmt = index['format']
+	gdf = add_columns(gdf)
+	month = gdf['DATE'].str.slice(0,4)
+	#-- partitions with new lines or lines of replaced files
+	keys = set(zip(gdf['TRACK'],month))
+	for f in replace:
+		track,date = parse_filename(f)
+		keys.add((track,date[:4]))
+	entries = {(p['TRACK'],p['MONTH']):p for p in index['partitions']}
+	for track,mm in sorted(keys):
+		new = gdf[((gdf['TRACK'] == track) & (month == mm)).values]
+		if (track,mm) in entries:
+			fname = os.path.join(path,entries[(track,mm)]['file'])
+			old = read_partition(fname, fmt, crs=index['crs'])
+			old = old[~old['FILENAME'].isin(replace).values]
+			part = gpd.GeoDataFrame(pd.concat([old,new], ignore_index=True, sort=False), crs=old.crs)
+			os.remove(fname)
+		else:
+			part = new
+		if len(part) > 0:
+			entries[(track,mm)] = write_partition_entry(part, path, fmt, track, mm)
+		else:
+			entries.pop((track,mm),None)
+	columns = index['columns'] + [c for c in gdf.columns if c not in index['columns']]
+	crs = index['crs'] if index['crs'] is not None else gdf.crs
+	write_index(path, fmt, crs, columns, [entries[k] for k in sorted(entries.keys())])
+	return fmt
+
+#-- read a combined grounding line catalog (any format, or any file that
+#-- geopandas can read), only the lines whose bounding box intersects bbox
+#-- (minx,miny,maxx,maxy) and only the given columns (plus the geometry)
+def read_catalog(path, bbox=None, columns=None):
+	if not (os.path.isdir(path) and os.path.exists(os.path.join(path,INDEX))):
+		gdf = gpd.read_file(path, bbox=None if bbox is None else tuple(bbox))
+		if columns is not None:
+			gdf = gdf[[c for c in gdf.columns if (c in columns) or (c == 'geometry')]]
+		return gdf.reset_index(drop=True)
+	with open(os.path.join(path,INDEX),'r') as fid:
+		index = json.load(fid)
+	parts = []
+	for p in index['partitions']:
+		pb = p['bbox']
+		if (bbox is not None) and ((pb[0] > bbox[2]) or (pb[2] < bbox[0]) or
+			(pb[1] > bbox[3]) or (pb[3] < bbox[1])):
+			continue
+		parts.append(read_partition(os.path.join(path,p['file']), index['format'],
+			bbox=None if bbox is None else tuple(bbox), columns=columns, crs=index['crs']))
+	if len(parts) == 0:
+		gdf = gpd.GeoDataFrame(columns=[c for c in index['columns'] if (columns is None)
+			or (c in columns) or (c == 'geometry')])
+	else:
+		gdf = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=parts[0].crs)
+	if bbox is not None and len(gdf) > 0:
+		keep = ~((gdf['MINX'] > bbox[2]) | (gdf['MAXX'] < bbox[0]) |
+			(gdf['MINY'] > bbox[3]) | (gdf['MAXY'] < bbox[1]))
+		gdf = gdf[keep.values]
+	if columns is not None:
+		gdf = gdf[[c for c in gdf.columns if (c in columns) or (c == 'geometry')]]
+	if index['crs'] is not None and gdf.crs is None:
+		gdf.crs = index['crs']
+	return gdf.reset_index(drop=True)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+u"""
+gz_transects.py
+
+Batched transects across the grounding zone polygons for calc_gz.py.
+
+The transects are built as one array of coordinates (three points each:
+start, center and end) and intersected with the grounding zone polygons
+all at once. The polygons that each transect can intersect are found with
+an STRtree. With shapely 2 the intersections and their lengths are
+computed with the vectorized shapely functions; with older versions of
+shapely the candidate polygons of each transect are intersected in turn.
+A transect that intersects more than one polygon is intersected with the
+union of these polygons, so that nested or overlapping polygons are not
+counted twice.
+"""
+import numpy as np
+import shapely
+from shapely import ops
+from shapely.geometry import LineString
+from spatial_index import GeometryIndex
+
+#-- shapely >= 2 has vectorized geometry functions
+VECTORIZED = hasattr(shapely,'linestrings')
+
+#-- coordinates of transects of half-length dist centered at (xc,yc)
+#-- in the direction ang, as an array of shape (n,3,2)
+def transect_coords(xc, yc, ang, dist):
+	xc,yc,ang = [np.asarray(v,dtype=float).ravel() for v in (xc,yc,ang)]
+	dx,dy = dist*np.cos(ang),dist*np.sin(ang)
+	return np.stack([np.column_stack((xc-dx,yc-dy)),np.column_stack((xc,yc)),
+		np.column_stack((xc+dx,yc+dy))],axis=1)
+
+class TransectEngine(object):
+	'Intersections of batches of transects with a list of polygons'
+	def __init__(self, polys):
+		self.polys = list(polys)
+		if VECTORIZED:
+			self.geoms = np.array(self.polys,dtype=object)
+			self.tree = shapely.STRtree(self.geoms)
+		else:
+			self.index = GeometryIndex(self.polys)
+
+	#-- (transect, polygon) pairs that intersect, sorted by transect
+	#-- and polygon, and the lengths of their intersections
+	def _pairs(self, coords, valid):
+		if VECTORIZED:
+			lines = shapely.linestrings(coords[valid])
+			li,pj = self.tree.query(lines, predicate='intersects')
+			order = np.lexsort((pj,li))
+			li,pj = li[order],pj[order]
+			lengths = shapely.length(shapely.intersection(lines[li],self.geoms[pj]))
+			return valid[li],pj,lengths
+		ti,pj,lengths = [],[],[]
+		for n in valid:
+			line = LineString(coords[n])
+			for j in self.index.query(line):
+				if line.intersects(self.polys[j]):
+					ti.append(n)
+					pj.append(j)
+					lengths.append(line.intersection(self.polys[j]).length)
+		return np.array(ti,dtype=np.int64),np.array(pj,dtype=np.int64),np.array(lengths)
+
+	#-- length of the intersection of a transect with the union of polygons
+	def _union_length(self, coords, pj):
+		line = LineString(coords)
+		if VECTORIZED:
+			return shapely.length(shapely.intersection(line,shapely.union_all(self.geoms[pj])))
+		return line.intersection(ops.unary_union([self.polys[j] for j in pj])).length
+
+	def intersect(self, coords):
+		'''Length of the intersection of each transect with the polygons (NaN
+		for transects with invalid coordinates), the number of polygons it
+		intersects and the first of them (-1 if none)'''
+		coords = np.asarray(coords,dtype=float).reshape(-1,3,2)
+		n = len(coords)
+		#-- transects without a direction (e.g. no velocity) don't intersect
+		valid = np.nonzero(np.all(np.isfinite(coords),axis=(1,2)))[0]
+		ti,pj,lengths = self._pairs(coords, valid)
+		total = np.full(n,np.nan)
+		total[valid] = 0.
+		np.add.at(total, ti, lengths)
+		count = np.bincount(ti, minlength=n)
+		first = np.full(n,-1,dtype=np.int64)
+		#-- pairs are sorted, so the first pair of a transect has its first polygon
+		#-- and the pairs of each transect are next to each other
+		tu,iu,nu = np.unique(ti, return_index=True, return_counts=True)
+		first[tu] = pj[iu]
+		#-- transects that intersect more than one polygon
+		for t,i0,c in zip(tu[nu > 1],iu[nu > 1],nu[nu > 1]):
+			total[t] = self._union_length(coords[t], pj[i0:i0+c])
+		return total,count,first
+
+#-- index of the shortest transect of each row (ignoring invalid transects)
+def shortest(lengths):
+	return np.argmin(np.where(np.isnan(lengths),np.inf,lengths),axis=-1)
@@ -11,7 +11,9 @@ import pathlib
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import gl_catalog
 import netCDF4 as nc
+import velocity_sampler
 from copy import copy
 import rasterio as rio
 from shapely.geometry import Point,MultiPoint,LineString
@@ -47,13 +49,11 @@ region = 'Getz'
 #-- read the delineated GZ
 df = pd.read_csv(REF_FILE)
 
-#-- read velocity field
-vel_fid = nc.Dataset(VEL_FILE,'r')
-xvel = vel_fid['x'][:]
-yvel = vel_fid['y'][:]
-vx = vel_fid['VX'][:]
-vy = vel_fid['VY'][:]
-vel_fid.close()
+#-- read the velocity field around the points and get the flow angle at
+#-- the closest velocity coordinate of each point
+vel = velocity_sampler.VelocitySampler(VEL_FILE)
+ivs,jvs = vel.nearest(df['X (m)'].values,df['Y (m)'].values)
+angs = velocity_sampler.flow_angle(*vel.velocity(ivs,jvs))
 
 #-- read bedmachine
 fid = nc.Dataset(BEDMACHINE_FILE,'r')
@@ -75,8 +75,8 @@ poly = basins['geometry'][idx[0]]
 region_poly = poly.buffer(5e3)
 
 #-- read delineated lines
-#-- read the grounding lines
-df_gl = gpd.read_file(GL_FILE)
+#-- read the grounding lines (only the ones in the bounds of the region)
+df_gl = gl_catalog.read_catalog(GL_FILE,bbox=region_poly.bounds,columns=[])
 lines = []
 for i in range(len(df_gl)):
 	#-- extract geometry to see if it's in region of interest
@@ -118,11 +118,8 @@ for i in range(len(df)):
 		ii = np.argmin(np.abs(xr-x))
 		jj = np.argmin(np.abs(yr-y))
 		#-- now we want to get the slope at this point along the velocity direction
-		#-- get the closest velocity coordinate
-		iv = np.argmin(np.abs(xr - xvel))
-		jv = np.argmin(np.abs(yr - yvel))
-		#-- find flow angle
-		ang = np.arctan(vy[jv,iv]/vx[jv,iv])
+		#-- flow angle at the closest velocity coordinate
+		ang = angs[i]
 		xtrans,ytrans = dist*np.cos(ang),dist*np.sin(ang)
 		#-- get the number of pixels in each direction
 		nx = int(xtrans/dx)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+u"""
+line_error.py
+
+Distances between predicted and hand-drawn grounding lines, as used in
+mean_difference.py and manual_error.py.
+
+Each line is broken into segments, and each segment is paired with the
+hand-drawn lines that have more than 20% of their length inside its
+minimum rotated rectangle. The candidate lines of a segment are found
+with an STRtree (spatial_index.py). For each pair, the shorter line is
+the reference: every reference vertex points to its nearest vertex on the
+other line, the side-by-side duplicates are resolved, and each remaining
+vertex of the other line gives its distance to the nearest reference
+vertex. The nearest vertices are found with a KD-tree instead of the full
+distance matrix, with the same distances and ties as the matrix.
+
+The scenes of mean_difference.py and manual_error.py are evaluated in a
+process pool with run_scenes, and the summary statistics of all scenes
+are written once at the end with write_summary.
+"""
+import numpy as np
+from scipy import stats
+from scipy.spatial import cKDTree
+from multiprocessing import Pool
+from shapely.geometry import LineString
+from spatial_index import GeometryIndex
+
+#-- break a line into segments of at least n_seg coordinates, increasing
+#-- n_seg until the last segment has at least min_rem coordinates
+def split_line(line, n_seg=50, min_rem=10):
+	lcoords = list(line.coords)
+	if len(lcoords) < n_seg:
+		return [line]
+	while len(lcoords)%n_seg < min_rem:
+		n_seg += 1
+	return [LineString(lcoords[bc:bc+n_seg]) for bc in range(0,len(lcoords),n_seg)]
+
+#-- segments of the lines and the hand-drawn lines that overlap them
+#-- yields each segment, its minimum rotated rectangle and the paired line
+def line_pairs(lines, hd_lines, n_seg=50, min_rem=10):
+	index = GeometryIndex(hd_lines)
+	for line in lines:
+		for ml in split_line(line, n_seg=n_seg, min_rem=min_rem):
+			box = ml.minimum_rotated_rectangle
+			#-- get hd line segment that intersects the box
+			for j in index.query(box):
+				hd = hd_lines[j]
+				#-- if more than 20% of length is within the box, consider the line
+				if hd.intersection(box).length > hd.length/5:
+					yield ml,box,hd
+
+#-- index and distance of the nearest point (x,y) to each point (xq,yq)
+#-- with the lowest index for equal distances (as np.argmin of the rows
+#-- of the full distance matrix)
+def nearest(x, y, xq, yq, k=8):
+	n = len(x)
+	k = min(k,n)
+	tree = cKDTree(np.column_stack((x,y)))
+	dd,ii = tree.query(np.column_stack((xq,yq)),k=k)
+	dd = dd.reshape(len(xq),k)
+	ii = ii.reshape(len(xq),k)
+	#-- distances of the candidates as in the distance matrix
+	d = np.sqrt((x[ii]-xq[:,None])**2 + (y[ii]-yq[:,None])**2)
+	dmin = d.min(axis=1)
+	ind = np.where(d == dmin[:,None],ii,n).min(axis=1)
+	#-- points where other points could be as close as the candidates
+	#-- are checked against all the points
+	if k < n:
+		for i in np.nonzero(dd[:,-1] <= dmin*(1+1e-7) + 1e-9)[0]:
+			row = np.sqrt((x-xq[i])**2 + (y-yq[i])**2)
+			ind[i] = np.argmin(row)
+			dmin[i] = row[ind[i]]
+	return ind,dmin
+
+#-- distances between a reference line (x1,y1) and another line (x2,y2)
+#-- returns the distances and the indices of the vertices of the reference
+#-- line and the other line they are between
+def pair_distances(x1, y1, x2, y2):
+	x1,y1,x2,y2 = [np.asarray(v,dtype=float) for v in (x1,y1,x2,y2)]
+	#-- go along x1,y1 and find closest points on x2,y2
+	ind_list,dmin = nearest(x2, y2, x1, y1)
+	#-- get how many times each unique index is repeated
+	unique_list,u_count = np.unique(ind_list, return_counts=True)
+	#-- for repeating indices that are side-by-side (for example many 4s and many 5s),
+	#-- the line is out of bounds of the other line, and the far-away points are
+	#-- alternating between a few points on the refernec line. Make them all the same index
+	#-- closest distance to point u of the points pointing to u
+	near_u = np.full(len(x2),np.inf)
+	np.minimum.at(near_u, ind_list, dmin)
+	#-- closest distance to point u of the points pointing to u+1
+	nxt = ind_list - 1
+	ok = nxt >= 0
+	near_next = np.full(len(x2),np.inf)
+	np.minimum.at(near_next, nxt[ok], np.sqrt((x2[nxt[ok]]-x1[ok])**2 + (y2[nxt[ok]]-y1[ok])**2))
+	present = np.zeros(len(x2)+1,dtype=bool)
+	present[unique_list] = True
+	check = unique_list[(u_count > 1) & present[unique_list+1]]
+	closer = near_u[check] < near_next[check]
+	remove = np.zeros(len(x2)+1,dtype=bool)
+	remove[check[closer]+1] = True
+	remove[check[~closer]] = True
+	unique_list = unique_list[~remove[unique_list]]
+	#-- distance of each remaining point to the closest point of the reference line
+	w,dist = nearest(x1, y1, x2[unique_list], y2[unique_list])
+	return dist,w,unique_list
+
+#-- evaluate scenes in a pool of nproc processes (or in this process)
+#-- yields the results in the order of the jobs as they are done
+def run_scenes(func, jobs, nproc=1):
+	if nproc > 1:
+		pool = Pool(processes=nproc)
+		for res in pool.imap(func, jobs):
+			yield res
+		pool.close()
+		pool.join()
+	else:
+		for job in jobs:
+			yield func(job)
+
+#-- mean, minimum and maximum of the distances of a scene
+def scene_stats(dist):
+	if len(dist) == 0:
+		return np.nan,np.nan,np.nan
+	return np.mean(dist),np.min(dist),np.max(dist)
+
+#-- write the summary statistics of the mean distances of all scenes
+def write_summary(outtxt, distances, minims, maxims):
+	outtxt.write('\nMEAN\t\t\t\t%.1f m\n'%(np.nanmean(distances)))
+	outtxt.write('MIN\t\t\t\t\t%.1f m\n'%(np.nanmin(minims)))
+	outtxt.write('MAX\t\t\t\t\t%.1f m\n'%(np.nanmax(maxims)))
+	outtxt.write('Interquartile Range\t%.1f m\n'%(stats.iqr(distances,nan_policy='omit')))
+	outtxt.write('MAD\t\t\t\t\t%.1f m\n'%(stats.median_absolute_deviation(distances,nan_policy='omit')))
+	outtxt.write('STD\t\t\t\t\t%.1f m\n'%(np.nanstd(distances)))
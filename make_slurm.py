@@ -5,15 +5,17 @@ Yara Mohajerani
 
 Make slurm scripts for GP for large data directories.
 Calls run_prediction.py
+With --CATALOG the tiles are taken from a tile catalog (tile_catalog.py)
 """
 import os
 import sys
 import getopt
+import tile_catalog
 
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['DATA_DIR=','SLURM_DIR=','CODE_DIR=','NUM=','MODEL=','USER=','CLOBBER']
+	long_options=['DATA_DIR=','SLURM_DIR=','CODE_DIR=','NUM=','MODEL=','USER=','CLOBBER','CATALOG=']
 	optlist,arglist = getopt.getopt(sys.argv[1:],'D:S:C:N:M:U:L',long_options)
 
 	#-- Set default settings
@@ -24,6 +26,7 @@ def main():
 	CLOBBER = False
 	model_str = 'atrous_32init_drop0.2_customLossR727.dir'
 	user = 'ymohajer'
+	catalog_file = None
 	for opt, arg in optlist:
 		if opt in ("-D","--DATA_DIR"):
 			ddir = os.path.expanduser(arg)
@@ -39,12 +42,17 @@ def main():
 			user = arg
 		elif opt in ("L","--CLOBBER"):
 			CLOBBER = True
+		elif opt == "--CATALOG":
+			catalog_file = os.path.expanduser(arg)
 
 	#-- if ddir ends with '/', remove so we can get basename
 	if ddir.endswith('/'):
 		ddir = ddir[:-1]
 	#-- Get list of images
-	fileList = os.listdir(ddir)
+	if catalog_file is not None:
+		fileList = [r['name'] for r in tile_catalog.query(catalog_file, ddir, kind='coco')]
+	else:
+		fileList = os.listdir(ddir)
 
 	#-- if not overwriting, only get files that don't already exist
 	if not CLOBBER:
@@ -77,8 +85,9 @@ def main():
 		fid.write("#SBATCH --mail-type=FAIL\n\n")
 
 		fid.write('source ~/miniconda3/bin/activate gl_env\n')
-		fid.write('python %s --DIR=%s --NUM=%i --START=%i --MODEL_DIR=%s\n'%\
-			(os.path.join(code_dir,'run_prediction.py'),ddir,num,cc,code_dir))
+		cat_str = ' --CATALOG=%s'%catalog_file if catalog_file else ''
+		fid.write('python %s --DIR=%s --NUM=%i --START=%i --MODEL_DIR=%s%s\n'%\
+			(os.path.join(code_dir,'run_prediction.py'),ddir,num,cc,code_dir,cat_str))
 		fid.close()
 
 		#-- add job to list 
@@ -7,6 +7,7 @@ Construct a dynamic u-net model with a variable
 number of layers for glacier calving front detection.
 
 Update History
+	11/2020	Allow None height and width for fully-convolutional inference
 	03/2020	Add atrous U-net-like model
     01/2019 Fix batch normalization axis input
     09/2018 Add multiple functions to test different versions
@@ -27,6 +28,14 @@ from keras.layers.normalization import BatchNormalization
 import os
 import imp
 
+#-----------------------------------------------------------------------------------
+#-- shape of the flattened output (any size if the input dimensions are None)
+#-----------------------------------------------------------------------------------
+def flat_shape(height,width):
+	if (height is None) or (width is None):
+		return (-1,1,)
+	return (height*width,1,)
+
 #-----------------------------------------------------------------------------------
 #-- model with no pooling or upsampling
 #-----------------------------------------------------------------------------------
@@ -70,7 +79,7 @@ def nn_model_atrous_noPool(height=0,width=0,channels=1,n_filts=32,drop=0):
 	#-- do one final sigmoid convolution into just 1 final channel (None,h,w,1)
 	c7 = kl.Conv2D(1,1,activation='sigmoid')(c6)
 	#-- reshape into a flattened output to match sample weights
-	c8 = kl.Reshape((height*width,1,))(c7)
+	c8 = kl.Reshape(flat_shape(height,width))(c7)
 
 	#-- make model
 	model = km.Model(inputs=inputs,outputs=c8)
@@ -139,7 +148,7 @@ def nn_model_atrous_double_dropout(height=0,width=0,channels=1,n_filts=32,drop=0
 	#-- do one final sigmoid convolution into just 1 final channel (None,h,w,1)
 	c16 = kl.Conv2D(1,1,activation='sigmoid')(c15)
 	#-- reshape into a flattened output to match sample weights
-	c17 = kl.Reshape((height*width,1,))(c16)
+	c17 = kl.Reshape(flat_shape(height,width))(c16)
 
 	#-- make model
 	model = km.Model(inputs=inputs,outputs=c17)
@@ -203,7 +212,7 @@ def unet_model_linear_dropout(height=0,width=0,channels=1,n_init=12,n_layers=2,d
     c[i] = kl.Conv2D(1,1,activation='sigmoid')(c[i-1])
     #-- reshape into a flattened output to match sample weights
     i += 1
-    c[i] = kl.Reshape((height*width,1,))(c[i-1])
+    c[i] = kl.Reshape(flat_shape(height,width))(c[i-1])
 
     print('output shape: ', c[i].shape)
     print('Total Number of layers: ',i)
@@ -280,7 +289,7 @@ def unet_model_double_dropout(height=0,width=0,channels=1,n_init=12,n_layers=2,d
     c[i] = kl.Conv2D(1,1,activation='sigmoid')(c[i-1])
     #-- reshape into a flattened output to match sample weights
     i += 1
-    c[i] = kl.Reshape((height*width,1,))(c[i-1])
+    c[i] = kl.Reshape(flat_shape(height,width))(c[i-1])
 
     print('output shape: ', c[i].shape)
     print('Total Number of layers: ',i)
@@ -347,7 +356,7 @@ def unet_model_linear_normalized(height=0,width=0,channels=1,n_init=12,n_layers=
     c[i] = BatchNormalization(axis=-1)(kl.Conv2D(1,1,activation='sigmoid')(c[i-1]))
     #-- reshape into a flattened output to match sample weights
     i += 1
-    c[i] = kl.Reshape((height*width,1,))(c[i-1])
+    c[i] = kl.Reshape(flat_shape(height,width))(c[i-1])
 
     print('output shape: ', c[i].shape)
     print('Total Number of layers: ',i)
@@ -416,7 +425,7 @@ def unet_model_double_normalized(height=0,width=0,channels=1,n_init=12,n_layers=
     c[i] = BatchNormalization(axis=-1)(kl.Conv2D(1,1,activation='sigmoid')(c[i-1]))
     #-- reshape into a flattened output to match sample weights
     i += 1
-    c[i] = kl.Reshape((height*width,1,))(c[i-1])
+    c[i] = kl.Reshape(flat_shape(height,width))(c[i-1])
 
     print('output shape: ', c[i].shape)
     print('Total Number of layers: ',i)
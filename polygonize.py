@@ -4,6 +4,13 @@ polygonize.py
 Yara Mohajerani (Last update 09/2020)
 
 Read output predictions and convert to shapefile lines
+
+With --CATALOG the stitched scenes are taken from a tile catalog
+(tile_catalog.py) instead of listing the directory.
+
+With --noSLURM no individual contour files and Slurm jobs are written.
+Instead the job list runs centerline_engine.py once for each scene, which
+gets all the centerlines of the scene with --NPROC processes.
 """
 import os
 import sys
@@ -11,14 +18,15 @@ import rasterio
 import numpy as np
 import getopt
 import shapefile
-from skimage.measure import find_contours
-from shapely.geometry import Polygon,LineString,Point
+import tile_catalog
+import geotiff_io
+import contour_utils
 
 
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['DIR=','FILTER=','OUT_BASE=','CODE_BASE=','IN_BASE=','noMASK']
+	long_options=['DIR=','FILTER=','OUT_BASE=','CODE_BASE=','IN_BASE=','noMASK','CATALOG=','noSLURM','NPROC=']
 	optlist,arglist = getopt.getopt(sys.argv[1:],'D:F:O:C:I:M',long_options)
 
 	#-- Set default settings
@@ -29,6 +37,9 @@ def main():
 	out_base = '/DFS-L/DATA/gl_ml'
 	make_mask = True
 	in_base = os.path.expanduser('~/GL_learning_data')
+	catalog_file = None
+	use_slurm = True
+	nproc = 1
 	for opt, arg in optlist:
 		if opt in ("-D","--DIR"):
 			subdir = arg
@@ -43,6 +54,12 @@ def main():
 			code_base = os.path.expanduser(arg)
 		elif opt in ("M","--noMASK"):
 			make_mask = False
+		elif opt == "--CATALOG":
+			catalog_file = os.path.expanduser(arg)
+		elif opt == "--noSLURM":
+			use_slurm = False
+		elif opt == "--NPROC":
+			nproc = int(arg)
 	flt_str = '_%.1fkm'%(FILTER/1000)
 
 	#-- make sure out directory doesn't end with '\' so we can get parent directory
@@ -51,8 +68,12 @@ def main():
 	indir = os.path.join(in_base,subdir)
 
 	#-- Get list of files
-	fileList = os.listdir(indir)
-	pred_list = [f for f in fileList if (f.endswith('.tif') and ('mask' not in f))]
+	if catalog_file is not None:
+		pred_list = [r['name'] for r in tile_catalog.query(catalog_file, indir)
+			if (r['name'].endswith('.tif') and ('mask' not in r['name']))]
+	else:
+		fileList = os.listdir(indir)
+		pred_list = [f for f in fileList if (f.endswith('.tif') and ('mask' not in f))]
 	#-- LOCAL output directory
 	local_output_dir = os.path.join(indir,'shapefiles.dir')
 	#-- make output directory if it doesn't exist
@@ -67,7 +88,7 @@ def main():
 	print('# of files: ', len(pred_list))
 	
 	#-- threshold for getting contours and centerlines
-	eps = 0.3
+	eps = contour_utils.EPS
 
 	#-- open file for list of polygons to run through centerline routine
 	list_fid = open(os.path.join(slurm_dir,'total_job_list%s.sh'%flt_str),'w')
@@ -76,13 +97,15 @@ def main():
 	#-- get contours and save each as a line in shapefile format
 	for pcount,f in enumerate(pred_list):
 		#-- open job list for this file
-		sub_list_fid = open(os.path.join(slurm_dir,f.replace('.tif','%s.sh'%flt_str)),'w')
+		if use_slurm:
+			sub_list_fid = open(os.path.join(slurm_dir,f.replace('.tif','%s.sh'%flt_str)),'w')
 		#-- read file
 		raster = rasterio.open(os.path.join(indir,f),'r')
-		im = raster.read(1)
+		im = geotiff_io.read_band(raster)
 		#-- get transformation matrix
 		trans = raster.transform
 
+		mask = None
 		if make_mask:
 			#-- also read the corresponding mask file
 			mask_file = os.path.join(indir,f.replace('.tif','_mask.tif'))
@@ -90,111 +113,32 @@ def main():
 			mask = mask_raster.read(1)
 			mask_raster.close()
 
-		#-- get contours of prediction
-		#-- close contour ends to make polygons
-		im[np.nonzero(im[:,0] > eps),0] = eps
-		im[np.nonzero(im[:,-1] > eps),-1] = eps
-		im[0,np.nonzero(im[0,:] > eps)] = eps
-		im[-1,np.nonzero(im[-1,:] > eps)] = eps
-		contours = find_contours(im, eps)
-		#-- make contours into closed polyons to find pinning points
-		#-- also apply noise filter and append to noise list
-		x = {}
-		y = {}
-		noise = []
-		none_list = []
-		pols = [None]*len(contours)
-		pol_type = [None]*len(contours)
-		for n,contour in enumerate(contours):
-			#-- convert to coordinates
-			x[n],y[n] = rasterio.transform.xy(trans, contour[:,0], contour[:,1])
-			if len(x[n]) < 3:
-				pols[n] = None
-				none_list.append(n)
-			else:
-				pols[n] = Polygon(zip(x[n],y[n]))
-			if make_mask:
-				#-- get elements of mask the contour is on
-				submask = mask[np.round(contour[:, 0]).astype('int'), np.round(contour[:, 1]).astype('int')]
-				#-- if more than half of the elements are from test tile, count contour as test type
-				if np.count_nonzero(submask) > submask.size/2.:
-					pol_type[n] = 'Test'
-				else:
-					pol_type[n] = 'Train'
-			else:
-				pol_type[n] = 'Test'
-
-		#-- loop through remaining polygons and determine which ones are 
-		#-- pinning points based on the width and length of the bounding box
-		pin_list = []
-		box_ll = [None]*len(contours)
-		box_ww = [None]*len(contours)
-		for n in range(len(pols)):
-			if n not in none_list:
-				box_ll[n] = pols[n].length
-				box_ww[n] = pols[n].area/box_ll[n]
-				#-- if the with is larger than 1/25 of the length, it's a pinning point
-				if box_ww[n] > box_ll[n]/25:
-					pin_list.append(n)
-
-		#-- Loop through all the polygons and take any overlapping areas out
-		#-- of the enclosing polygon and ignore the inside polygon
-		ignore_list = []
-		for i in range(len(pols)):
-			for j in range(len(pols)):
-				if (i != j) and (i not in none_list) and (j not in none_list) and pols[i].contains(pols[j]):
-					# pols[i] = pols[i].difference(pols[j])
-					if (i in pin_list) and (j in pin_list):
-						#-- if it's a pinning point, ignore outer loop
-						ignore_list.append(i)
-					else:
-						#-- if not, add inner loop to ignore list
-						ignore_list.append(j)
-
-		#-- get rid of duplicates in ignore list
-		ignore_list = list(set(ignore_list))
-
-		#-- loop through and apply noise filter
-		for n in range(len(contours)):
-			#-- apply filter
-			if (n not in none_list) and (n not in ignore_list) and (len(x[n]) < 2 or LineString(zip(x[n],y[n])).length <= FILTER):
-				noise.append(n)
-
-		#-- find overlap between ignore list nad noise list
-		if len(list(set(noise) & set(ignore_list))) != 0:
-			sys.exit('Overlap not empty: ', list(set(noise) & set(ignore_list)))
-		#-- find overlap between ignore list nad none list
-		if len(list(set(none_list) & set(ignore_list))) != 0:
-			sys.exit('Overlap not empty: ', list(set(none_list) & set(ignore_list)))
-
+		#-- get contours of prediction, find the pinning points (width larger
+		#-- than 1/25 of the length), the contours ignored inside other
+		#-- contours and the noise, and label the pinning points and lines
+		#-- (test contours have more than half of their mask elements from
+		#-- test tiles)
+		rec,xy,er_lbl = contour_utils.scene_contours(im, trans, mask=mask, FILTER=FILTER, eps=eps)
+		pol_type = np.where(rec['test'],'Test','Train')
+		none = contour_utils.has_flag(rec, contour_utils.NONE)
+		box_ll = [None if none[n] else float(rec['length'][n]) for n in range(len(rec))]
+		box_ww = [None if none[n] else float(rec['width'][n]) for n in range(len(rec))]
 
 		#-- initialize list of contour linestrings
-		er = [None]*len(contours)
-		n = 0  # total center line counter
+		er = [None]*len(rec)
 		er_type = [None]*len(er)
 		er_class = [None]*len(er)
-		er_lbl = [None]*len(er)
 		count = 1 #-- file count
-		pc = 1 # pinning point counter
-		lc = 1 # line counter
-		#-- loop through polygons and save to separate files
-		for idx,p in enumerate(pols):
-			er[idx] = [list(a) for a in zip(x[idx],y[idx])]
-			er_type[idx] = pol_type[idx]
-			if (idx in noise) or (idx in none_list):
-				er_class[idx] = 'Noise'			
-			elif idx in ignore_list:
-				er_class[idx] = 'Ignored Contour'
-			else:
-				if idx in pin_list:
-					er_class[idx] = 'Pinning Contour'
-					er_lbl[idx] = 'pin_err%i'%pc
-					pc += 1 #- incremenet pinning point counter
-				else:
-					er_class[idx] = 'GL Uncertainty'
-					#-- set label
-					er_lbl[idx] = 'err%i'%lc
-					lc += 1 #- incremenet line counter
+		#-- loop through contours and save lines to separate files
+		for idx in range(len(rec)):
+			er[idx] = xy[idx].tolist()
+			er_type[idx] = str(pol_type[idx])
+			code = rec['code'][idx]
+			er_class[idx] = contour_utils.CLASS_NAMES[code]
+			if code in (contour_utils.PIN_CLASS,contour_utils.GL_CLASS):
+				#-- without slurm the centerlines are run for the whole scene
+				if not use_slurm:
+					continue
 				
 				#-- write individual polygon to file
 				out_name = f.replace('.tif','%s_ERR_%i'%(flt_str,count))
@@ -216,7 +160,7 @@ def main():
 				
 				#-- write corresponding slurm file
 				#-- calculate run time
-				run_time = int(p.length/300)+10
+				run_time = int(rec['length'][idx]/300)+10
 
 				outfile = os.path.join(slurm_dir,'%s.sh'%out_name)
 				fid = open(outfile,'w')
@@ -241,9 +185,14 @@ def main():
 
 				count += 1
 		
-		sub_list_fid.close()
-		#-- add sub list fid to total job list
-		list_fid.write('sh %s\n'%os.path.join(out_base,subdir,'slurm.dir',f.replace('.tif','%s.sh'%flt_str)))
+		if use_slurm:
+			sub_list_fid.close()
+			#-- add sub list fid to total job list
+			list_fid.write('sh %s\n'%os.path.join(out_base,subdir,'slurm.dir',f.replace('.tif','%s.sh'%flt_str)))
+		else:
+			#-- add centerlines of the whole scene to total job list
+			list_fid.write('python %s --NPROC=%i %s\n'%(os.path.join(code_base,'centerline_engine.py'),nproc,
+				os.path.join(out_base,subdir,'shapefiles.dir',f.replace('.tif','%s_ERR.shp'%flt_str))))
 
 		
 		#-- save all contours to file
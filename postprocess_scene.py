@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+u"""
+postprocess_scene.py
+
+Single-pass postprocessing of stitched scenes: go from the probability
+raster straight to the final contour (<scene>_ERR.shp) and grounding line
+(<scene>.shp) shapefiles, keeping the contours, their classification and
+the centerlines in memory. This replaces polygonize.py, run_centerline.py
+and combine_shapefiles.py without the intermediate files.
+
+The contours are classified as in polygonize.py and the centerlines are
+drawn as in centerline_engine.py (with the same time limit for each line).
+The centerlines of all the scenes are drawn by one pool of --NPROC worker
+processes, and the contours of the next scene are found in this process
+whenever the workers need more lines, so at most --NPROC lines are drawn
+at a time.
+
+python postprocess_scene.py --DIR=<directory of stitched scenes> --FILTER=<minimum line threshold in meters> --NPROC=<# of processes> [--BACKEND=voronoi or skeleton] [--noMASK] [--CLOBBER]
+"""
+import os
+import sys
+import time
+import getopt
+import rasterio
+import numpy as np
+import shapefile
+import geotiff_io
+import tile_catalog
+import contour_utils
+import centerline_engine
+
+#-- fields of the output shapefiles
+FIELDS = ['ID','Type','Class','Length','Width']
+
+#-- write lines and their records to a shapefile and its .prj file
+def write_lines(out_file, lines, records, crs_wkt):
+	w = shapefile.Writer(out_file)
+	for f in FIELDS:
+		w.field(f,'C')
+	for line,record in zip(lines,records):
+		w.line([line])
+		w.record(*record)
+	w.close()
+	prj = open(out_file.replace('.shp','.prj'), "w")
+	prj.write(crs_wkt)
+	prj.close()
+
+#-- contours and classification of one scene, written to the contour file
+#-- returns the scene name, the contour records, coordinates and labels,
+#-- the records of the contour file and the crs of the scene
+def scene_contour_file(args):
+	in_file,output_dir,FILTER,make_mask = args
+	flt_str = '_%.1fkm'%(FILTER/1000)
+	name = os.path.basename(in_file)
+	#-- read file
+	raster = rasterio.open(in_file,'r')
+	im = geotiff_io.read_band(raster)
+	trans = raster.transform
+	crs_wkt = raster.crs.to_wkt()
+	raster.close()
+	mask = None
+	if make_mask:
+		mask_raster = rasterio.open(in_file.replace('.tif','_mask.tif'),'r')
+		mask = mask_raster.read(1)
+		mask_raster.close()
+
+	rec,xy,lbl = contour_utils.scene_contours(im, trans, mask=mask, FILTER=FILTER)
+	none = contour_utils.has_flag(rec, contour_utils.NONE)
+	er_records = []
+	for idx in range(len(rec)):
+		ll = None if none[idx] else float(rec['length'][idx])
+		ww = None if none[idx] else float(rec['width'][idx])
+		er_records.append([lbl[idx], 'Test' if rec['test'][idx] else 'Train',
+			contour_utils.CLASS_NAMES[rec['code'][idx]], ll, ww])
+	#-- write contours
+	write_lines(os.path.join(output_dir,name.replace('.tif','%s_ERR.shp'%flt_str)),
+		[v.tolist() for v in xy], er_records, crs_wkt)
+	return name,rec,xy,lbl,er_records,crs_wkt
+
+#-- centerline jobs ((scene, contour), coordinates, backend) of the scenes,
+#-- finding the contours of each scene when its first job is needed
+#-- the contours, labels and centerlines of the scenes are kept in scenes
+def scene_jobs(jobs, scenes, output_dir, FILTER, backend='voronoi'):
+	for k,job in enumerate(jobs):
+		t0 = time.time()
+		name,rec,xy,lbl,er_records,crs_wkt = scene_contour_file(job)
+		#-- centerlines: pinning points are the contours themselves
+		cn = {}
+		gl_jobs = []
+		for idx in range(len(rec)):
+			if rec['code'][idx] == contour_utils.PIN_CLASS:
+				cn[idx] = xy[idx].tolist()
+			elif rec['code'][idx] == contour_utils.GL_CLASS:
+				gl_jobs.append(((k,idx),xy[idx],backend))
+		#-- run the longest lines first so they don't hold up the workers at the end
+		gl_jobs.sort(key=lambda j: len(j[1]), reverse=True)
+		scenes[k] = dict(name=name, rec=rec, lbl=lbl, er_records=er_records,
+			crs_wkt=crs_wkt, cn=cn, left=len(gl_jobs), failed=0, t0=t0)
+		if len(gl_jobs) == 0:
+			write_centerlines(output_dir, FILTER, scenes.pop(k))
+		for j in gl_jobs:
+			yield j
+
+#-- write the centerline file of a scene once all its lines are done
+def write_centerlines(output_dir, FILTER, scene):
+	flt_str = '_%.1fkm'%(FILTER/1000)
+	rec,lbl,er_records,cn = scene['rec'],scene['lbl'],scene['er_records'],scene['cn']
+	cn_records = []
+	for idx in sorted(cn.keys()):
+		cls = 'Pinning Point' if (rec['code'][idx] == contour_utils.PIN_CLASS) else 'Grounding Line'
+		cn_records.append([lbl[idx].replace('err',''), er_records[idx][1], cls,
+			er_records[idx][3], er_records[idx][4]])
+	write_lines(os.path.join(output_dir,scene['name'].replace('.tif','%s.shp'%flt_str)),
+		[cn[idx] for idx in sorted(cn.keys())], cn_records, scene['crs_wkt'])
+	print('%s: %i contours, %i centerlines, %i failed (%.1f s)'%(scene['name'],
+		len(rec),len(cn),scene['failed'],time.time()-scene['t0']))
+
+#-- contours, classification and centerlines of the scenes, with the
+#-- centerlines of all scenes drawn by one pool of nproc workers
+def postprocess_scenes(jobs, output_dir, FILTER, nproc=1, backend='voronoi'):
+	scenes = {}
+	for (k,idx),coords,err in centerline_engine.run_jobs(centerline_engine.centerline_job,
+		scene_jobs(jobs, scenes, output_dir, FILTER, backend=backend),
+		centerline_engine.centerline_failed, nproc=nproc):
+		scene = scenes[k]
+		if coords is None:
+			print('%s contour %s: %s'%(scene['name'],scene['lbl'][idx],err))
+			scene['failed'] += 1
+		else:
+			scene['cn'][idx] = coords
+		scene['left'] -= 1
+		if scene['left'] == 0:
+			write_centerlines(output_dir, FILTER, scenes.pop(k))
+
+#-- main function
+def main():
+	#-- Read the system arguments listed after the program
+	long_options=['DIR=','FILTER=','NPROC=','BACKEND=','noMASK','CLOBBER','CATALOG=']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'D:F:P:B:MC',long_options)
+
+	#-- Set default settings
+	indir = os.path.join(os.path.expanduser('~'),'GL_learning_data','geocoded_v1',\
+		'stitched.dir','atrous_32init_drop0.2_customLossR727.dir')
+	FILTER = 0.
+	nproc = 1
+	backend = 'voronoi'
+	make_mask = True
+	clobber = False
+	catalog_file = None
+	for opt, arg in optlist:
+		if opt in ("-D","--DIR"):
+			indir = os.path.expanduser(arg)
+		elif opt in ("-F","--FILTER"):
+			if arg not in ['NONE','none','None','N','n',0]:
+				FILTER = float(arg)
+		elif opt in ("-P","--NPROC"):
+			nproc = int(arg)
+		elif opt in ("-B","--BACKEND"):
+			backend = arg.lower()
+		elif opt in ("-M","--noMASK"):
+			make_mask = False
+		elif opt in ("-C","--CLOBBER"):
+			clobber = True
+		elif opt == "--CATALOG":
+			catalog_file = os.path.expanduser(arg)
+	if backend not in centerline_engine.BACKENDS:
+		sys.exit('Unknown backend %s'%backend)
+	flt_str = '_%.1fkm'%(FILTER/1000)
+
+	#-- Get list of files
+	if catalog_file is not None:
+		pred_list = [r['name'] for r in tile_catalog.query(catalog_file, indir)
+			if (r['name'].endswith('.tif') and ('mask' not in r['name']))]
+	else:
+		pred_list = [f for f in os.listdir(indir) if (f.endswith('.tif') and ('mask' not in f))]
+	#-- output directory
+	output_dir = os.path.join(indir,'shapefiles.dir')
+	if not os.path.exists(output_dir):
+		os.mkdir(output_dir)
+	#-- skip scenes that are already done
+	if not clobber:
+		existing = os.listdir(output_dir)
+		pred_list = [f for f in pred_list if not ((f.replace('.tif','%s.shp'%flt_str) in existing)
+			and (f.replace('.tif','%s_ERR.shp'%flt_str) in existing))]
+	print('# of files: ', len(pred_list))
+
+	jobs = [(os.path.join(indir,f),output_dir,FILTER,make_mask) for f in sorted(pred_list)]
+	postprocess_scenes(jobs, output_dir, FILTER, nproc=nproc, backend=backend)
+
+#-- run main program
+if __name__ == '__main__':
+	main()
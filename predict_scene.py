@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+u"""
+predict_scene.py
+
+Run the trained network directly on whole DInSAR scenes instead of
+512x512 tiles, without writing and stitching intermediate tile files.
+
+The model is built with no fixed input size and each scene is read in
+windows of --WINDOW pixels that overlap their neighbours by 2*--HALO.
+The predictions of the windows are blended in memory with the same
+Gaussian kernel as stitch_tile.py, and the finished rows are written
+strip by strip to one probability raster per scene in
+<DIR>/<model>.dir/stitched.dir (geotiff_io.py, optionally quantized to
+uint8 with --QUANTIZE).
+"""
+import os
+import sys
+import imp
+import getopt
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from export_model import build_model
+import geotiff_io
+
+#-- Gaussian weights of a window (same as in stitch_tile.py)
+def gaussian_kernel(ny, nx, sigma_kernel=0.05, flag_gaussian_weight=True):
+	if not flag_gaussian_weight:
+		return np.ones((ny,nx),dtype=np.float32)
+	gx = np.arange(nx)
+	gx = (gx-gx[-1]/2.0)/(nx/2)
+	gy = np.arange(ny)
+	gy = (gy-gy[-1]/2.0)/(ny/2)
+	gxx,gyy = np.meshgrid(gx,gy)
+	return np.exp(-(gxx**2+gyy**2)/sigma_kernel).astype(np.float32)
+
+#-- start positions of windows of size n with step s covering length nt
+def window_starts(nt, n, s):
+	nw = max(int(np.ceil((nt - n)/s)),0) + 1
+	return [i*s for i in range(nw)]
+
+#-- read a window of the complex scene as (h,w,2) float32
+#-- parts of the window outside of the scene are set to 0
+def read_window(raster, x0, y0, n):
+	img = np.zeros((n,n,2),dtype=np.float32)
+	nx = min(n,raster.width-x0)
+	ny = min(n,raster.height-y0)
+	band = raster.read(1, window=Window(x0,y0,nx,ny))
+	img[:ny,:nx,0] = band.real
+	img[:ny,:nx,1] = band.imag
+	return img
+
+#-- predict and blend one scene, writing the output in strips
+def predict_scene(model, in_file, out_file, window=2048, halo=128, kernel=None,
+	batch_size=4, quantize=False):
+	step = window - 2*halo
+	if kernel is None:
+		kernel = gaussian_kernel(window, window)
+	raster = rasterio.open(in_file,'r')
+	nx_out = raster.width
+	ny_out = raster.height
+	#-- set up the output with the same georeferencing as the scene
+	out = geotiff_io.StripWriter(out_file, nx_out, ny_out, raster.transform.to_gdal(),
+		raster.crs.to_wkt(), quantize=quantize)
+	#-- buffers for the rows covered by the current row of windows
+	arr_sum = np.zeros((window,nx_out+window),dtype=np.float32)
+	arr_weight = np.zeros((window,nx_out+window),dtype=np.float32)
+	x_starts = window_starts(nx_out, window, step)
+	y_starts = window_starts(ny_out, window, step)
+	for j,y0 in enumerate(y_starts):
+		#-- run the model on the row of windows in batches
+		for b in range(0,len(x_starts),batch_size):
+			xs = x_starts[b:b+batch_size]
+			imgs = np.array([read_window(raster, x0, y0, window) for x0 in xs])
+			out_imgs = model.predict(imgs, batch_size=batch_size)
+			out_imgs = out_imgs.reshape(len(xs),window,window)
+			#-- set nan elements to 0
+			out_imgs[np.isnan(out_imgs)] = 0.0
+			for x0,tile in zip(xs,out_imgs):
+				arr_sum[:,x0:x0+window] += tile*kernel
+				arr_weight[:,x0:x0+window] += kernel
+		#-- rows above the next row of windows are complete
+		y1 = y_starts[j+1] if (j+1 < len(y_starts)) else ny_out
+		nrows = min(y1,ny_out) - y0
+		with np.errstate(invalid='ignore',divide='ignore'):
+			arr_out = arr_sum[:nrows,:nx_out]/arr_weight[:nrows,:nx_out]
+		#-- nan values from division by 0 are set to 0 (no window coverage)
+		arr_out[np.isnan(arr_out)] = 0.0
+		arr_out[arr_out < 0] = 0.0
+		out.write(arr_out, y0)
+		#-- shift the buffers to the start of the next row of windows
+		arr_sum[:window-step] = arr_sum[step:]
+		arr_sum[window-step:] = 0.0
+		arr_weight[:window-step] = arr_weight[step:]
+		arr_weight[window-step:] = 0.0
+	raster.close()
+	out.close()
+
+#-- main function
+def main():
+	#-- Read the system arguments listed after the program
+	long_options=['DIR=','DOWN=','INIT=','DROPOUT=','RATIO=','MOD=','MODEL_DIR=',
+		'WINDOW=','HALO=','KERNEL=','noFLAG','BATCH=','QUANTIZE']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'D:W:I:O:R:M:L:N:H:K:FB:Q',long_options)
+
+	#-- Set default settings
+	ddir = os.path.expanduser('~/GL_learning_data/scenes')
+	model_dir = os.path.join(os.path.expanduser('~'),'GL_learning')
+	ndown = 4 # number of 'down' steps
+	ninit = 32 #number of channels to start with
+	dropout_frac = 0.2 # dropout fraction (only used for the name of the model)
+	ratio = 727 # penalization ratio for GL and non-GL points based on smaller dataaset
+	mod_lbl = 'atrous'
+	window = 2048
+	halo = 128
+	flag_gaussian_weight = True
+	sigma_kernel = 0.05
+	batch_size = 4
+	quantize = False
+	for opt, arg in optlist:
+		if opt in ("-D","--DIR"):
+			ddir = os.path.expanduser(arg)
+		elif opt in ("-L","--MODEL_DIR"):
+			model_dir = os.path.expanduser(arg)
+		elif opt in ("-W","--DOWN"):
+			ndown = int(arg)
+		elif opt in ("-I","--INIT"):
+			ninit = int(arg)
+		elif opt in ("-O","--DROPOUT"):
+			dropout_frac = float(arg)
+		elif opt in ("-R","--RATIO"):
+			ratio = float(arg)
+		elif opt in ("-M","--MOD"):
+			mod_lbl = arg
+		elif opt in ("-N","--WINDOW"):
+			window = int(arg)
+		elif opt in ("-H","--HALO"):
+			halo = int(arg)
+		elif opt in ("-K","--KERNEL"):
+			sigma_kernel = float(arg)
+		elif opt in ("-F","--noFLAG"):
+			flag_gaussian_weight = False
+			print('Not using Gaussian kernel.')
+		elif opt in ("-B","--BATCH"):
+			batch_size = int(arg)
+		elif opt in ("-Q","--QUANTIZE"):
+			quantize = True
+
+	#-- set up model name
+	if mod_lbl == 'unet':
+		mod_str = '{0}_{1}init_{2}down_drop{3:.1f}_customLossR{4}'.\
+			format(mod_lbl,ninit,ndown,dropout_frac,ratio)
+		#-- the window has to be divisible by all the pooling steps
+		factor = 2**(ndown-1)
+	elif mod_lbl == 'atrous':
+		mod_str = '{0}_{1}init_drop{2:.1f}_customLossR{3}'.\
+			format(mod_lbl,ninit,dropout_frac,ratio)
+		factor = 8
+	else:
+		sys.exit('model label not matching.')
+	if (window % factor) != 0:
+		sys.exit('WINDOW has to be a multiple of %i for this model.'%factor)
+	if (2*halo >= window):
+		sys.exit('HALO has to be smaller than half of the WINDOW.')
+
+	#-- checkpoint file
+	chk_file = os.path.join(model_dir,'{0}_weights.h5'.format(mod_str))
+	if not os.path.isfile(chk_file):
+		sys.exit('Model does not previously exist.')
+
+	#-- build the model with no fixed input size (without dropout for inference)
+	mod_module = imp.load_source('nn_model',os.path.join(model_dir,'nn_model.py'))
+	model = build_model(mod_module, mod_lbl, None, None, 2, ninit=ninit, ndown=ndown, drop=0)
+	print(chk_file)
+	model.load_weights(chk_file)
+
+	#-- output directory
+	path_stitched = os.path.join(ddir,'{0}.dir'.format(mod_str),'stitched.dir')
+	if not os.path.exists(path_stitched):
+		os.makedirs(path_stitched)
+
+	#-- Gaussian kernel of each window
+	kernel = gaussian_kernel(window, window, sigma_kernel=sigma_kernel,
+		flag_gaussian_weight=flag_gaussian_weight)
+
+	#-- Get list of scenes
+	scene_list = sorted([f for f in os.listdir(ddir) if f.endswith('.tif')])
+	for f in scene_list:
+		print(f)
+		out_file = os.path.join(path_stitched,f)
+		predict_scene(model, os.path.join(ddir,f), out_file, window=window,
+			halo=halo, kernel=kernel, batch_size=batch_size, quantize=quantize)
+
+#-- run main program
+if __name__ == '__main__':
+	main()
@@ -4,28 +4,156 @@ run_prediction.py
 by Yara Mohajerani (07/2020)
 
 Run already trained network on specifed data.
+
+The tiles are streamed through three overlapping stages: reader threads
+read batches of tiles into float32 arrays, the main thread runs the model
+on each batch (--BATCH tiles at a time), and writer threads save the
+predictions as compressed GeoTIFFs (geotiff_io.py, optionally quantized
+to uint8 with --QUANTIZE). The queues between the stages are
+bounded (--QUEUE batches), so memory does not depend on --NUM.
+
+With --CATALOG the tiles are taken from a tile catalog (tile_catalog.py)
+instead of listing the data directory.
 """
 #-- Import Modules
 import os
 import sys
 import imp
+import queue
 import getopt
+import threading
+import traceback
 import numpy as np
 import rasterio
-from osgeo import gdal,osr
 import keras
 import timeit
 from keras import backend as K
 from keras.preprocessing import image
 from tensorflow.python.client import device_lib
+from export_model import FrozenModel
+import tile_catalog
+import geotiff_io
+
+#-- read a list of tiles into a float32 batch
+#-- also returns the transformation and epsg code of each tile
+def read_batch(ddir, files, h, wi, ch):
+	imgs = np.ones((len(files),h,wi,ch),dtype=np.float32)
+	trans = [None]*len(files)
+	epsg = [None]*len(files)
+	for i,f in enumerate(files):
+		#-- read image
+		raster = rasterio.open(os.path.join(ddir,f))
+		try:
+			band = raster.read(1)
+			imgs[i,:,:,0] = band.real
+			imgs[i,:,:,1] = band.imag
+		except:
+			print('Skipping %s'%f)
+			imgs[i,:,:,0] = None
+			imgs[i,:,:,1] = None
+		#-- get transformation matrix
+		trans[i] = raster.transform
+		epsg[i] = raster.crs.to_epsg()
+		raster.close()
+	return imgs,trans,epsg
+
+#-- geotransform of the output prediction of a tile
+def prediction_geotransform(trans):
+	#-- get pixel size
+	x_orig,y_orig = rasterio.transform.xy(trans, 0, 0)
+	x2,y2 = rasterio.transform.xy(trans, 0, 1)
+	x3,y3 = rasterio.transform.xy(trans, 1, 0)
+	dx = np.abs(x2 - x_orig)
+	dy = np.abs(y3 - y_orig)
+	#-- top left x, w-e pixel resolution, rotation
+	#-- top left y, rotation, n-s pixel resolution
+	return [x_orig, dx, 0, y_orig, 0, -dy]
+
+#-- reader thread: read each batch of file names from tasks into out_queue
+def reader(ddir, tasks, out_queue, h, wi, ch):
+	while True:
+		files = tasks.get()
+		if files is None:
+			break
+		try:
+			imgs,trans,epsg = read_batch(ddir, files, h, wi, ch)
+		except Exception:
+			out_queue.put(traceback.format_exc())
+		else:
+			out_queue.put((files,imgs,trans,epsg))
+
+#-- stop the reader threads: drop the batches that are left and empty the
+#-- read queue so that no reader stays blocked on it
+def stop_readers(tasks, read_queue, readers):
+	while True:
+		try:
+			tasks.get_nowait()
+		except queue.Empty:
+			break
+	for t in readers:
+		tasks.put(None)
+	while any(t.is_alive() for t in readers):
+		try:
+			read_queue.get(timeout=0.1)
+		except queue.Empty:
+			pass
+	for t in readers:
+		t.join()
+
+#-- run the model on a list of files with overlapping read, predict and write stages
+#-- errors are raised after the reader and writer threads are shut down
+def run_pipeline(model, ddir, out_dir, files, h, wi, ch, batch_size=8,
+	n_readers=2, n_writers=2, queue_size=4, quantize=False):
+	#-- batches of file names for the readers
+	tasks = queue.Queue()
+	batches = [files[i:i+batch_size] for i in range(0,len(files),batch_size)]
+	for b in batches:
+		tasks.put(b)
+	for i in range(n_readers):
+		tasks.put(None)
+	#-- bounded queues so that only a few batches are held in memory
+	read_queue = queue.Queue(maxsize=queue_size)
+	readers = [threading.Thread(target=reader,args=(ddir,tasks,read_queue,h,wi,ch),daemon=True)
+		for i in range(n_readers)]
+	for t in readers:
+		t.start()
+	#-- geotiffs are compressed and written in background threads
+	writers = geotiff_io.WriterPool(workers=n_writers, max_pending=queue_size*batch_size,
+		quantize=quantize, num_threads=geotiff_io.writer_threads(n_writers))
+	#-- run the model on the batches as they are read
+	count = 0
+	try:
+		for n in range(len(batches)):
+			item = read_queue.get()
+			if not isinstance(item,tuple):
+				raise RuntimeError('Reading batch failed:\n%s'%item)
+			files_batch,imgs,trans,epsg = item
+			out_imgs = model.predict(imgs, batch_size=batch_size)
+			out_imgs = out_imgs.reshape(out_imgs.shape[0],h,wi)
+			for i,f in enumerate(files_batch):
+				out_file = os.path.join(out_dir,os.path.basename(f).replace('coco','pred'))
+				writers.submit(out_file, out_imgs[i], prediction_geotransform(trans[i]), epsg[i])
+			count += len(files_batch)
+			print('predicted {0:d} of {1:d} tiles'.format(count,len(files)))
+	except BaseException:
+		#-- shut down the readers and writers before passing on the error
+		stop_readers(tasks, read_queue, readers)
+		try:
+			writers.close()
+		except RuntimeError as e:
+			print(e)
+		raise
+	#-- wait for all outputs to be written
+	writers.close()
 
 #-- main function
 def main():
 	# print(K.tensorflow_backend._get_available_gpus())
 	print(device_lib.list_local_devices())
 	#-- Read the system arguments listed after the program
-	long_options=['DIR=','DOWN=','INIT=','DROPOUT=','RATIO=','MOD=','NUM=','START=','MODEL_DIR=','RUN_ALL']
-	optlist,arglist = getopt.getopt(sys.argv[1:],'D:W:I:O:R:M:N:S:L:A',long_options)
+	long_options=['DIR=','DOWN=','INIT=','DROPOUT=','RATIO=','MOD=','NUM=','START=','MODEL_DIR=','RUN_ALL',
+		'BATCH=','READERS=','WRITERS=','QUEUE=','FROZEN=','CATALOG=','QUANTIZE']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'D:W:I:O:R:M:N:S:L:AB:F:C:Q',long_options)
 
 	#-- Set default settings
 	ddir = os.path.join(os.path.expanduser('~'),'Google Drive File Stream',\
@@ -40,6 +168,13 @@ def main():
 	num = 500
 	cc = 0
 	run_all = False
+	batch_size = 8
+	n_readers = 2
+	n_writers = 2
+	queue_size = 4
+	frozen_file = None
+	catalog_file = None
+	quantize = False
 	for opt, arg in optlist:
 		if opt in ("-D","--DIR"):
 			ddir = os.path.expanduser(arg)
@@ -62,6 +197,20 @@ def main():
 		elif opt in ("-A","--RUN_ALL"):
 			run_all = True
 			cc = 0
+		elif opt in ("-B","--BATCH"):
+			batch_size = int(arg)
+		elif opt == "--READERS":
+			n_readers = int(arg)
+		elif opt == "--WRITERS":
+			n_writers = int(arg)
+		elif opt == "--QUEUE":
+			queue_size = int(arg)
+		elif opt in ("-F","--FROZEN"):
+			frozen_file = os.path.expanduser(arg)
+		elif opt in ("-C","--CATALOG"):
+			catalog_file = os.path.expanduser(arg)
+		elif opt in ("-Q","--QUANTIZE"):
+			quantize = True
 
 	#-- set up model name
 	if mod_lbl == 'unet':
@@ -75,55 +224,72 @@ def main():
 		sys.exit('model label not matching.')
 
 	#-- Get list of images
-	fileList = os.listdir(ddir)
-	# file_list = sorted([f for f in fileList if ( (f.endswith('DIR00.tif') or f.endswith('DIR11.tif')) and f.startswith('coco') )])
-	file_list = sorted([f for f in fileList if (f.endswith('.tif') and f.startswith('coco'))])
+	if catalog_file is not None:
+		#-- get the tiles and their dimensions from the catalog
+		rows = [r for r in tile_catalog.query(catalog_file, ddir, kind='coco')
+			if r['name'].endswith('.tif')]
+		file_list = [r['name'] for r in rows]
+		h = rows[0]['height']
+		wi = rows[0]['width']
+		ch = 1
+	else:
+		fileList = os.listdir(ddir)
+		# file_list = sorted([f for f in fileList if ( (f.endswith('DIR00.tif') or f.endswith('DIR11.tif')) and f.startswith('coco') )])
+		file_list = sorted([f for f in fileList if (f.endswith('.tif') and f.startswith('coco'))])
+
+		#-- read first file to get dimensions
+		raster = rasterio.open(os.path.join(ddir,file_list[0]))
+		h = raster.height
+		wi = raster.width
+		ch = raster.count
 	N = len(file_list)
 	print(N)
 
-	#-- read first file to get dimensions
-	raster = rasterio.open(os.path.join(ddir,file_list[0]))
-	h = raster.height
-	wi = raster.width
-	ch = raster.count
-
 	print(h,wi,ch)
 
 	#-- set channel to 2 because there are actually real and imaginary components
 	ch = 2
 
-	#-- Import model
-	mod_module = imp.load_source('nn_model',os.path.join(model_dir,'nn_model.py'))
-	#-- set up model
-	if mod_lbl == 'unet':
-		print('loading unet model')
-		model = mod_module.unet_model_double_dropout(height=h,width=wi,\
-			channels=ch,n_init=ninit,n_layers=ndown,drop=dropout_frac)
-	elif mod_lbl == 'atrous':
-		print("loading atrous model")
-		model = mod_module.nn_model_atrous_double_dropout(height=h,\
-			width=wi,channels=ch,n_filts=ninit,drop=dropout_frac)
+	if frozen_file is not None:
+		#-- use the inference-only model from export_model.py
+		print(frozen_file)
+		model = FrozenModel(frozen_file)
+		if (model.info['height'],model.info['width']) != (h,wi):
+			sys.exit('Frozen model was exported for {0:d}x{1:d} tiles.'.format(
+				model.info['height'],model.info['width']))
 	else:
-		print('Model label not correct.')
-
-	#-- define custom loss function
-	def customLoss(yTrue,yPred):
-		return -1*K.mean(ratio*(yTrue*K.log(yPred+1e-32)) + ((1. - yTrue)*K.log(1-yPred+1e-32)))
-
-	#-- compile imported model
-	model.compile(loss=customLoss,optimizer='adam',
-				metrics=['accuracy'])
-
-	#-- checkpoint file
-	chk_file = os.path.join(model_dir,'{0}_weights.h5'.format(mod_str))
-	print(chk_file)
-	#-- if file exists, read model from file
-	if os.path.isfile(chk_file):
-		print('Check point exists; loading model from file.')
-		#-- load weights
-		model.load_weights(chk_file)
-	else:
-		sys.exit('Model does not previously exist.')
+		#-- Import model
+		mod_module = imp.load_source('nn_model',os.path.join(model_dir,'nn_model.py'))
+		#-- set up model
+		if mod_lbl == 'unet':
+			print('loading unet model')
+			model = mod_module.unet_model_double_dropout(height=h,width=wi,\
+				channels=ch,n_init=ninit,n_layers=ndown,drop=dropout_frac)
+		elif mod_lbl == 'atrous':
+			print("loading atrous model")
+			model = mod_module.nn_model_atrous_double_dropout(height=h,\
+				width=wi,channels=ch,n_filts=ninit,drop=dropout_frac)
+		else:
+			print('Model label not correct.')
+
+		#-- define custom loss function
+		def customLoss(yTrue,yPred):
+			return -1*K.mean(ratio*(yTrue*K.log(yPred+1e-32)) + ((1. - yTrue)*K.log(1-yPred+1e-32)))
+
+		#-- compile imported model
+		model.compile(loss=customLoss,optimizer='adam',
+					metrics=['accuracy'])
+
+		#-- checkpoint file
+		chk_file = os.path.join(model_dir,'{0}_weights.h5'.format(mod_str))
+		print(chk_file)
+		#-- if file exists, read model from file
+		if os.path.isfile(chk_file):
+			print('Check point exists; loading model from file.')
+			#-- load weights
+			model.load_weights(chk_file)
+		else:
+			sys.exit('Model does not previously exist.')
 
 	#-------------------------------
 	#-- Run model on data
@@ -140,63 +306,10 @@ def main():
 	print('Running total: ', num)
 	print('start: ', cc)
 	print('N: ', N)
-	while (cc < N):
-		#-- read "num" files at a time
-		print(cc)
-		#-- Read data all at once
-		imgs = np.ones((num,h,wi,ch))
-		trans = [None]*num
-		for i,f in enumerate(file_list[cc:cc+num]):
-			#-- read image
-			raster = rasterio.open(os.path.join(ddir,f))
-			try:
-				imgs[i,:,:,0] = raster.read(1).real
-				imgs[i,:,:,1] = raster.read(1).imag
-			except:
-				print('Skipping %s'%f)
-				imgs[i,:,:,0] = None
-				imgs[i,:,:,1] = None
-			#-- get transformation matrix
-			trans[i] = raster.transform
-			raster.close()
-
-		out_crs = raster.crs.to_epsg()
-		out_imgs = model.predict(imgs, batch_size=1, verbose=1)
-		out_imgs = out_imgs.reshape(out_imgs.shape[0],h,wi,out_imgs.shape[2])
-		
-		#-- save output images
-		for i,f in enumerate(file_list[cc:cc+num]):
-			#-- get pixel size
-			x_orig,y_orig = rasterio.transform.xy(trans[i], 0, 0)
-			x2,y2 = rasterio.transform.xy(trans[i], 0, 1)
-			x3,y3 = rasterio.transform.xy(trans[i], 1, 0)
-			dx = np.abs(x2 - x_orig)
-			dy = np.abs(y3 - y_orig)
-
-			#-- get transformation for output
-			#-- output as geotiff
-			driver = gdal.GetDriverByName("GTiff")
-			#-- set up the dataset with compression options (1 is for band 1)
-			OPTS = ['COMPRESS=LZW'] #['COMPRESS=NONE'] #['COMPRESS=PACKBITS']
-			ds = driver.Create(os.path.join(out_dir,os.path.basename(f).replace('coco','pred')),\
-				h, wi, 1, gdal.GDT_Float32, OPTS)
-			#-- top left x, w-e pixel resolution, rotation
-			#-- top left y, rotation, n-s pixel resolution
-			ds.SetGeoTransform([x_orig, dx, 0, y_orig, 0, -dy])
-			#-- set the reference info
-			srs = osr.SpatialReference()
-			srs.ImportFromEPSG(out_crs)
-			#-- export
-			ds.SetProjection( srs.ExportToWkt() )
-			#-- write to geotiff array
-			ds.GetRasterBand(1).WriteArray(out_imgs[i].reshape(h,wi))
-			ds.FlushCache()
-			ds = None
-			#-- also save as image
-			# im = image.array_to_img(out_imgs[i]) 
-			# im.save(os.path.join(out_dir,os.path.basename(f).replace('coco','pred').replace('tif','png')))
-		#-- increment counter
-		cc += num
+	#-- stream the files through the read, predict and write stages
+	run_pipeline(model, ddir, out_dir, file_list[cc:N], h, wi, ch,
+		batch_size=batch_size, n_readers=n_readers, n_writers=n_writers,
+		queue_size=queue_size, quantize=quantize)
 	#-- print total time
 	end_time = timeit.default_timer()
 	print('Time Elapsed: ', end_time - start_time)  
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+u"""
+skeleton_centerline.py
+
+Centerline of a grounding line uncertainty polygon from the skeleton of
+the rasterized polygon, as a faster alternative to the Voronoi-based
+label_centerlines.get_centerline.
+
+The polygon is rasterized on a grid with the median spacing of its
+vertices (about the pixel size of the prediction the contour was drawn
+from) and skeletonized. The centerline is the longest path through the
+largest connected part of the skeleton, found with two sweeps of
+Dijkstra's algorithm over the 8-connected skeleton pixels.
+"""
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra,connected_components
+from skimage.draw import polygon
+from skimage.morphology import skeletonize
+from shapely.geometry import LineString
+
+#-- neighbours of a pixel that come after it in row-major order
+#-- (row offset, column offset, distance)
+OFFSETS = [(0,1,1.),(1,-1,np.sqrt(2.)),(1,0,1.),(1,1,np.sqrt(2.))]
+
+#-- median distance between consecutive vertices of a polygon
+def vertex_spacing(p):
+	xy = np.asarray(p.exterior.coords)
+	d = np.sqrt(np.sum(np.diff(xy,axis=0)**2,axis=1))
+	d = d[d > 0]
+	return np.median(d) if len(d) else 1.0
+
+#-- rasterize a polygon with a one pixel border around its bounding box
+#-- returns the image and the coordinates of the center of pixel (0,0)
+def rasterize(p, pixel):
+	minx,miny,maxx,maxy = p.bounds
+	nr = int(np.ceil((maxy-miny)/pixel)) + 3
+	nc = int(np.ceil((maxx-minx)/pixel)) + 3
+	x0 = minx - pixel
+	y0 = maxy + pixel
+	xy = np.asarray(p.exterior.coords)
+	r = (y0 - xy[:,1])/pixel
+	c = (xy[:,0] - x0)/pixel
+	img = np.zeros((nr,nc),dtype=bool)
+	rr,cc = polygon(r,c,shape=img.shape)
+	img[rr,cc] = True
+	#-- also draw the outline (sampled at least once per pixel) so narrow
+	#-- parts stay connected
+	nseg = np.ceil(np.hypot(np.diff(r),np.diff(c))).astype(int) + 1
+	k = np.repeat(np.arange(len(nseg)),nseg)
+	f = (np.arange(nseg.sum()) - np.repeat(np.cumsum(nseg)-nseg,nseg)) / \
+		np.repeat(np.maximum(nseg-1,1),nseg)
+	img[np.round(r[k] + f*(r[k+1]-r[k])).astype(int),
+		np.round(c[k] + f*(c[k+1]-c[k])).astype(int)] = True
+	return img,x0,y0
+
+#-- (row,col) indices of the longest path through the largest connected
+#-- part of a skeleton image
+def longest_path(skel):
+	rows,cols = np.nonzero(skel)
+	n = len(rows)
+	if n < 2:
+		return rows,cols
+	node = -np.ones(skel.shape,dtype=np.int64)
+	node[rows,cols] = np.arange(n)
+	#-- edges between neighbouring skeleton pixels
+	src,dst,wgt = [],[],[]
+	for dr,dc,w in OFFSETS:
+		r2 = rows + dr
+		c2 = cols + dc
+		ok, = np.nonzero((r2 < skel.shape[0]) & (c2 >= 0) & (c2 < skel.shape[1]))
+		j = node[r2[ok],c2[ok]]
+		src.append(ok[j >= 0])
+		dst.append(j[j >= 0])
+		wgt.append(np.full(np.count_nonzero(j >= 0),w))
+	graph = coo_matrix((np.concatenate(wgt),(np.concatenate(src),
+		np.concatenate(dst))),shape=(n,n)).tocsr()
+	#-- start from the largest connected part
+	ncomp,labels = connected_components(graph,directed=False)
+	start = np.argmax(labels == np.argmax(np.bincount(labels)))
+	#-- the farthest pixel from the start is one end of the longest path
+	#-- and the farthest pixel from that end is the other end
+	dist = dijkstra(graph,directed=False,indices=start)
+	a = np.argmax(np.where(np.isfinite(dist),dist,-1))
+	dist,pred = dijkstra(graph,directed=False,indices=a,return_predecessors=True)
+	b = np.argmax(np.where(np.isfinite(dist),dist,-1))
+	path = [b]
+	while path[-1] != a:
+		path.append(pred[path[-1]])
+	path = np.array(path[::-1])
+	return rows[path],cols[path]
+
+#-- centerline of a polygon from its skeleton
+#-- pixel is the grid size (median vertex spacing by default)
+def get_skeleton_centerline(p, pixel=None):
+	if pixel is None:
+		pixel = vertex_spacing(p)
+	img,x0,y0 = rasterize(p, pixel)
+	rr,cc = longest_path(skeletonize(img))
+	if len(rr) < 2:
+		raise ValueError('Skeleton has less than 2 pixels')
+	return LineString(np.column_stack((x0 + cc*pixel, y0 - rr*pixel)))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+u"""
+spatial_index.py
+
+Bounding-box index of a list of shapely geometries that returns the
+indices of the candidate geometries, for both shapely 1.7 (where
+STRtree.query returns the geometries) and shapely 2.0 (where it returns
+indices). Missing (None) or empty geometries are skipped.
+
+Besides the envelope queries, the index finds the geometries within a
+distance of a geometry and the closest geometry, with the same results as
+computing the distances to all the geometries.
+"""
+import numpy as np
+from shapely.strtree import STRtree
+from shapely.geometry import box
+
+class GeometryIndex(object):
+	'STRtree of a list of geometries returning list indices'
+	def __init__(self, geoms):
+		self.geoms = list(geoms)
+		self.valid = np.array([i for i,g in enumerate(self.geoms)
+			if (g is not None) and (not g.is_empty)],dtype=np.int64)
+		self.tree = STRtree([self.geoms[i] for i in self.valid]) if len(self.valid) else None
+		#-- shapely 1.7 returns the geometries themselves (the same
+		#-- geometry can be in the list more than once)
+		self._ids = {}
+		for i in self.valid:
+			self._ids.setdefault(id(self.geoms[i]),[]).append(i)
+
+	def __len__(self):
+		return len(self.geoms)
+
+	def _indices(self, res):
+		if len(res) == 0:
+			return np.array([],dtype=np.int64)
+		if isinstance(res[0],(int,np.integer)):
+			return self.valid[np.asarray(res,dtype=np.int64)]
+		ids = set(id(g) for g in res)
+		return np.array([i for g in ids for i in self._ids[g]],dtype=np.int64)
+
+	def query(self, geom):
+		'Sorted indices of the geometries whose envelope intersects the envelope of geom'
+		if self.tree is None:
+			return np.array([],dtype=np.int64)
+		return np.sort(self._indices(self.tree.query(geom)))
+
+	def bounds(self, i):
+		'Bounding box (minx,miny,maxx,maxy) of geometry i'
+		return self.geoms[i].bounds
+
+	def near(self, geom, dist):
+		'Sorted indices of the geometries whose envelope is within dist of the envelope of geom'
+		minx,miny,maxx,maxy = geom.bounds
+		return self.query(box(minx-dist,miny-dist,maxx+dist,maxy+dist))
+
+	def nearest(self, geom):
+		'Index of the closest geometry to geom (the first one for equal distances), -1 if none'
+		if self.tree is None:
+			return -1
+		#-- grow the search box until it has candidates
+		cand = self.query(geom)
+		r = 1.
+		while len(cand) == 0:
+			cand = self.near(geom, r)
+			r *= 2.
+		#-- all geometries as close as the closest candidate are within its distance
+		d = min(self.geoms[j].distance(geom) for j in cand)
+		cand = self.near(geom, d*(1.+1e-9)+1e-9)
+		dist = np.array([self.geoms[j].distance(geom) for j in cand])
+		return int(cand[np.argmin(dist)])
@@ -3,25 +3,150 @@ u"""
 stitch_tile.py
 
 Stitch tiles together before postprcessing.
+
+Each scene is stitched strip by strip: only the tiles overlapping the
+current strip of rows are held in memory, the weighted sum and the
+normalization (the sum of the kernel weights of the tiles) are
+accumulated in float32 for that strip only, and the finished strip is
+written to a tiled GeoTIFF in the background (geotiff_io.py, optionally
+quantized to uint8 with --QUANTIZE). Scenes can be stitched in parallel with
+--NPROC.
+
+With --CATALOG the tiles and their offsets are taken from a tile catalog
+(tile_catalog.py) instead of listing the directory.
 """
 import os
 import sys
 import getopt
+import functools
+import multiprocessing
 import numpy as np
-from osgeo import gdal,osr
 # import imageio
 import rasterio
+import tile_catalog
+import geotiff_io
+
+#-- read a tile as float32 with nan elements set to 0
+def read_tile(tile_file):
+	try:
+		raster = rasterio.open(tile_file,'r')
+	except:
+		print('could not read ',tile_file)
+		return None
+	tile_in = geotiff_io.read_band(raster).astype(np.float32)
+	raster.close()
+	#-- set nan elements to 0
+	tile_in[np.isnan(tile_in)] = 0.0
+	return tile_in
+
+#-- stitch the tiles of one scene into a geotiff
+#-- tiles is a list of (x0,y0,file) and kernel_weight the weight of each tile pixel
+def stitch_scene(dinsar_to_stitch, tiles, path_stitched='', kernel_weight=None,
+	quantize=False, num_threads='ALL_CPUS'):
+	ny_tile,nx_tile = kernel_weight.shape
+	kernel_weight = kernel_weight.astype(np.float32)
+	#-- sort tiles by row so they can be dropped once the strips are past them
+	tiles = sorted(tiles, key=lambda t: (t[1],t[0]))
+	list_x0 = np.array([t[0] for t in tiles],dtype=np.int64)
+	list_y0 = np.array([t[1] for t in tiles],dtype=np.int64)
+	list_tile_to_stitch = [t[2] for t in tiles]
+	numtiles = len(tiles)
+
+	#-- determine the output tile size
+	nx_out=list_x0.max()+nx_tile
+	ny_out=list_y0.max()+ny_tile
+
+	#-- get the georeferencing from the first readable tile
+	for i,tile_to_stitch in enumerate(list_tile_to_stitch):
+		try:
+			raster = rasterio.open(tile_to_stitch,'r')
+		except:
+			continue
+		trans = raster.transform
+		out_crs = raster.crs.to_epsg()
+		raster.close()
+		break
+	else:
+		print('could not read any tiles of ',dinsar_to_stitch)
+		return dinsar_to_stitch
+
+	#-- get pixel size
+	x1,y1 = rasterio.transform.xy(trans, 0, 0)
+	x2,y2 = rasterio.transform.xy(trans, 0, 1)
+	x3,y3 = rasterio.transform.xy(trans, 1, 0)
+	dx = np.abs(x2 - x1)
+	dy = np.abs(y3 - y1)
+	#-- Now find the coordinates of the upper left corner of scene based on total size
+	#-- note the x1,y1 refers to position list_x0[i],list_y0[i]
+	x_orig = x1 - (dx*list_x0[i]) - dx/2
+	y_orig = y1 + (dy*list_y0[i]) + dy/2
+	# y_orig = y1 - (dy*list_y0[i]) + dy/2 #- temporary fix for problem in metadata in current data
+
+	#-- get transformation for output
+	#-- output as tiled geotiff written strip by strip in the background
+	#-- top left x, w-e pixel resolution, rotation
+	#-- top left y, rotation, n-s pixel resolution
+	out = geotiff_io.StripWriter(os.path.join(path_stitched,'%s.tif'%dinsar_to_stitch),
+		nx_out, ny_out, [x_orig, dx, 0, y_orig, 0, -dy], out_crs, quantize=quantize,
+		num_threads=num_threads)
+
+	#-- loop through strips of one tile height
+	active = {}
+	nxt = 0
+	for ys in range(0,ny_out,ny_tile):
+		ye = min(ys+ny_tile,ny_out)
+		#-- drop tiles above the strip
+		for i in [i for i in active if list_y0[i]+ny_tile <= ys]:
+			del(active[i])
+		#-- read tiles starting in the strip (weighted by the kernel)
+		while (nxt < numtiles) and (list_y0[nxt] < ye):
+			tile_in = read_tile(list_tile_to_stitch[nxt])
+			if tile_in is not None:
+				active[nxt] = tile_in*kernel_weight
+			nxt += 1
+		#-- sum of tiles and weights for the strip
+		arr_sum = np.zeros((ye-ys,nx_out),dtype=np.float32)
+		arr_weight = np.zeros((ye-ys,nx_out),dtype=np.float32)
+		for i,tile_in in active.items():
+			r0 = max(ys,list_y0[i]) - list_y0[i]
+			r1 = min(ye,list_y0[i]+ny_tile) - list_y0[i]
+			s0 = list_y0[i] + r0 - ys
+			s1 = list_y0[i] + r1 - ys
+			arr_sum[s0:s1,list_x0[i]:list_x0[i]+nx_tile] += tile_in[r0:r1]
+			arr_weight[s0:s1,list_x0[i]:list_x0[i]+nx_tile] += kernel_weight[r0:r1]
+
+		#-- noramlize
+		with np.errstate(invalid='ignore',divide='ignore'):
+			arr_out = arr_sum/arr_weight
+		#-- nan values from division by 0 are set to 0 (no tile coverage)
+		arr_out[np.isnan(arr_out)] = 0.0
+		arr_out[arr_out < 0] = 0.0
+		#-- write strip to geotiff
+		out.write(arr_out, ys)
+	out.close()
+	return dinsar_to_stitch
+
+#-- stitch one (scene name, list of (x0,y0,file)) item
+def stitch_tile_list(item, path_stitched='', kernel_weight=None, quantize=False,
+	num_threads='ALL_CPUS'):
+	dinsar_to_stitch,tiles = item
+	print(dinsar_to_stitch,'- # tiles:',len(tiles))
+	return stitch_scene(dinsar_to_stitch, tiles, path_stitched=path_stitched,
+		kernel_weight=kernel_weight, quantize=quantize, num_threads=num_threads)
 
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['DIR=','KERNEL=','noFLAG']
-	optlist,arglist = getopt.getopt(sys.argv[1:],'D:K:F',long_options)
+	long_options=['DIR=','KERNEL=','noFLAG','NPROC=','CATALOG=','QUANTIZE']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'D:K:FP:C:Q',long_options)
 
 	#-- Set default settings
 	ddir = os.path.expanduser('~/GL_learning_data/S1_Pope-Smith-Kohler/UNUSED/coco_PSK-UNUSED_with_null/atrous_32init_drop0.2_customLossR727.dir')
 	flag_gaussian_weight = True
 	sigma_kernel = 0.05
+	nproc = 1
+	catalog_file = None
+	quantize = False
 	for opt, arg in optlist:
 		if opt in ("-D","--DIR"):
 			ddir = os.path.expanduser(arg)
@@ -30,11 +155,22 @@ def main():
 		elif opt in ("-F","--noFLAG"):
 			flag_gaussian_weight = False
 			print('Not using Gaussian kernel.')
+		elif opt in ("-P","--NPROC"):
+			nproc = int(arg)
+		elif opt in ("-C","--CATALOG"):
+			catalog_file = os.path.expanduser(arg)
+		elif opt in ("-Q","--QUANTIZE"):
+			quantize = True
 
 	#-- Get list of geotiff label files
 	print(ddir)
-	fileList = os.listdir(ddir)
-	pred_list = [os.path.join(ddir,f) for f in fileList if (f.endswith('.tif') and f.startswith('pred'))]
+	if catalog_file is not None:
+		rows = [r for r in tile_catalog.query(catalog_file, ddir, kind='pred')
+			if r['name'].endswith('.tif')]
+		pred_list = [tile_catalog.row_path(r) for r in rows]
+	else:
+		fileList = os.listdir(ddir)
+		pred_list = [os.path.join(ddir,f) for f in fileList if (f.endswith('.tif') and f.startswith('pred'))]
 
 	#-- output directory
 	path_stitched = os.path.join(ddir,'stitched.dir')
@@ -43,11 +179,14 @@ def main():
 		os.mkdir(path_stitched)
 
 	#-- read first file to get dimensions
-	raster = rasterio.open(pred_list[0],'r')
-	nx_tile = raster.width
-	ny_tile = raster.height
-	out_crs = raster.crs.to_epsg()
-	raster.close()
+	if catalog_file is not None:
+		nx_tile = rows[0]['width']
+		ny_tile = rows[0]['height']
+	else:
+		raster = rasterio.open(pred_list[0],'r')
+		nx_tile = raster.width
+		ny_tile = raster.height
+		raster.close()
 
 	#-- buid the kernel
 	if flag_gaussian_weight:
@@ -62,97 +201,37 @@ def main():
 		kernel_weight = np.ones((ny_tile,nx_tile))
 
 	#-- make a dictionary of all tiles that belong together
+	#-- with the (x0,y0) offsets and file name of each tile
 	tdict = {}
 	print('Identifying the tiles and source DInSAR names...')
-	for tilename in pred_list:
-		name_dinsar = os.path.basename(tilename).split('pred_')[1].split('_x')[0]
-		if not name_dinsar in tdict.keys():
-			tdict[name_dinsar] = [tilename]
-		else:
-			tdict[name_dinsar].append(tilename)
-	#-- get list of all the scenes (keys of dict)
-	list_dinsar_src = list(tdict.keys())
-	print('Done!')
-
-	for dinsar_to_stitch in list_dinsar_src:
-		print(dinsar_to_stitch,'- # tiles:',len(tdict[dinsar_to_stitch]))
-		list_tile_to_stitch = tdict[dinsar_to_stitch]
-		numtiles = len(list_tile_to_stitch)
-		list_x0 = np.zeros(numtiles,dtype=np.int32)
-		list_y0 = np.zeros(numtiles,dtype=np.int32)
-		for i,tile_to_stitch in enumerate(list_tile_to_stitch):
-			list_x0[i]=int(tile_to_stitch.split('_x')[1].split('_y')[0])
-			list_y0[i]=int(tile_to_stitch.split('_y')[1].split('_DIR')[0])
-		
-		#-- determine the output tile size
-		nx_out=list_x0.max()+nx_tile
-		ny_out=list_y0.max()+ny_tile
-
-		#-- initialize sum of tiles and weights
-		arr_sum=np.zeros((ny_out,nx_out))
-		arr_weight=np.zeros((ny_out,nx_out))
-		#-- loop through tiles and adding to larger scene array
-		trans = {}
-		for i,tile_to_stitch in enumerate(list_tile_to_stitch):
-			try:
-				raster = rasterio.open(tile_to_stitch,'r')
-			except:
-				print('could not read ',tile_to_stitch)
+	if catalog_file is not None:
+		for name_dinsar,scene_rows in tile_catalog.group_scenes(rows).items():
+			tdict[name_dinsar] = [(r['x0'],r['y0'],tile_catalog.row_path(r)) for r in scene_rows]
+	else:
+		for tilename in pred_list:
+			name_dinsar = os.path.basename(tilename).split('pred_')[1].split('_x')[0]
+			x0 = int(tilename.split('_x')[1].split('_y')[0])
+			y0 = int(tilename.split('_y')[1].split('_DIR')[0])
+			if not name_dinsar in tdict.keys():
+				tdict[name_dinsar] = [(x0,y0,tilename)]
 			else:
-				tile_in = raster.read(1).astype(float)
-				#-- get transformation matrix
-				trans[i] = raster.transform
-				#-- set nan elements to 0
-				tile_in[np.isnan(tile_in)] = 0.0
-
-				arr_sum[list_y0[i]:list_y0[i]+ny_tile,list_x0[i]:list_x0[i]+nx_tile] += tile_in*kernel_weight
-				arr_weight[list_y0[i]:list_y0[i]+ny_tile,list_x0[i]:list_x0[i]+nx_tile] += kernel_weight
-
-				raster.close()
-
-		#-- noramlize
-		arr_out = arr_sum/arr_weight
+				tdict[name_dinsar].append((x0,y0,tilename))
+	print('Done!')
 
-		#-- nan values from division by 0 are set to 0 (no tile coverage)
-		arr_out[np.isnan(arr_out)] = 0.0
-		arr_out[arr_out < 0] = 0.0
+	#-- stitch scenes, optionally in parallel (sharing the compression threads)
+	func = functools.partial(stitch_tile_list, path_stitched=path_stitched,
+		kernel_weight=kernel_weight, quantize=quantize,
+		num_threads=geotiff_io.writer_threads(nproc))
+	if nproc > 1:
+		pool = multiprocessing.Pool(processes=nproc)
+		for dinsar in pool.imap_unordered(func, tdict.items()):
+			print('Done stitching ',dinsar)
+		pool.close()
+		pool.join()
+	else:
+		for dinsar in map(func, tdict.items()):
+			print('Done stitching ',dinsar)
 
-		#-- get pixel size
-		x1,y1 = rasterio.transform.xy(trans[i], 0, 0)
-		x2,y2 = rasterio.transform.xy(trans[i], 0, 1)
-		x3,y3 = rasterio.transform.xy(trans[i], 1, 0)
-		dx = np.abs(x2 - x1)
-		dy = np.abs(y3 - y1)
-		#-- Now find the coordinates of the upper left corner of scene based on total size
-		#-- note the x1,y1 refers to position list_x0[i],list_y0[i]
-		x_orig = x1 - (dx*list_x0[i]) - dx/2
-		y_orig = y1 + (dy*list_y0[i]) + dy/2
-		# y_orig = y1 - (dy*list_y0[i]) + dy/2 #- temporary fix for problem in metadata in current data
-
-		#-- get transformation for output
-		#-- output as geotiff
-		driver = gdal.GetDriverByName("GTiff")
-		#-- set up the dataset with compression options (1 is for band 1)
-		OPTS = ['COMPRESS=LZW']
-		ds = driver.Create(os.path.join(path_stitched,'%s.tif'%dinsar_to_stitch), \
-			int(nx_out), int(ny_out), 1, gdal.GDT_Float32, OPTS)
-		#-- top left x, w-e pixel resolution, rotation
-		#-- top left y, rotation, n-s pixel resolution
-		ds.SetGeoTransform([x_orig, dx, 0, y_orig, 0, -dy])
-		#-- set the reference info
-		srs = osr.SpatialReference()
-		srs.ImportFromEPSG(out_crs)
-		#-- export
-		ds.SetProjection( srs.ExportToWkt() )
-		#-- write to geotiff array
-		ds.GetRasterBand(1).WriteArray(arr_out)
-		ds.FlushCache()
-		ds = None
-		
-		#-- also save image for reference
-		# outfile = os.path.join(path_stitched,'%s.png'%dinsar_to_stitch)
-		# imageio.imsave(outfile,(arr_out*255).astype(np.ubyte))
-		
 #-- run main program
 if __name__ == '__main__':
 	main()
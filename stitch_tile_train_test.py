@@ -6,6 +6,9 @@ Stitch tiles together before postprcessing.
 This script is specifically for the mixed train/test data used
 to initially train the data. For tests on other generic data
 use `stitch_tile.py`
+
+With --CATALOG the tiles, offsets and georeferencing are taken from a
+tile catalog (tile_catalog.py) instead of listing the directories.
 """
 import os
 import sys
@@ -14,6 +17,7 @@ import numpy as np
 from osgeo import gdal,osr
 import imageio
 import rasterio
+import tile_catalog
 import matplotlib.pyplot as plt
 
 #-- directory setup
@@ -24,8 +28,8 @@ ddir = os.path.expanduser('~/GL_learning_data/geocoded_v1')
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['DIR=','NX=','NY=','KERNEL=','noFLAG']
-	optlist,arglist = getopt.getopt(sys.argv[1:],'D:X:Y:K:F',long_options)
+	long_options=['DIR=','NX=','NY=','KERNEL=','noFLAG','CATALOG=']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'D:X:Y:K:FC:',long_options)
 
 	#-- Set default settings
 	subdir = 'atrous_32init_drop0.2_customLossR727.dir'
@@ -33,6 +37,7 @@ def main():
 	ny_tile = 512
 	flag_gaussian_weight = True
 	sigma_kernel = 0.05
+	catalog_file = None
 	for opt, arg in optlist:
 		if opt in ("-D","--DIR"):
 			subdir = arg
@@ -44,19 +49,37 @@ def main():
 			sigma_kernel = float(arg)
 		elif opt in ("-F","--noFLAG"):
 			flag_gaussian_weight = False
+		elif opt in ("-C","--CATALOG"):
+			catalog_file = os.path.expanduser(arg)
 
 	#-- Get list of geotiff label files
 	lbl_dir = os.path.join(gdrive,'delineationtile_withoutnull_v1')
-	fileList = os.listdir(lbl_dir)
-	lbl_list = [f for f in fileList if (f.endswith('.tif') and f.startswith('delineation'))]
+	if catalog_file is not None:
+		#-- catalog records of the labels (for the georeferencing)
+		lbl_rows = {r['name']:r for r in tile_catalog.query(catalog_file, lbl_dir,
+			kind='delineation') if r['name'].endswith('.tif')}
+		lbl_list = list(lbl_rows.keys())
+	else:
+		fileList = os.listdir(lbl_dir)
+		lbl_list = [f for f in fileList if (f.endswith('.tif') and f.startswith('delineation'))]
 	
 	#-- Get list of prediction files
 	pred_list = {}
+	offsets = {}
 	for t in ['Train','Test']:
 		pred_dir = os.path.join(ddir,'%s_predictions.dir'%t,subdir)
-		fileList = os.listdir(pred_dir)
-		pred_list[t] = [os.path.join(pred_dir,f) for f in fileList \
-			if (f.endswith('.npy') and f.startswith('pred'))]
+		if catalog_file is not None:
+			rows = [r for r in tile_catalog.query(catalog_file, pred_dir, kind='pred',
+				subset=t) if r['name'].endswith('.npy')]
+			if len(rows) == 0:
+				sys.exit('No {0} prediction tiles in the catalog for {1}'.format(t,pred_dir))
+			pred_list[t] = [tile_catalog.row_path(r) for r in rows]
+			offsets.update({tile_catalog.row_path(r):(r['x0'],r['y0']) for r in rows})
+		else:
+			fileList = os.listdir(pred_dir)
+			pred_list[t] = [os.path.join(pred_dir,f) for f in fileList \
+				if (f.endswith('.npy') and f.startswith('pred'))]
+	test_set = set(pred_list['Test'])
 	#-- combine test and train dataset and add the whole path
 	list_tile = pred_list['Train'] + pred_list['Test']
 
@@ -98,8 +121,11 @@ def main():
 		list_x0 = np.zeros(numtiles,dtype=np.int32)
 		list_y0 = np.zeros(numtiles,dtype=np.int32)
 		for i,tile_to_stitch in enumerate(list_tile_to_stitch):
-			list_x0[i]=int(tile_to_stitch.split('_x')[1].split('_y')[0])
-			list_y0[i]=int(tile_to_stitch.split('_y')[1].split('_DIR')[0])
+			if catalog_file is not None:
+				list_x0[i],list_y0[i] = offsets[tile_to_stitch]
+			else:
+				list_x0[i]=int(tile_to_stitch.split('_x')[1].split('_y')[0])
+				list_y0[i]=int(tile_to_stitch.split('_y')[1].split('_DIR')[0])
 		
 		#-- determine the output tile size
 		nx_out=list_x0.max()+nx_tile
@@ -117,7 +143,7 @@ def main():
 			arr_sum[list_y0[i]:list_y0[i]+ny_tile,list_x0[i]:list_x0[i]+nx_tile] += tile_in.astype(np.float)*kernel_weight
 			arr_weight[list_y0[i]:list_y0[i]+ny_tile,list_x0[i]:list_x0[i]+nx_tile] += kernel_weight
 			#-- if tile is from test data set mask to 1
-			if tile_to_stitch in pred_list['Test']:
+			if tile_to_stitch in test_set:
 				arr_mask[list_y0[i]:list_y0[i]+ny_tile,list_x0[i]:list_x0[i]+nx_tile] = 1
 
 		#-- noramlize
@@ -129,12 +155,18 @@ def main():
 		#-- read the geotiff corresponding to the last tile to get geocoding
 		#-- find the corresponding geotif file
 		#-- first find the index of the corresponding file
-		file_ind = lbl_list.index(os.path.basename(tile_to_stitch).replace('pred','delineation').replace('.npy','.tif'))
-		raster = rasterio.open(os.path.join(gdrive,'delineationtile_withoutnull_v1',lbl_list[file_ind]),'r')
-		#-- get transformation matrix
-		trans = raster.transform
-		out_crs = raster.crs.to_epsg()
-		raster.close()
+		lbl_name = os.path.basename(tile_to_stitch).replace('pred','delineation').replace('.npy','.tif')
+		if catalog_file is not None:
+			#-- get transformation matrix from the catalog
+			trans = rasterio.Affine.from_gdal(*tile_catalog.row_geotransform(lbl_rows[lbl_name]))
+			out_crs = lbl_rows[lbl_name]['epsg']
+		else:
+			file_ind = lbl_list.index(lbl_name)
+			raster = rasterio.open(os.path.join(gdrive,'delineationtile_withoutnull_v1',lbl_list[file_ind]),'r')
+			#-- get transformation matrix
+			trans = raster.transform
+			out_crs = raster.crs.to_epsg()
+			raster.close()
 		#-- get pixel size
 		x1,y1 = rasterio.transform.xy(trans, 0, 0)
 		x2,y2 = rasterio.transform.xy(trans, 0, 1)
@@ -4,6 +4,7 @@ test_model.py
 Yara Mohajerani (Last update 07/2020)
 
 Write History
+	11/2020	add --FROZEN option for models exported with export_model.py
 	06/2020	add user inputs
 			save output as npy files
 	05/2020 Written
@@ -18,6 +19,7 @@ import matplotlib.pyplot as plt
 import keras
 from keras import backend as K
 from keras.preprocessing import image
+from export_model import FrozenModel
 
 ninit = 16 #number of channels to start with
 dropout_frac = 0.2 # dropout fraction
@@ -25,7 +27,7 @@ dropout_frac = 0.2 # dropout fraction
 #-- main function
 def main():
 	#-- Read the system arguments listed after the program
-	long_options=['MOD=','DOWN=','INIT=','DROPOUT=','NTEST=','RATIO=','FORMAT=']
+	long_options=['MOD=','DOWN=','INIT=','DROPOUT=','NTEST=','RATIO=','FORMAT=','FROZEN=']
 	optlist,arglist = getopt.getopt(sys.argv[1:],'M:D:I:O:N:R:F:',long_options)
 
 	#-- Set default settings
@@ -36,6 +38,7 @@ def main():
 	n_test = 500
 	ratio = 727 # penalization ratio for GL and non-GL points based on smaller dataaset
 	out_form = 'npy'
+	frozen_file = None
 	for opt, arg in optlist:
 		if opt in ("-M","--MOD"):
 			mod_lbl = arg
@@ -51,6 +54,8 @@ def main():
 			ratio = int(arg)
 		elif opt in ("-F","--FORMAT"):
 			out_form = arg
+		elif opt == "--FROZEN":
+			frozen_file = os.path.expanduser(arg)
 
 	#-- make model string
 	if mod_lbl == 'unet':
@@ -92,47 +97,52 @@ def main():
 	h,wi,ch = im.shape
 	print(h,wi,ch)
 
-	#-- Import model
-	mod_module = imp.load_source('nn_model',os.path.join(colabdir,'nn_model.py'))
-	#-- set up model
-	if mod_lbl == 'unet':
-		print('loading unet model')
-		model = mod_module.unet_model_double_dropout(height=h,width=wi,channels=ch, 
-													n_init=ninit,n_layers=ndown,
-													drop=dropout_frac)
-	elif mod_lbl == 'atrous':
-		print("loading atrous model")
-		model = mod_module.nn_model_atrous_double_dropout(height=h,width=wi,
-															channels=ch,
-															n_filts=ninit,
-															drop=dropout_frac)
-	elif mod_lbl == 'atrous_noPool':
-		print("loading atrous_noPool model")
-		model = mod_module.nn_model_atrous_noPool(height=h,width=wi,
-													channels=ch,
-													n_filts=ninit,
-													drop=dropout_frac)
+	if frozen_file is not None:
+		#-- use the inference-only model from export_model.py
+		print(frozen_file)
+		model = FrozenModel(frozen_file)
 	else:
-		sys.exit('Model label not correct.')
+		#-- Import model
+		mod_module = imp.load_source('nn_model',os.path.join(colabdir,'nn_model.py'))
+		#-- set up model
+		if mod_lbl == 'unet':
+			print('loading unet model')
+			model = mod_module.unet_model_double_dropout(height=h,width=wi,channels=ch, 
+														n_init=ninit,n_layers=ndown,
+														drop=dropout_frac)
+		elif mod_lbl == 'atrous':
+			print("loading atrous model")
+			model = mod_module.nn_model_atrous_double_dropout(height=h,width=wi,
+																channels=ch,
+																n_filts=ninit,
+																drop=dropout_frac)
+		elif mod_lbl == 'atrous_noPool':
+			print("loading atrous_noPool model")
+			model = mod_module.nn_model_atrous_noPool(height=h,width=wi,
+														channels=ch,
+														n_filts=ninit,
+														drop=dropout_frac)
+		else:
+			sys.exit('Model label not correct.')
 
-	#-- define custom loss function
-	def customLoss(yTrue,yPred):
-		return -1*K.mean(ratio*(yTrue*K.log(yPred+1e-32)) + ((1. - yTrue)*K.log(1-yPred+1e-32)))
+		#-- define custom loss function
+		def customLoss(yTrue,yPred):
+			return -1*K.mean(ratio*(yTrue*K.log(yPred+1e-32)) + ((1. - yTrue)*K.log(1-yPred+1e-32)))
 	
-	#-- compile imported model
-	model.compile(loss=customLoss,optimizer='adam',
-					metrics=['accuracy'])
+		#-- compile imported model
+		model.compile(loss=customLoss,optimizer='adam',
+						metrics=['accuracy'])
 
-	#-- checkpoint file
-	chk_file = os.path.join(mod_dir,'{0}_weights.h5'.format(mod_str))
-	print(chk_file)
-	#-- if file exists, read model from file
-	if os.path.isfile(chk_file):
-		print('Check point exists; loading model from file.')
-		#-- load weights
-		model.load_weights(chk_file)
-	else:
-		sys.exit('Model does not exist.')
+		#-- checkpoint file
+		chk_file = os.path.join(mod_dir,'{0}_weights.h5'.format(mod_str))
+		print(chk_file)
+		#-- if file exists, read model from file
+		if os.path.isfile(chk_file):
+			print('Check point exists; loading model from file.')
+			#-- load weights
+			model.load_weights(chk_file)
+		else:
+			sys.exit('Model does not exist.')
 
 	#-------------------------------
 	#-- Run on train and test data
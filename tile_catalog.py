@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+u"""
+tile_catalog.py
+
+Persistent SQLite catalog of tiles and scenes, so the processing steps
+don't have to list large directories and parse the file names every run.
+
+Every file is recorded with its directory, kind (coco, pred, delineation,
+scene or mask), source DInSAR scene, x0/y0 offsets and DIR code, size,
+geotransform, EPSG code and train/test subset. The subset is taken from
+--SUBSET or else from the name of the directory (or of a parent directory)
+such as Train_predictions.dir or test_n50.dir. The offsets are parsed
+from the file name and the rest is read from the file header once, when
+the file is first added to the catalog. The modification time of each
+directory is also kept, and a directory is scanned again when it is
+queried after files have been added to or removed from it.
+
+Usage:
+	python tile_catalog.py --CATALOG=<file> [--SUBSET=Train|Test] [--UPDATE] <dir> ...
+
+Where --UPDATE only reads the files that are new or changed since the
+directory was catalogued. Files that no longer exist are removed from the
+catalog. Directories that are not in the catalog yet are added
+automatically the first time they are queried.
+"""
+import os
+import sys
+import getopt
+import sqlite3
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+#-- columns of the tile table
+COLUMNS = ['dir','name','kind','scene','x0','y0','dir_code','width','height',
+	'gt0','gt1','gt2','gt3','gt4','gt5','epsg','subset','mtime','size']
+
+#-- prefixes of tile file names
+TILE_KINDS = ['coco','pred','delineation']
+
+#-- normalized directory name used as key in the catalog
+def catalog_dir(directory):
+	return os.path.abspath(os.path.expanduser(directory)).rstrip('/')
+
+#-- train/test subset from the name of a directory or one of its parents
+#-- (e.g. Train_predictions.dir/<model> or test_n50.dir), None if unknown
+def directory_subset(directory):
+	for part in reversed(catalog_dir(directory).split(os.sep)):
+		if not part.endswith('.dir'):
+			continue
+		if part.lower().startswith('train'):
+			return 'Train'
+		elif part.lower().startswith('test'):
+			return 'Test'
+	return None
+
+#-- kind, scene, x0, y0 and DIR code from a file name
+#-- tiles are named <kind>_<scene>_x<x0>_y<y0>_DIR<code>
+def parse_tile_name(name):
+	base = os.path.splitext(name)[0]
+	kind,_,rest = base.partition('_')
+	if kind in TILE_KINDS:
+		try:
+			x0 = int(rest.split('_x')[1].split('_y')[0])
+			y0 = int(rest.split('_y')[1].split('_DIR')[0])
+		except (ValueError,IndexError):
+			return kind,rest,None,None,None
+		dir_code = rest.split('_DIR')[1] if ('_DIR' in rest) else None
+		return kind,rest.split('_x')[0],x0,y0,dir_code
+	if base.endswith('_mask'):
+		return 'mask',base[:-len('_mask')],None,None,None
+	return 'scene',base,None,None,None
+
+#-- read the size and georeferencing of a file
+def read_header(path):
+	if path.endswith('.npy'):
+		shape = np.load(path,mmap_mode='r').shape
+		return shape[1],shape[0],[None]*6,None
+	import rasterio
+	raster = rasterio.open(path,'r')
+	width,height = raster.width,raster.height
+	gt = list(raster.transform.to_gdal())
+	epsg = raster.crs.to_epsg() if raster.crs else None
+	raster.close()
+	return width,height,gt,epsg
+
+#-- open (and create if needed) a catalog
+def connect(catalog_file):
+	conn = sqlite3.connect(catalog_file)
+	conn.row_factory = sqlite3.Row
+	conn.execute('CREATE TABLE IF NOT EXISTS tiles (dir TEXT, name TEXT, kind TEXT, '
+		'scene TEXT, x0 INTEGER, y0 INTEGER, dir_code TEXT, width INTEGER, '
+		'height INTEGER, gt0 REAL, gt1 REAL, gt2 REAL, gt3 REAL, gt4 REAL, gt5 REAL, '
+		'epsg INTEGER, subset TEXT, mtime REAL, size INTEGER, PRIMARY KEY (dir,name))')
+	conn.execute('CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, mtime REAL)')
+	#-- catalogs from before the directory times were kept
+	if 'mtime' not in [r['name'] for r in conn.execute('PRAGMA table_info(dirs)')]:
+		conn.execute('ALTER TABLE dirs ADD COLUMN mtime REAL')
+	conn.execute('CREATE INDEX IF NOT EXISTS tiles_scene ON tiles (dir,kind,scene)')
+	return conn
+
+#-- catalog record of one file
+def make_record(directory, name, subset=None):
+	path = os.path.join(directory,name)
+	st = os.stat(path)
+	kind,scene,x0,y0,dir_code = parse_tile_name(name)
+	try:
+		width,height,gt,epsg = read_header(path)
+	except Exception:
+		print('could not read header of ',path)
+		width,height,gt,epsg = None,None,[None]*6,None
+	return (directory,name,kind,scene,x0,y0,dir_code,width,height,*gt,epsg,
+		subset,st.st_mtime,st.st_size)
+
+#-- set the subset of the files of a directory that were catalogued
+#-- before their subset was known
+def set_subset(conn, directory, subset):
+	if subset is not None:
+		conn.execute('UPDATE tiles SET subset=? WHERE dir=? AND subset IS NULL',
+			(subset,directory))
+
+#-- add the .tif and .npy files of a directory to the catalog
+#-- and remove the files that are no longer in the directory
+#-- headers are read in parallel threads since this is mostly waiting on I/O
+def add_directory(conn, directory, subset=None, update=False, nthreads=8):
+	directory = catalog_dir(directory)
+	if subset is None:
+		subset = directory_subset(directory)
+	#-- directory time before the listing, so that files added while
+	#-- scanning give a new scan at the next query
+	dir_mtime = os.stat(directory).st_mtime
+	known = {r['name']:(r['mtime'],r['size']) for r in
+		conn.execute('SELECT name,mtime,size FROM tiles WHERE dir=?',(directory,))}
+	names = []
+	present = set()
+	for entry in os.scandir(directory):
+		if not entry.name.endswith(('.tif','.npy')):
+			continue
+		present.add(entry.name)
+		if update and (entry.name in known):
+			st = entry.stat()
+			if known[entry.name] == (st.st_mtime,st.st_size):
+				continue
+		names.append(entry.name)
+	pool = ThreadPool(processes=nthreads)
+	records = pool.map(lambda n: make_record(directory,n,subset=subset), names)
+	pool.close()
+	pool.join()
+	removed = [(directory,n) for n in known.keys() if n not in present]
+	conn.executemany('DELETE FROM tiles WHERE dir=? AND name=?', removed)
+	set_subset(conn, directory, subset)
+	conn.executemany('INSERT OR REPLACE INTO tiles VALUES ({0})'.format(
+		','.join(['?']*len(COLUMNS))), records)
+	conn.execute('INSERT OR REPLACE INTO dirs VALUES (?,?)',(directory,dir_mtime))
+	conn.commit()
+	print('{0:d} files added to and {1:d} removed from catalog for {2}'.format(
+		len(records),len(removed),directory))
+	return len(records)
+
+#-- query the files of a directory (which is catalogued first if needed,
+#-- and scanned again if files were added or removed since)
+#-- returns a list of sqlite3.Row objects (accessed like dicts) sorted by name
+def query(catalog_file, directory, kind=None, subset=None, scene=None):
+	directory = catalog_dir(directory)
+	conn = connect(catalog_file)
+	row = conn.execute('SELECT mtime FROM dirs WHERE dir=?',(directory,)).fetchone()
+	if row is None:
+		add_directory(conn, directory, subset=subset)
+	elif row['mtime'] != os.stat(directory).st_mtime:
+		add_directory(conn, directory, subset=subset, update=True)
+	else:
+		set_subset(conn, directory, subset if (subset is not None) else
+			directory_subset(directory))
+		conn.commit()
+	sql = 'SELECT * FROM tiles WHERE dir=?'
+	args = [directory]
+	for col,val in [('kind',kind),('subset',subset),('scene',scene)]:
+		if val is not None:
+			sql += ' AND {0}=?'.format(col)
+			args.append(val)
+	rows = conn.execute(sql+' ORDER BY name',args).fetchall()
+	conn.close()
+	return rows
+
+#-- group tiles by their source scene
+def group_scenes(rows):
+	scenes = {}
+	for r in rows:
+		scenes.setdefault(r['scene'],[]).append(r)
+	return scenes
+
+#-- full path of a catalog record
+def row_path(r):
+	return os.path.join(r['dir'],r['name'])
+
+#-- gdal geotransform of a catalog record
+def row_geotransform(r):
+	return [r['gt%i'%i] for i in range(6)]
+
+#-- main function
+def main():
+	#-- Read the system arguments listed after the program
+	long_options=['CATALOG=','SUBSET=','UPDATE']
+	optlist,arglist = getopt.getopt(sys.argv[1:],'C:S:U',long_options)
+
+	#-- Set default settings
+	catalog_file = 'tiles.sqlite'
+	subset = None
+	update = False
+	for opt, arg in optlist:
+		if opt in ("-C","--CATALOG"):
+			catalog_file = os.path.expanduser(arg)
+		elif opt in ("-S","--SUBSET"):
+			subset = arg
+		elif opt in ("-U","--UPDATE"):
+			update = True
+
+	conn = connect(catalog_file)
+	for d in arglist:
+		add_directory(conn, d, subset=subset, update=update)
+	conn.close()
+
+#-- run main program
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+u"""
+tile_shards.py
+
+Packed training shards as an alternative to one .npy file per tile.
+
+Each shard holds the images of a block of tiles as a single float32
+array (n,h,w,2) and the labels as bit-packed uint8 rows (n,ceil(h*w/8)),
+both saved in .npy format so they can be opened with np.memmap.
+A JSON index maps every tile name to its shard and row.
+"""
+import os
+import json
+import numpy as np
+
+#-- name of the index file in each shard directory
+INDEX = 'index.json'
+
+#-- file names of the image and label arrays of shard k
+def shard_files(k):
+	return 'images_%03i.npy'%k,'labels_%03i.npy'%k
+
+#-- create (or reuse) the index of a shard directory
+#-- tiles is a list of lists with the names of all copies of each tile
+#-- (i.e. the augmented versions), so all copies end up in the same shard
+#-- returns the index and whether it was newly created
+def create_index(out_dir, tiles, dim=(512,512), n_channels=2, shard_size=500):
+	index_file = os.path.join(out_dir,INDEX)
+	names = [n for copies in tiles for n in copies]
+	if os.path.exists(index_file):
+		with open(index_file,'r') as fid:
+			index = json.load(fid)
+		#-- only reuse the index if it describes the same set of tiles
+		if (index['shard_size'] == shard_size) and ([t[0] for t in index['tiles']] == names):
+			return index,False
+	index = {'dim':list(dim),'n_channels':n_channels,'shard_size':shard_size,
+		'shards':[],'tiles':[]}
+	for k,s in enumerate(range(0,len(tiles),shard_size)):
+		img_file,lbl_file = shard_files(k)
+		row = 0
+		for copies in tiles[s:s+shard_size]:
+			for n in copies:
+				index['tiles'].append([n,k,row])
+				row += 1
+		index['shards'].append({'images':img_file,'labels':lbl_file,'n':row})
+	with open(index_file,'w') as fid:
+		json.dump(index,fid)
+	return index,True
+
+#-- open the arrays of shard k for writing
+def open_shard(out_dir, index, k):
+	h,w = index['dim']
+	shard = index['shards'][k]
+	images = np.lib.format.open_memmap(os.path.join(out_dir,shard['images']),
+		mode='w+',dtype=np.float32,shape=(shard['n'],h,w,index['n_channels']))
+	labels = np.lib.format.open_memmap(os.path.join(out_dir,shard['labels']),
+		mode='w+',dtype=np.uint8,shape=(shard['n'],(h*w+7)//8))
+	return images,labels
+
+#-- bit-pack a (h,w) label tile into a single row
+def pack_label(lbl):
+	return np.packbits(np.ravel(lbl) > 0)
+
+#-- read batches of tiles from a shard directory through np.memmap
+class ShardReader(object):
+	'Reads tiles and labels from packed shards'
+	def __init__(self, shard_dir):
+		self.shard_dir = shard_dir
+		with open(os.path.join(shard_dir,INDEX),'r') as fid:
+			index = json.load(fid)
+		self.dim = tuple(index['dim'])
+		self.n_channels = index['n_channels']
+		self.shards = index['shards']
+		self.names = [t[0] for t in index['tiles']]
+		self.lookup = {t[0]:(t[1],t[2]) for t in index['tiles']}
+		self._images = {}
+		self._labels = {}
+
+	def __len__(self):
+		return len(self.names)
+
+	def __getstate__(self):
+		#-- don't copy the memory-mapped arrays into worker processes
+		state = self.__dict__.copy()
+		state['_images'] = {}
+		state['_labels'] = {}
+		return state
+
+	def images(self, k):
+		'Memory-mapped image array of shard k'
+		if k not in self._images:
+			self._images[k] = np.load(os.path.join(self.shard_dir,
+				self.shards[k]['images']),mmap_mode='r')
+		return self._images[k]
+
+	def labels(self, k):
+		'Memory-mapped packed label array of shard k'
+		if k not in self._labels:
+			self._labels[k] = np.load(os.path.join(self.shard_dir,
+				self.shards[k]['labels']),mmap_mode='r')
+		return self._labels[k]
+
+	def locate(self, names):
+		'Shard and row numbers of a list of tile names'
+		loc = np.array([self.lookup[n] for n in names],dtype=np.int64).reshape(-1,2)
+		return loc[:,0],loc[:,1]
+
+	def read_images(self, names, out):
+		'Fill out[i] with the image of names[i]'
+		shard,row = self.locate(names)
+		for k in np.unique(shard):
+			ii, = np.nonzero(shard == k)
+			out[ii] = self.images(k)[row[ii]]
+		return out
+
+	def read_labels(self, names, out):
+		'Fill out[i] with the flattened (h*w,1) label of names[i]'
+		npix = self.dim[0]*self.dim[1]
+		shard,row = self.locate(names)
+		for k in np.unique(shard):
+			ii, = np.nonzero(shard == k)
+			bits = np.unpackbits(self.labels(k)[row[ii]],axis=1)[:,:npix]
+			out[ii] = bits.reshape(len(ii),npix,1)
+		return out
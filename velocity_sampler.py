@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+u"""
+velocity_sampler.py
+
+Sample a gridded ice velocity field (x, y, VX, VY in a netCDF file) at a
+set of points for calc_gz.py, calc_gz_hybrid.py and hydrostatic_gz.py.
+
+Only the coordinate axes are read when the sampler is created. The VX and
+VY grids are read lazily, and only in a window around the points that are
+sampled (plus a margin of grid cells); the window is kept and only read
+again if later points fall outside of it. The grid points closest to each
+sample point are found with index arithmetic on the regular grid axes
+(checking the neighbouring grid points, so the result is the same as
+searching the whole axis), and all lookups are vectorized over the
+sample points. Velocities can also be bilinearly interpolated.
+"""
+import numpy as np
+import netCDF4 as nc
+
+class VelocitySampler(object):
+	'Windowed, cached reads of a velocity field on a regular grid'
+	def __init__(self, VEL_FILE, margin=8):
+		self.filename = VEL_FILE
+		self.margin = margin
+		fid = nc.Dataset(VEL_FILE,'r')
+		self.x = fid['x'][:]
+		self.y = fid['y'][:]
+		fid.close()
+		#-- origin and spacing of the grid axes
+		self.x0,self.dx = float(self.x[0]),float(self.x[1]-self.x[0])
+		self.y0,self.dy = float(self.y[0]),float(self.y[1]-self.y[0])
+		#-- window of the grid that has been read (rows j0:j1, columns i0:i1)
+		self.window = None
+		self.vx = None
+		self.vy = None
+
+	def _read(self, i0, i1, j0, j1):
+		fid = nc.Dataset(self.filename,'r')
+		self.vx = fid['VX'][j0:j1,i0:i1]
+		self.vy = fid['VY'][j0:j1,i0:i1]
+		fid.close()
+		self.window = (i0,i1,j0,j1)
+
+	def load(self, ii, jj):
+		'Read the window of VX and VY that contains the grid indices ii, jj'
+		i0 = max(int(np.min(ii))-self.margin,0)
+		i1 = min(int(np.max(ii))+self.margin+1,len(self.x))
+		j0 = max(int(np.min(jj))-self.margin,0)
+		j1 = min(int(np.max(jj))+self.margin+1,len(self.y))
+		if self.window is not None:
+			wi0,wi1,wj0,wj1 = self.window
+			if (i0 >= wi0) and (i1 <= wi1) and (j0 >= wj0) and (j1 <= wj1):
+				return
+			#-- also keep the previous window
+			i0,i1,j0,j1 = min(i0,wi0),max(i1,wi1),min(j0,wj0),max(j1,wj1)
+		self._read(i0, i1, j0, j1)
+
+	@staticmethod
+	def _closest(axis, origin, step, v, k):
+		#-- candidate indices around the index from the grid spacing
+		#-- (shifted to stay inside the axis at its ends)
+		n = min(2*k+1,len(axis))
+		c = np.round((np.asarray(v,dtype=float) - origin)/step).astype(np.int64)
+		c = np.clip(c-k,0,len(axis)-n)[:,None] + np.arange(n)[None,:]
+		d = np.abs(np.asarray(axis)[c] - np.asarray(v,dtype=float)[:,None])
+		order = np.argsort(d,axis=1,kind='mergesort')[:,:k]
+		return np.take_along_axis(c,order,axis=1)
+
+	def neighbours(self, xi, yi, k=5):
+		'Indices of the k closest grid columns to xi and rows to yi, closest first'
+		ii = self._closest(self.x, self.x0, self.dx, np.atleast_1d(xi), k)
+		jj = self._closest(self.y, self.y0, self.dy, np.atleast_1d(yi), k)
+		return ii,jj
+
+	def nearest(self, xi, yi):
+		'Indices of the closest grid column to xi and row to yi'
+		ii,jj = self.neighbours(xi, yi, k=1)
+		return ii[:,0],jj[:,0]
+
+	def velocity(self, ii, jj):
+		'VX and VY at grid rows jj and columns ii (arrays of the same shape)'
+		if np.size(ii) == 0:
+			shape = np.broadcast(ii,jj).shape
+			return np.ma.zeros(shape),np.ma.zeros(shape)
+		self.load(ii, jj)
+		i0,i1,j0,j1 = self.window
+		return self.vx[jj-j0,ii-i0],self.vy[jj-j0,ii-i0]
+
+	def bilinear(self, xi, yi):
+		'Bilinearly interpolated VX and VY at xi, yi'
+		fx = (np.atleast_1d(xi).astype(float) - self.x0)/self.dx
+		fy = (np.atleast_1d(yi).astype(float) - self.y0)/self.dy
+		i = np.clip(np.floor(fx).astype(np.int64),0,len(self.x)-2)
+		j = np.clip(np.floor(fy).astype(np.int64),0,len(self.y)-2)
+		t = fx - i
+		u = fy - j
+		vx00,vy00 = self.velocity(i,j)
+		vx10,vy10 = self.velocity(i+1,j)
+		vx01,vy01 = self.velocity(i,j+1)
+		vx11,vy11 = self.velocity(i+1,j+1)
+		vx = (1-t)*(1-u)*vx00 + t*(1-u)*vx10 + (1-t)*u*vx01 + t*u*vx11
+		vy = (1-t)*(1-u)*vy00 + t*(1-u)*vy10 + (1-t)*u*vy01 + t*u*vy11
+		return vx,vy
+
+#-- flow angle from the velocity components
+def flow_angle(vx, vy):
+	return np.arctan(vy/vx)